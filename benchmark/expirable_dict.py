@@ -0,0 +1,141 @@
+# ExpirableDict 基准测试
+#
+# 对比 common.struct.ExpirableDict 与旧实现的读写、遍历耗时，以及持续写入短期键时的内存占用
+# 用法: python benchmark/expirable_dict.py --keys 100000 --iter-keys 5000
+
+import argparse
+import importlib.util
+import random
+import time
+from pathlib import Path
+from typing import Callable, Generic, Optional, TypeVar
+
+_STRUCT_PATH = Path(__file__).parents[1] / "common" / "struct.py"
+_spec = importlib.util.spec_from_file_location("struct_module", _STRUCT_PATH)
+assert _spec and _spec.loader
+struct_module = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(struct_module)
+ExpirableDict = struct_module.ExpirableDict
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class LegacyExpirableDict(Generic[K, V]):
+    """旧实现，只保留基准测试用到的方法"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.__data: dict[K, V] = {}
+        self.__expiry: dict[K, int] = {}
+
+    def set(self, key: K, value: V, ttl: Optional[int] = None) -> None:
+        self.__data[key] = value
+        if ttl is not None:
+            expiry_time = int(time.time()) + ttl
+            self.__expiry[key] = expiry_time
+
+    def get(self, key: K) -> Optional[V]:
+        if self.__expiry.get(key) is None:
+            return self.__data.get(key)
+        if int(time.time()) > self.__expiry[key]:
+            del self.__data[key]
+            del self.__expiry[key]
+        return self.__data.get(key)
+
+    def exists(self, key: K) -> bool:
+        return self.get(key) is not None
+
+    def __iter__(self):
+        self.__index = 0
+        return self
+
+    def __next__(self) -> K:
+        keys = self.keys()
+        if self.__index < len(keys):
+            result = keys[self.__index]
+            self.__index += 1
+            return result
+        else:
+            raise StopIteration
+
+    def keys(self) -> list[K]:
+        return [k for k in [*self.__data.keys()] if self.exists(k)]
+
+    def items(self) -> list[tuple[K, V]]:
+        return [(k, v) for k, v in [*self.__data.items()] if self.exists(k)]
+
+    def stored(self) -> int:
+        return len(self.__data)
+
+
+def stored(d) -> int:
+    """实际保存的键数，包括已过期但尚未清除的键"""
+    return d.stored() if isinstance(d, LegacyExpirableDict) else len(d._data)
+
+
+def timed(func: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    func()
+    return (time.perf_counter() - start) * 1000
+
+
+class FakeClock:
+    """替换 time.time，用于模拟键过期"""
+
+    def __init__(self) -> None:
+        self.now = time.time()
+        self.original = time.time
+
+    def __enter__(self):
+        time.time = lambda: self.now
+        return self
+
+    def __exit__(self, *_):
+        time.time = self.original
+
+
+def bench(factory: Callable[[], object], keys: int, iter_keys: int, rounds: int) -> dict[str, float]:
+    result: dict[str, float] = {}
+    rng = random.Random(0)
+    d = factory()
+    result["set_ms"] = timed(lambda: [d.set(i, str(i), 3600) for i in range(keys)])
+    lookups = [rng.randrange(keys) for _ in range(keys)]
+    result["get_ms"] = timed(lambda: [d.get(i) for i in lookups])
+    result["items_ms"] = timed(d.items)
+    small = factory()
+    for i in range(iter_keys):
+        small.set(i, str(i), 3600)
+    result["iter_ms"] = timed(lambda: [k for k in small])
+    # 每轮写入一批 1 秒后过期的新键，之后只读取其中一个键
+    with FakeClock() as clock:
+        churn = factory()
+        for r in range(rounds):
+            for i in range(1000):
+                churn.set((r, i), "v", 1)
+            clock.now += 2
+            churn.get((r, 0))
+        result["stored"] = stored(churn)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ExpirableDict 基准测试")
+    parser.add_argument("--keys", type=int, default=100000)
+    parser.add_argument("--iter-keys", type=int, default=5000, help="逐个遍历测试的键数，旧实现为 O(n²)")
+    parser.add_argument("--rounds", type=int, default=100, help="过期测试的轮数，每轮写入 1000 个键")
+    args = parser.parse_args()
+
+    print(f"keys={args.keys} iter_keys={args.iter_keys} rounds={args.rounds}")
+    print(f"{'impl':<10}{'set(ms)':>10}{'get(ms)':>10}{'items(ms)':>11}{'iter(ms)':>10}{'stored':>10}")
+    factories = [("legacy", lambda: LegacyExpirableDict("bench")), ("current", lambda: ExpirableDict("bench"))]
+    for name, factory in factories:
+        r = bench(factory, args.keys, args.iter_keys, args.rounds)
+        print(
+            f"{name:<10}{r['set_ms']:>10.1f}{r['get_ms']:>10.1f}{r['items_ms']:>11.1f}"
+            f"{r['iter_ms']:>10.1f}{r['stored']:>10.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
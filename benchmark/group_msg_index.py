@@ -0,0 +1,154 @@
+# 群消息表索引基准测试
+#
+# 使用 sqlite3 生成与 people_like_groupmsg 相同结构的数据，分别在创建索引前后统计热点查询的耗时与查询计划
+# 用法: python benchmark/group_msg_index.py --rows 1000000 --repeat 50
+
+import argparse
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+TABLE = "people_like_groupmsg"
+
+INDEXES = [
+    f"CREATE INDEX ix_people_like_groupmsg_group_id_time ON {TABLE} (group_id, time)",
+    f"CREATE INDEX ix_people_like_groupmsg_message_id ON {TABLE} (message_id)",
+    f"CREATE INDEX ix_people_like_groupmsg_group_id_user_id_time ON {TABLE} (group_id, user_id, time)",
+]
+
+
+def seed(conn: sqlite3.Connection, rows: int, groups: int, users: int, days: int, seed: int = 0):
+    """生成消息数据，时间均匀分布在最近 days 天内"""
+    conn.execute(
+        f"""CREATE TABLE {TABLE} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            message_id INTEGER,
+            group_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            self_msg BOOLEAN NOT NULL,
+            to_me BOOLEAN NOT NULL,
+            "index" INTEGER NOT NULL,
+            nick_name VARCHAR NOT NULL,
+            content VARCHAR NOT NULL,
+            file_id VARCHAR,
+            time INTEGER NOT NULL
+        )"""
+    )
+    rng = random.Random(seed)
+    now = int(time.time())
+    start = now - days * 24 * 60 * 60
+    batch = []
+    for i in range(rows):
+        batch.append(
+            (
+                None if rng.random() < 0.02 else i + 1,
+                rng.randrange(groups),
+                rng.randrange(users),
+                rng.random() < 0.1,
+                rng.random() < 0.05,
+                0,
+                "nick",
+                "content" * rng.randint(1, 5),
+                None,
+                start + i * (now - start) // rows,
+            )
+        )
+        if len(batch) >= 10000:
+            conn.executemany(f"INSERT INTO {TABLE} VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany(f"INSERT INTO {TABLE} VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+    conn.commit()
+
+
+def make_queries(rows: int, groups: int, users: int, days: int) -> dict[str, tuple[str, callable]]:
+    """与插件中的查询对应，参数每次随机生成"""
+    now = int(time.time())
+    rng = random.Random(1)
+    return {
+        "chat_with_gemini 上下文": (
+            f"SELECT * FROM {TABLE} WHERE group_id = ? ORDER BY time DESC LIMIT 40",
+            lambda: (rng.randrange(groups),),
+        ),
+        "check_should_reply 计数": (
+            f"SELECT count(*) FROM {TABLE} WHERE group_id = ? AND time > "
+            f"(SELECT time FROM {TABLE} WHERE message_id = ? LIMIT 1)",
+            lambda: (rng.randrange(groups), rows - rng.randrange(1000)),
+        ),
+        "check_should_reply 原消息": (
+            f"SELECT * FROM {TABLE} WHERE message_id = ?",
+            lambda: (rng.randrange(rows),),
+        ),
+        "get_group_history 群组": (
+            f"SELECT * FROM {TABLE} WHERE group_id = ? AND time >= ? AND time <= ? ORDER BY time ASC",
+            lambda: (rng.randrange(groups), (t := now - rng.randrange(days) * 86400), t + 86400),
+        ),
+        "get_group_history 用户": (
+            f"SELECT * FROM {TABLE} WHERE group_id = ? AND user_id = ? AND time >= ? AND time <= ? ORDER BY time ASC",
+            lambda: (rng.randrange(groups), rng.randrange(users), (t := now - rng.randrange(days) * 86400), t + 86400),
+        ),
+        "remove_old_msg 计数": (
+            f"SELECT count(*) FROM {TABLE} WHERE time < ?",
+            lambda: (now - 7 * 86400,),
+        ),
+    }
+
+
+def run(conn: sqlite3.Connection, queries: dict, repeat: int) -> dict[str, tuple[float, float, str]]:
+    """返回各查询的中位数、p95 耗时（毫秒）与查询计划"""
+    results = {}
+    for name, (sql, params) in queries.items():
+        plan = "; ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params()))
+        timings = []
+        for _ in range(repeat):
+            args = params()
+            start = time.perf_counter()
+            conn.execute(sql, args).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results[name] = (statistics.median(timings), timings[max(int(len(timings) * 0.95) - 1, 0)], plan)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="群消息表索引基准测试")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--db", type=str, default="", help="sqlite 数据库文件，默认使用临时目录")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(args.db or str(Path(tmp) / "bench.db"))
+        start = time.perf_counter()
+        seed(conn, args.rows, args.groups, args.users, args.days)
+        print(f"生成{args.rows}条数据，用时{time.perf_counter() - start:.1f}秒")
+        queries = make_queries(args.rows, args.groups, args.users, args.days)
+
+        before = run(conn, queries, args.repeat)
+        start = time.perf_counter()
+        for sql in INDEXES:
+            conn.execute(sql)
+        conn.commit()
+        conn.execute("ANALYZE")
+        print(f"创建索引用时{time.perf_counter() - start:.1f}秒")
+        after = run(conn, queries, args.repeat)
+        conn.close()
+
+    print(f"{'查询':<28}{'索引前p50':>12}{'索引前p95':>12}{'索引后p50':>12}{'索引后p95':>12}")
+    for name in queries:
+        b50, b95, _ = before[name]
+        a50, a95, _ = after[name]
+        print(f"{name:<28}{b50:>11.2f}ms{b95:>11.2f}ms{a50:>11.2f}ms{a95:>11.2f}ms")
+    print()
+    for name in queries:
+        print(f"{name}\n  索引前：{before[name][2]}\n  索引后：{after[name][2]}")
+
+
+if __name__ == "__main__":
+    main()
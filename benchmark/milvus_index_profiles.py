@@ -0,0 +1,110 @@
+# 图片向量索引召回率与延迟基准测试
+#
+# 使用 Milvus Lite 本地实例，对各索引配置构建相同数据的集合，统计 recall@k 与搜索延迟
+# 用法: python benchmark/milvus_index_profiles.py --rows 20000 --queries 200
+# Milvus Lite 不支持的索引类型会被跳过
+
+import argparse
+import importlib.util
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from pymilvus import DataType, MilvusClient
+
+_PROFILE_PATH = Path(__file__).parents[1] / "direct_plugins" / "people_like" / "index_profile.py"
+_spec = importlib.util.spec_from_file_location("index_profile", _PROFILE_PATH)
+assert _spec and _spec.loader
+index_profile = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(index_profile)
+
+DIM = 768
+
+
+def make_vectors(rows: int, queries: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """生成带聚类结构的向量，更接近真实的描述向量分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(rows // 100, 1), DIM)).astype(np.float32)
+    data = centers[rng.integers(0, len(centers), rows)] + rng.normal(scale=0.3, size=(rows, DIM)).astype(np.float32)
+    query = centers[rng.integers(0, len(centers), queries)] + rng.normal(scale=0.3, size=(queries, DIM)).astype(
+        np.float32
+    )
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    query /= np.linalg.norm(query, axis=1, keepdims=True)
+    return data, query
+
+
+def ground_truth(data: np.ndarray, query: np.ndarray, k: int) -> list[set[int]]:
+    """暴力计算余弦相似度 top k"""
+    scores = query @ data.T
+    top = np.argpartition(-scores, k, axis=1)[:, :k]
+    return [set(row.tolist()) for row in top]
+
+
+def bench_profile(client: MilvusClient, profile, data: np.ndarray, query: np.ndarray, truth: list[set[int]], k: int):
+    name = f"bench_{profile.index_type.lower()}"
+    if client.has_collection(name):
+        client.drop_collection(name)
+    schema = client.create_schema(auto_id=False, enable_dynamic_field=False)
+    schema.add_field("id", DataType.INT64, is_primary=True)
+    schema.add_field("vec", DataType.FLOAT_VECTOR, dim=DIM)
+    index_params = client.prepare_index_params()
+    index_params.add_index(
+        field_name="vec", index_type=profile.index_type, metric_type="COSINE", params=profile.index_params()
+    )
+    client.create_collection(collection_name=name, schema=schema, index_params=index_params)
+
+    build_start = time.perf_counter()
+    for start in range(0, len(data), 1000):
+        batch = data[start : start + 1000]
+        client.insert(name, [{"id": start + i, "vec": vec.tolist()} for i, vec in enumerate(batch)])
+    client.flush(name)
+    client.load_collection(name)
+    build_seconds = time.perf_counter() - build_start
+
+    latencies = []
+    hits = 0
+    for vec, expected in zip(query, truth):
+        start = time.perf_counter()
+        result = client.search(name, data=[vec.tolist()], limit=k, search_params=profile.search_params())
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len({item["id"] for item in result[0]} & expected)
+    client.drop_collection(name)
+    latencies.sort()
+    return {
+        "build_s": build_seconds,
+        "recall": hits / (len(truth) * k),
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片向量索引基准测试")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--db", type=str, default="", help="Milvus Lite 数据库文件，默认使用临时目录")
+    args = parser.parse_args()
+
+    data, query = make_vectors(args.rows, args.queries)
+    truth = ground_truth(data, query, args.k)
+    with tempfile.TemporaryDirectory() as tmp:
+        client = MilvusClient(args.db or str(Path(tmp) / "bench.db"))
+        print(f"rows={args.rows} queries={args.queries} k={args.k}")
+        print(f"{'index':<10}{'build(s)':>10}{'recall':>10}{'p50(ms)':>10}{'p95(ms)':>10}")
+        for index_type in index_profile.INDEX_TYPES:
+            profile = index_profile.IndexProfile(index_type=index_type)
+            try:
+                r = bench_profile(client, profile, data, query, truth, args.k)
+            except Exception as e:
+                print(f"{index_type:<10}skipped: {e}")
+                continue
+            print(f"{index_type:<10}{r['build_s']:>10.2f}{r['recall']:>10.3f}{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}")
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
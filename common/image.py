@@ -0,0 +1,135 @@
+from io import BytesIO
+from typing import Literal, Optional
+
+from PIL import Image, ImageChops, ImageSequence, ImageStat, features
+
+PREPARED_FORMAT = "WEBP" if features.check("webp") else "JPEG"
+"""预处理后的图片格式，Pillow 不支持 WEBP 时使用 JPEG"""
+
+PREPARED_MIME_TYPE = f"image/{PREPARED_FORMAT.lower()}"
+
+PREPARED_SUFFIX = PREPARED_FORMAT.lower()
+
+_PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+_MAGIC_NUMBERS = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+
+def sniff_mime_type(data: bytes) -> Optional[str]:
+    """根据文件头判断图片的 mime 类型，无法识别时返回 None"""
+    for magic, mime_type in _MAGIC_NUMBERS:
+        if data.startswith(magic):
+            return mime_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def prepare_image(data: bytes, max_side: int, quality: int = 85) -> tuple[bytes, str, bool]:
+    """缩放并重新编码图片
+
+    尺寸不超过 max_side 且格式可直接使用的图片原样返回，GIF 等其他格式取第一帧重新编码
+
+    Args:
+        data (bytes): 图片内容
+        max_side (int): 最长边像素数
+        quality (int): 编码质量
+
+    Returns:
+        tuple[bytes, str, bool]: 图片内容、mime 类型、是否经过重新编码
+    """
+    with Image.open(BytesIO(data)) as image:
+        image_format = image.format or ""
+        if image_format in _PASSTHROUGH_FORMATS and max(image.size) <= max_side:
+            return data, _PASSTHROUGH_FORMATS[image_format], False
+        image.seek(0)
+        frame = image.copy()
+    frame.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    has_alpha = frame.mode in ("RGBA", "LA") or (frame.mode == "P" and "transparency" in frame.info)
+    if PREPARED_FORMAT == "WEBP":
+        frame = frame.convert("RGBA" if has_alpha else "RGB")
+    else:
+        frame = frame.convert("RGB")
+    output = BytesIO()
+    frame.save(output, format=PREPARED_FORMAT, quality=quality)
+    return output.getvalue(), PREPARED_MIME_TYPE, True
+
+
+def _sample_even(count: int, sample: int) -> list[int]:
+    """均匀选取 sample 帧"""
+    if sample <= 0 or count <= sample:
+        return list(range(count))
+    if sample == 1:
+        return [0]
+    return sorted({round(i * (count - 1) / (sample - 1)) for i in range(sample)})
+
+
+def _sample_scene(diffs: list[float], sample: int) -> list[int]:
+    """选取首帧以及与前一帧差异最大的 sample - 1 帧"""
+    count = len(diffs)
+    if sample <= 0 or count <= sample:
+        return list(range(count))
+    ranked = sorted(range(1, count), key=lambda i: diffs[i], reverse=True)
+    return sorted([0, *ranked[: sample - 1]])
+
+
+def _composed_frames(gif: Image.Image):
+    """依次叠加 GIF 各帧，返回完整画面"""
+    gif.seek(0)
+    canvas = Image.new("RGBA", gif.size, (0, 0, 0, 0))
+    for i, frame in enumerate(ImageSequence.Iterator(gif)):
+        canvas = Image.alpha_composite(canvas, frame.convert("RGBA"))
+        yield i, canvas
+
+
+def extract_gif_frames(
+    data: bytes,
+    sample: int = 0,
+    mode: Literal["even", "scene"] = "even",
+    max_side: int = 1024,
+    quality: int = 85,
+) -> list[bytes]:
+    """拆分 GIF 动画并编码为 JPEG，结果保存在内存中
+
+    计算量较大，应在进程池中调用
+
+    Args:
+        data (bytes): GIF 内容
+        sample (int): 选取的帧数，0 表示全部帧
+        mode (Literal["even", "scene"]): even 为均匀选取，scene 为选取画面变化最大的帧
+        max_side (int): 最长边像素数
+        quality (int): 编码质量
+
+    Returns:
+        list[bytes]: 按播放顺序排列的帧
+    """
+    frames = []
+    with Image.open(BytesIO(data)) as gif:
+        count = getattr(gif, "n_frames", 1)
+        if mode == "scene" and 0 < sample < count:
+            # 第一遍只计算缩略灰度图的平均像素差，衡量画面变化
+            diffs = []
+            previous = None
+            for _, canvas in _composed_frames(gif):
+                thumb = canvas.convert("L").resize((32, 32))
+                diffs.append(
+                    0.0 if previous is None else ImageStat.Stat(ImageChops.difference(thumb, previous)).mean[0]
+                )
+                previous = thumb
+            selected = set(_sample_scene(diffs, sample))
+        else:
+            selected = set(_sample_even(count, sample))
+        for i, canvas in _composed_frames(gif):
+            if i not in selected:
+                continue
+            rgb = canvas.convert("RGB")
+            rgb.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            output = BytesIO()
+            rgb.save(output, format="JPEG", quality=quality)
+            frames.append(output.getvalue())
+    return frames
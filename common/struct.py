@@ -1,5 +1,9 @@
+import asyncio
+import heapq
+import itertools
 import time
-from typing import Optional, Generic, TypeVar
+from collections import OrderedDict
+from typing import Hashable, Iterator, Optional, Generic, TypeVar
 
 # 创建类型变量
 K = TypeVar("K")
@@ -7,40 +11,79 @@ V = TypeVar("V")
 
 
 class ExpirableDict(Generic[K, V]):
-    def __init__(self, name: str) -> None:
+    """带过期时间的字典
+
+    过期时间保存在最小堆中，每次读写时从堆顶清除已过期的键，每个键只会被清除一次；
+    指定 max_size 时超出数量按最近访问顺序淘汰
+    """
+
+    __slots__ = ("name", "max_size", "evictions", "expirations", "_data", "_expiry", "_heap", "_seq")
+
+    def __init__(self, name: str, max_size: Optional[int] = None) -> None:
         self.name = name
-        self.__data: dict[K, V] = {}
-        self.__expiry: dict[K, int] = {}
+        self.max_size = max_size
+        self.evictions = 0
+        """因超出数量被淘汰的键数"""
+        self.expirations = 0
+        """因过期被清除的键数"""
+        self._data: OrderedDict[K, V] = OrderedDict()
+        self._expiry: dict[K, int] = {}
+        self._heap: list[tuple[int, int, K]] = []
+        self._seq = itertools.count()
+
+    def purge(self) -> int:
+        """清除所有已过期的键，返回清除数量"""
+        now = int(time.time())
+        heap = self._heap
+        removed = 0
+        while heap and heap[0][0] < now:
+            expiry, _, key = heapq.heappop(heap)
+            # 键被重新设置过期时间或已删除时，堆中的记录已失效
+            if self._expiry.get(key) == expiry:
+                del self._expiry[key]
+                self._data.pop(key, None)
+                removed += 1
+        self.expirations += removed
+        return removed
+
+    def _push(self, key: K, expiry: int):
+        self._expiry[key] = expiry
+        heapq.heappush(self._heap, (expiry, next(self._seq), key))
+        # 失效记录过多时重建堆
+        if len(self._heap) > 2 * len(self._expiry) + 64:
+            self._heap = [(expiry, next(self._seq), key) for key, expiry in self._expiry.items()]
+            heapq.heapify(self._heap)
 
     def set(self, key: K, value: V, ttl: Optional[int] = None) -> None:
-        self.__data[key] = value
+        self.purge()
+        self._data[key] = value
         # 如果有设置过期时间，则更新过期时间
         if ttl is not None:
-            expiry_time = int(time.time()) + ttl
-            self.__expiry[key] = expiry_time
+            self._push(key, int(time.time()) + ttl)
+        if self.max_size is not None:
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                evicted, _ = self._data.popitem(last=False)
+                self._expiry.pop(evicted, None)
+                self.evictions += 1
 
     def get(self, key: K) -> Optional[V]:
-        # 如果没有设置过期时间，则直接返回值
-        if self.__expiry.get(key) is None:
-            return self.__data.get(key)
-        # 如果有过期时间，且已过期，则删除
-        if int(time.time()) > self.__expiry[key]:
-            del self.__data[key]
-            del self.__expiry[key]
-        return self.__data.get(key)
+        self.purge()
+        value = self._data.get(key)
+        if value is not None and self.max_size is not None:
+            self._data.move_to_end(key)
+        return value
 
     def delete(self, key: K) -> None:
-        if key in self.__data:
-            del self.__data[key]
-        if key in self.__expiry:
-            del self.__expiry[key]
+        self._data.pop(key, None)
+        self._expiry.pop(key, None)
 
     def ttl(self, key: K) -> int:
         # 键对应的值不存在
-        if self.__data.get(key) is None:
+        if self.get(key) is None:
             return -2
         # 键没有设置过期时间
-        if (expiry := self.__expiry.get(key)) is None:
+        if (expiry := self._expiry.get(key)) is None:
             return -1
         # 键已过期
         if (ttl := expiry - int(time.time())) <= 0:
@@ -51,72 +94,186 @@ class ExpirableDict(Generic[K, V]):
     def exists(self, key: K) -> bool:
         return self.get(key) is not None
 
-    def __add__(self, other: "ExpirableDict[K,V]") -> "ExpirableDict[K,V]":
-        result = ExpirableDict[K, V](name=self.name)
-        result.__data = {k: v for k, v in self.__data.items()}
-        result.__expiry = {k: v for k, v in self.__expiry.items()}
-
-        for key, value in other.__data.items():
-            if key not in result.__data:
-                result.__data[key] = value
-
-        for key, value in other.__expiry.items():
-            if key not in result.__expiry:
-                result.__expiry[key] = value
+    def _copy(self) -> "ExpirableDict[K,V]":
+        result = ExpirableDict[K, V](name=self.name, max_size=self.max_size)
+        result._data = OrderedDict(self._data)
+        for key, expiry in self._expiry.items():
+            result._push(key, expiry)
+        return result
 
+    def __add__(self, other: "ExpirableDict[K,V]") -> "ExpirableDict[K,V]":
+        self.purge()
+        other.purge()
+        result = self._copy()
+        for key, value in other._data.items():
+            if key not in result._data:
+                result._data[key] = value
+                if (expiry := other._expiry.get(key)) is not None:
+                    result._push(key, expiry)
         return result
 
     def __sub__(self, other: "ExpirableDict[K,V]") -> "ExpirableDict[K,V]":
-        result = ExpirableDict[K, V](name=self.name)
-        result.__data = {k: v for k, v in self.__data.items()}
-        result.__expiry = {k: v for k, v in self.__expiry.items()}
-
-        for key, _ in other.__data.items():
-            if key in result.__data:
-                del result.__data[key]
-            if key in result.__expiry:
-                del result.__expiry[key]
-
+        self.purge()
+        other.purge()
+        result = self._copy()
+        for key in other._data:
+            result.delete(key)
         return result
 
     def __repr__(self) -> str:
-        res = f"{ExpirableDict[K,V].__name__}: {self.name}"
+        self.purge()
+        now = int(time.time())
+        res = f"{ExpirableDict.__name__}: {self.name}"
         del_key = []
-        for key, value in self.__data.items():
+        for key, value in self._data.items():
             # 过期时间为None，表示永不过期
-            if (expiry := self.__expiry.get(key)) is None:
+            if (expiry := self._expiry.get(key)) is None:
                 ttl = -1
-            else:
-                # 如果过期
-                if (ttl := expiry - int(time.time())) <= 0:
-                    del_key.append(key)
-                    continue
-            line = f"\n{key}\t{value}\t{ttl}"
-            res += line
-
+            # 如果过期
+            elif (ttl := expiry - now) <= 0:
+                del_key.append(key)
+                continue
+            res += f"\n{key}\t{value}\t{ttl}"
         for key in del_key:
             self.delete(key)
-
         return res
 
-    def __iter__(self):
-        self.__index = 0  # 初始化索引
-        return self
+    def __len__(self) -> int:
+        self.purge()
+        return len(self._data)
+
+    def __contains__(self, key: object) -> bool:
+        self.purge()
+        return key in self._data and self._data[key] is not None
 
-    def __next__(self) -> K:
-        keys = self.keys()  # 取出所有未过期的 key
-        if self.__index < len(keys):
-            result = keys[self.__index]
-            self.__index += 1
-            return result
-        else:
-            raise StopIteration  # 结束迭代
+    def __iter__(self) -> Iterator[K]:
+        return iter(self.keys())
 
     def keys(self) -> list[K]:
-        return [k for k in [*self.__data.keys()] if self.exists(k)]  # 取出所有未过期的 key
+        self.purge()
+        return [k for k, v in self._data.items() if v is not None]  # 取出所有未过期的 key
 
     def values(self) -> list[V]:
-        return [v for k, v in [*self.__data.items()] if self.exists(k)]  # 取出所有未过期的 value
+        self.purge()
+        return [v for v in self._data.values() if v is not None]  # 取出所有未过期的 value
 
     def items(self) -> list[tuple[K, V]]:
-        return [(k, v) for k, v in [*self.__data.items()] if self.exists(k)]  # 取出所有未过期的 key-value 对
+        self.purge()
+        return [(k, v) for k, v in self._data.items() if v is not None]  # 取出所有未过期的 key-value 对
+
+
+G = TypeVar("G", bound=Hashable)
+
+
+class ExpirableDictFamily(Generic[G, K, V]):
+    """同一用途的一组 ExpirableDict，例如按群组或会话划分的字典
+
+    字典在首次获取时创建，由后台清理任务清除过期键并移除已经为空的字典
+    """
+
+    __slots__ = ("name", "max_size", "maps", "registry", "dropped", "expirations", "evictions")
+
+    def __init__(self, name: str, registry: "ExpirableDictRegistry", max_size: Optional[int] = None) -> None:
+        self.name = name
+        self.max_size = max_size
+        self.maps: dict[G, ExpirableDict[K, V]] = {}
+        self.registry = registry
+        self.dropped = 0
+        """被移除的空字典数"""
+        self.expirations = 0
+        """已移除的字典中因过期被清除的键数"""
+        self.evictions = 0
+        """已移除的字典中因超出数量被淘汰的键数"""
+
+    def get(self, key: G) -> ExpirableDict[K, V]:
+        """获取字典，不存在时创建"""
+        if (d := self.maps.get(key)) is None:
+            d = ExpirableDict[K, V](str(key), self.max_size)
+            self.maps[key] = d
+            self.registry.ensure_sweeper()
+        return d
+
+    def peek(self, key: G) -> Optional[ExpirableDict[K, V]]:
+        """获取字典，不存在时不创建"""
+        return self.maps.get(key)
+
+    def items(self) -> list[tuple[G, ExpirableDict[K, V]]]:
+        return list(self.maps.items())
+
+    def __len__(self) -> int:
+        return len(self.maps)
+
+    def sweep(self) -> int:
+        """清除所有字典中的过期键并移除空字典，返回清除的键数"""
+        removed = 0
+        for key, d in list(self.maps.items()):
+            removed += d.purge()
+            if not d._data:
+                del self.maps[key]
+                self.dropped += 1
+                self.expirations += d.expirations
+                self.evictions += d.evictions
+        return removed
+
+    def report(self) -> str:
+        maps = list(self.maps.values())
+        size = sum(len(d._data) for d in maps)
+        expirations = self.expirations + sum(d.expirations for d in maps)
+        evictions = self.evictions + sum(d.evictions for d in maps)
+        return (
+            f"{self.name}：字典{len(maps)}个，键{size}个，过期{expirations}，淘汰{evictions}，"
+            f"移除空字典{self.dropped}个"
+        )
+
+
+class ExpirableDictRegistry:
+    """登记所有 ExpirableDictFamily，由一个后台任务定期清理
+
+    清理任务在第一次创建字典时于当前事件循环中启动，任务结束（如事件循环关闭）后再次创建字典时重新启动
+    """
+
+    def __init__(self, sweep_interval: float = 60) -> None:
+        self.sweep_interval = sweep_interval
+        self.families: dict[str, ExpirableDictFamily] = {}
+        self.sweeper: Optional[asyncio.Task] = None
+        self.sweeps = 0
+
+    def family(self, name: str, max_size: Optional[int] = None) -> ExpirableDictFamily:
+        """获取指定名称的字典组，不存在时创建"""
+        if (family := self.families.get(name)) is None:
+            family = ExpirableDictFamily(name, self, max_size)
+            self.families[name] = family
+        return family
+
+    def ensure_sweeper(self):
+        if self.sweeper is not None and not self.sweeper.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 不在事件循环中，等下一次在事件循环中创建字典时启动
+            return
+        self.sweeper = loop.create_task(self._sweep_forever())
+
+    async def _sweep_forever(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            await self.sweep()
+
+    async def sweep(self) -> int:
+        """清理所有字典组，每组之间让出事件循环"""
+        removed = 0
+        for family in list(self.families.values()):
+            removed += family.sweep()
+            await asyncio.sleep(0)
+        self.sweeps += 1
+        return removed
+
+    def report(self) -> str:
+        lines = [f"过期字典清理{self.sweeps}次"]
+        lines.extend(family.report() for family in self.families.values())
+        return "\n".join(lines)
+
+
+EXPIRABLE_DICTS = ExpirableDictRegistry()
+"""全局过期字典登记"""
@@ -11,7 +11,7 @@ from dataclasses import dataclass
 from enum import Enum
 from pathlib import Path
 from asyncio import sleep
-from typing import Any, Literal, Optional
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Literal, Optional
 from pydantic import BaseModel
 from nonebot import get_bot, logger, on_command, on_keyword, on_message, require, get_driver, on
 from nonebot.permission import SUPERUSER
@@ -22,6 +22,8 @@ from nonebot.adapters import Event
 from nonebot.adapters.onebot.v11 import GroupMessageEvent, Bot, Message, MessageSegment, MessageEvent
 from google.genai.types import (
     Part,
+    FunctionCall,
+    GenerateContentResponse,
     Tool,
     GenerateContentConfig,
     GoogleSearch,
@@ -39,7 +41,7 @@ from google.genai.types import (
 from google.genai.errors import APIError
 
 from common import retry_on_exception
-from common.struct import ExpirableDict
+from common.struct import EXPIRABLE_DICTS, ExpirableDict
 
 require("nonebot_plugin_localstore")
 require("nonebot_plugin_waiter")
@@ -52,7 +54,7 @@ from nonebot_plugin_apscheduler import scheduler
 
 import nonebot_plugin_localstore as store
 
-from sqlalchemy import delete, select, func, update
+from sqlalchemy import select, func, update
 from .setting import get_value_or_default, get_blacklist
 from .config import Config, plugin_config
 from .image_send import get_file_name_of_image_will_sent_by_description_vec, SAFETY_SETTINGS, _HTTP_CLIENT
@@ -61,8 +63,18 @@ from .vector import (
     analysis_image_to_str_description,
 )
 from .model import GroupMemberImpression, GroupMsg
-from .task import get_model, change_model
-from .notice_proc import get_user_nickname_of_group
+from .task import MODEL_ROUTER, RequestClass, get_model
+from .nickname import NICKNAME_CACHE, get_user_nickname_of_group
+from .context import CONTEXT_BUFFER, Character, ChatMsg, ContextMsg, add_group_msgs, build_message_content
+from .ingest import IngestQueue
+from .image_cache import IMAGE_CACHE
+from .image_prep import load_image_part
+from .memo import GEMINI_MEMO
+from .context_cache import CONTEXT_CACHE
+from .reply import HedgeBudget, ReplyScheduler
+from .governor import GOVERNOR, Priority, estimate_tokens, request_priority
+from .retention import RETENTION
+from .word_filter import SEGMENT_FILTER, WORD_FILTER, WordFilter
 
 __plugin_meta__ = PluginMetadata(
     name="people-like",
@@ -76,28 +88,6 @@ DRIVER = get_driver()
 LOG_LEVEL = DRIVER.config.log_level
 
 
-@scheduler.scheduled_job("interval", days=1, id="remove_old_msg")
-async def _():
-    async with get_session() as session:
-        # 删除超过 7 天的消息
-        seven_days_ago = int(time.time()) - 60 * 60 * 24 * 7
-        result = await session.execute(delete(GroupMsg).where(GroupMsg.time < seven_days_ago))
-        deleted_count = result.rowcount if result.rowcount is not None else 0
-        logger.info(f"已删除超过7天的消息，共 {deleted_count} 条")
-        await session.commit()
-
-
-class Character(Enum):
-    BOT = 1
-    USER = 2
-
-
-@dataclass
-class ChatMsg:
-    sender: Character
-    content: list[Part]
-
-
 # ↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓FACE表情处理↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓↓
 
 EMOJI_ID_DICT: dict[int, str] = {}
@@ -174,7 +164,8 @@ async def receive_group_msg(bot: Bot, event: GroupMessageEvent) -> None:
     # 8位及以上数字字母组合为无意义消息，可能为密码或邀请码之类，过滤不做处理
     if re.match(r"^(?=.*[A-Za-z])(?=.*\d)[A-Za-z\d]{8,}$", em.extract_plain_text()):
         return
-    await store_message_segment_into_db(event)
+    # 入库交给后台队列，只有需要回复时才等待入库完成
+    stored = INGEST_QUEUE.submit(lambda: store_message_segment_into_db(event))
 
     logger.debug(f"receive: {em}")
 
@@ -219,9 +210,21 @@ async def receive_group_msg(bot: Bot, event: GroupMessageEvent) -> None:
         and event.user_id != event.self_id
     ):
         logger.info(f"reply: {em}")
-        await chat_with_gemini(
-            event.message_id, gid, nickname, await get_bot_gender(), await is_bot_admin(gid), is_superuser
-        )
+
+        async def reply(to_me: bool):
+            await wait_for_stored(stored)
+            await chat_with_gemini(
+                event.message_id,
+                gid,
+                nickname,
+                await get_bot_gender(),
+                await is_bot_admin(gid),
+                is_superuser,
+                to_me=to_me,
+            )
+
+        # 同一群组同时只生成一个回复，生成期间的触发合并为一次后续回复
+        await REPLY_SCHEDULER.trigger(gid, reply, event.is_tome())
 
 
 def convert_to_group_message_event(event: Event) -> GroupMessageEvent:
@@ -239,7 +242,7 @@ async def receive_group_self_msg(raw_event: Event) -> None:
     """处理机器人自己发的消息"""
     if raw_event.model_dump()["message_type"] == "group":
         event = convert_to_group_message_event(raw_event)
-        await store_message_segment_into_db(event)
+        INGEST_QUEUE.submit(lambda: store_message_segment_into_db(event))
 
 
 async def sleep_sometime(size: int):
@@ -248,134 +251,188 @@ async def sleep_sometime(size: int):
     await sleep(time)
 
 
-ALL_IMAGE_FILE_CACHE_DIR = store.get_cache_dir("people_like") / "all"
+REPLY_SCHEDULER = ReplyScheduler(plugin_config.reply_min_gap)
+"""群组回复调度"""
+
+HEDGE_BUDGET = HedgeBudget(plugin_config.hedge_budget_per_hour)
+"""对冲请求额度"""
+
+INGEST_QUEUE = IngestQueue(
+    "group_msg", workers=plugin_config.ingest_workers, maxsize=plugin_config.ingest_queue_size
+)
+"""群消息入库队列"""
+
+
+@DRIVER.on_startup
+async def start_ingest_queue():
+    """启动入库队列"""
+    INGEST_QUEUE.start()
+
+
+@DRIVER.on_shutdown
+async def flush_ingest_queue():
+    """关闭前将队列中以及后台分析中的消息写入数据库"""
+    await INGEST_QUEUE.flush()
+    if _BACKGROUND_TASKS:
+        logger.info(f"等待{len(_BACKGROUND_TASKS)}个图片分析任务完成")
+        await asyncio.wait(list(_BACKGROUND_TASKS), timeout=30)
+
+
+async def wait_for_stored(stored: asyncio.Future, timeout: float = 10):
+    """等待消息入库完成，超时或失败不影响后续回复"""
+    try:
+        await asyncio.wait_for(asyncio.shield(stored), timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.warning("等待消息入库超时，使用已入库的上下文进行回复")
+    except Exception:
+        pass
+
+
+@on_command("入库状态", permission=SUPERUSER, rule=to_me(), priority=1, block=True).handle()
+async def ingest_status(matcher: Matcher):
+    await matcher.finish(
+        f"{INGEST_QUEUE.report()}\n后台图片分析任务：{len(_BACKGROUND_TASKS)}\n{IMAGE_CACHE.report()}\n"
+        f"{GEMINI_MEMO.report()}\n{REPLY_SCHEDULER.report()}\n{HEDGE_BUDGET.report()}\n{NICKNAME_CACHE.report()}\n"
+        f"{EXPIRABLE_DICTS.report()}\n"
+        f"上次清理：{RETENTION.last_report or '尚未执行'}"
+    )
+
+
+_IMAGE_ANALYZE_SEMAPHORE = asyncio.Semaphore(plugin_config.image_analyze_concurrency)
+"""限制同时进行的图片分析请求数量"""
+
+_BACKGROUND_TASKS: set[asyncio.Task] = set()
+"""后台任务引用，防止任务被提前回收"""
+
+
+async def analysis_image_segment(part: Part, file_id: str) -> str:
+    """分析单张图片，受并发数限制，相同图片复用已有的描述"""
+    if (description := await IMAGE_CACHE.get_description(file_id)) is not None:
+        logger.debug(f"图片{file_id}复用已有描述")
+        return description
+    async with _IMAGE_ANALYZE_SEMAPHORE:
+        parts = [Part.from_text(text="分析一下这张图片描述的内容，用中文描述它"), part]
+        content = await analysis_image_to_str_description(parts=parts)
+    logger.debug(f"anaylysis iamge {file_id}")
+    logger.debug(content)
+    if content:
+        IMAGE_CACHE.remember_description(file_id, content)
+    return content
+
+
+async def store_image_descriptions(base_row: dict[str, Any], images: list[tuple[int, str, Part]]):
+    """并发分析图片并将图片描述写入数据库"""
+    with request_priority(Priority.INGESTION):
+        await _store_image_descriptions(base_row, images)
+
+
+async def _store_image_descriptions(base_row: dict[str, Any], images: list[tuple[int, str, Part]]):
+    analysis_start = time.perf_counter()
+    results = await asyncio.gather(
+        *(analysis_image_segment(part, file_id) for _, file_id, part in images), return_exceptions=True
+    )
+    INGEST_QUEUE.record("analysis", time.perf_counter() - analysis_start)
+    msg_data_list = []
+    for (index, file_id, _), content in zip(images, results):
+        if isinstance(content, BaseException):
+            logger.error(f"分析图片{file_id}失败：{repr(content)}")
+            continue
+        if content:
+            msg_data_list.append(GroupMsg(**base_row, index=index, content=content, file_id=file_id))
+    if msg_data_list:
+        async with get_session() as session:
+            await add_group_msgs(session, msg_data_list)
 
 
 async def store_message_segment_into_db(event: GroupMessageEvent):
-    """提取群消息事件中的消息内容"""
-    global _HTTP_CLIENT, ALL_IMAGE_FILE_CACHE_DIR
+    """提取群消息事件中的消息内容
+
+    图片并发下载，文本消息立即入库，图片描述分析在后台以有限并发完成后再补充入库
+    """
+    global _HTTP_CLIENT
     em = event.message
     gid = event.group_id
     sender_user_id = event.user_id
     self_msg = event.self_id == event.user_id
-    target: list[Part] = []
+    target: list[Optional[Part]] = []
     file_ids: list[str] = []
+    image_segments: list[tuple[int, str, str]] = []  # (index, file_id, url)
     sender_nickname = await get_user_nickname_of_group(gid, int(sender_user_id))
 
+    def append_text(text: str):
+        """与上一段文本合并，上一段不是文本时新增一段"""
+        if len(target) > 0 and (part := target[-1]) is not None and (txt := part.text):
+            target[-1] = Part.from_text(text=f"{txt}{text}")
+        else:
+            target.append(Part.from_text(text=text))
+            file_ids.append("")
+
     for ms in em:
         match ms.type:
             case "text":
-                text = ms.data["text"]
-                if len(target) > 0:
-                    part = target.pop()
-                    if txt := part.text:
-                        target.append(Part.from_text(text=f"{txt}{text}"))
-                    else:
-                        target.append(Part.from_text(text=text))
-                        file_ids.append("")
-                else:
-                    target.append(Part.from_text(text=text))
-                    file_ids.append("")
+                append_text(ms.data["text"])
             case "at":
-                if len(target) > 0:
-                    part = target.pop()
-                    if txt := part.text:
-                        target.append(Part.from_text(text=f"{txt}@{ms.data['qq']} "))
-                    else:
-                        target.append(Part.from_text(text=f"@{ms.data['qq']} "))
-                        file_ids.append("")
-                else:
-                    target.append(Part.from_text(text=f"@{ms.data['qq']} "))
-                    file_ids.append("")
+                append_text(f"@{ms.data['qq']} ")
             case "face":
                 face_text = EMOJI_ID_DICT.get(ms.data["id"])
                 face_text = "" if face_text is None else f"[/{face_text}]"
-                if len(target) > 0:
-                    part = target.pop()
-                    if txt := part.text:
-                        target.append(Part.from_text(text=f"{txt}{face_text} "))
-                    else:
-                        target.append(Part.from_text(text=f"{face_text} "))
-                        file_ids.append("")
-                else:
-                    target.append(Part.from_text(text=f"{face_text} "))
-                    file_ids.append("")
+                append_text(f"{face_text} ")
             case "image":
                 if plugin_config.image_analyze:
-                    # 下载图片进行处理
-                    data = await _HTTP_CLIENT.get(ms.data["url"])
+                    # 先占位，稍后并发下载
                     file_id = str(ms.data["file"])
+                    image_segments.append((len(target), file_id, ms.data["url"]))
+                    target.append(None)
                     file_ids.append(file_id)
-                    # 写入本地路径 ALL_IMAGE_DIR / file_id
-                    file_path = ALL_IMAGE_FILE_CACHE_DIR / file_id
-                    file_path.parent.mkdir(parents=True, exist_ok=True)  # Ensure directory exists
-                    async with aiofiles.open(file_path, "wb") as f:
-                        await f.write(data.content)
-
-                    suffix_name = file_id.split(".")[-1]
-                    mime_type: Literal["image/jpeg", "image/png"] = "image/jpeg"
-                    match suffix_name:
-                        case "jpg" | "gif":
-                            mime_type = "image/jpeg"
-                        case "png":
-                            mime_type = "image/png"
-                    if data.status_code == 200:
-                        target.append(Part.from_bytes(data=data.content, mime_type=mime_type))
             case _:
                 pass
 
+    # 并发下载所有图片
+    if image_segments:
+        download_start = time.perf_counter()
+        downloads = await asyncio.gather(
+            *(IMAGE_CACHE.fetch(file_id, url, _HTTP_CLIENT) for _, file_id, url in image_segments),
+            return_exceptions=True,
+        )
+        for (index, file_id, _), content in zip(image_segments, downloads):
+            if isinstance(content, BaseException):
+                logger.error(f"下载图片{file_id}失败：{repr(content)}")
+                continue
+            if content is not None:
+                target[index] = await load_image_part(file_id, content)
+        INGEST_QUEUE.record("download", time.perf_counter() - download_start)
+
     # 新增数据到数据库
-    message_id = event.message_id
-    group_id = event.group_id
-    user_id = event.user_id
-    db_data = []
+    base_row = {
+        "message_id": event.message_id,
+        "group_id": event.group_id,
+        "user_id": event.user_id,
+        "self_msg": self_msg,
+        "to_me": event.is_tome(),
+        "nick_name": sender_nickname,
+        "time": event.time,
+    }
+    msg_data_list = []
+    images: list[tuple[int, str, Part]] = []
     for index, part in enumerate(target):
+        if part is None:
+            continue
         file_id = file_ids[index] if index < len(file_ids) else ""
         if part.text:
-            db_data.append(
-                {
-                    "message_id": message_id,
-                    "group_id": group_id,
-                    "user_id": user_id,
-                    "self_msg": self_msg,
-                    "to_me": event.is_tome(),
-                    "index": index,
-                    "nick_name": sender_nickname,
-                    "content": part.text,
-                    "file_id": file_id,
-                    "time": int(time.time()),
-                }
-            )
+            msg_data_list.append(GroupMsg(**base_row, index=index, content=part.text, file_id=file_id))
         if part.inline_data:
-            # 如果是图片，则先分析图片
-            parts = []
-            parts.append(Part.from_text(text="分析一下这张图片描述的内容，用中文描述它"))
-            parts.append(part)
-            content = await analysis_image_to_str_description(parts=parts)
-            logger.debug(f"anaylysis iamge {file_id}")
-            logger.debug(content)
-            if content:
-                db_data.append(
-                    {
-                        "message_id": message_id,
-                        "group_id": group_id,
-                        "user_id": user_id,
-                        "self_msg": self_msg,
-                        "to_me": event.is_tome(),
-                        "index": index,
-                        "nick_name": sender_nickname,
-                        "content": content,
-                        "file_id": file_id,
-                        "time": int(time.time()),
-                    }
-                )
-    # 插入数据到数据库
-    msg_data_list = []
-    for data in db_data:
-        msg_data_list.append(GroupMsg(**data))
-    async with get_session() as session:
-        session.add_all(msg_data_list)
-        await session.commit()
+            images.append((index, file_id, part))
+    # 文本消息立即入库
+    if msg_data_list:
+        insert_start = time.perf_counter()
+        async with get_session() as session:
+            await add_group_msgs(session, msg_data_list)
+        INGEST_QUEUE.record("insert", time.perf_counter() - insert_start)
+    # 图片描述在后台补充
+    if images:
+        task = asyncio.create_task(store_image_descriptions(base_row, images))
+        _BACKGROUND_TASKS.add(task)
+        task.add_done_callback(_BACKGROUND_TASKS.discard)
 
 
 _BOT_OF_GROUP_NICKNAME: ExpirableDict[int, str] = ExpirableDict("bot_of_group_nickname")
@@ -479,6 +536,187 @@ class ReturnMsg(BaseModel):
     """消息类型"""
 
 
+@dataclass
+class ReplyContext:
+    """执行函数调用所需的回复信息"""
+
+    bot: Bot
+    group_id: int
+    message_id: int
+    words: WordFilter
+    """禁止出现在回复中的词汇"""
+    segmented: bool = False
+    """是否将文本消息按段逐条发送"""
+    sent: bool = False
+    """是否已经发送过内容"""
+
+
+async def build_text_messages(returnMsgs: list[ReturnMsg], ctx: ReplyContext) -> Optional[list[Message]]:
+    """将模型返回的消息段转换为待发送的消息，包含非法文本时返回 None
+
+    逐条发送时，每段文本与其之前的提及、表情组成一条消息
+    """
+    group_id = ctx.group_id
+    messages: list[Message] = []
+    message = Message()
+    for returnMsg in returnMsgs:
+        if returnMsg.msg_type == ReturnMsgEnum.AT:
+            content = returnMsg.content
+            if not content.isdigit():
+                if not await process_text_segment(message, content, group_id, ctx.message_id):
+                    logger.warning(f"发送到群{group_id}的文本消息中包含非法文本：{content}，重新请求消息")
+                    return None
+                else:
+                    continue
+            message.append(MessageSegment.at(int(content)))
+        elif returnMsg.msg_type == ReturnMsgEnum.TEXT:
+            # 处理文本中包含 @123 的情况，转换成 TEXT+AT+TEXT 串
+            content = returnMsg.content
+            if not await process_text_segment(message, content, group_id, ctx.message_id):
+                logger.warning(f"发送到群{group_id}的文本消息中包含非法文本：{content}，重新请求消息")
+                return None
+            if ctx.segmented and len(message) > 0:
+                messages.append(message)
+                message = Message()
+        elif returnMsg.msg_type == ReturnMsgEnum.FACE:
+            content = returnMsg.content
+            if not content.isdigit():
+                if content in EMOJI_NAME_DICT:
+                    # 如果是表情名称，则转换为表情id
+                    face_id = EMOJI_NAME_DICT[content]
+                    message.append(MessageSegment.face(face_id))
+                else:
+                    # 如果找不到对应 face 描述的 id，则改为发送动画表情
+                    description = content
+                    logger.info(f"群{group_id}调用函数send_text_message，参数{description}")
+                    will_send_img = await get_file_name_of_image_will_sent_by_description_vec(
+                        str(description), group_id
+                    )
+                    if will_send_img:
+                        logger.trace(f"群{group_id}回复图片：{will_send_img}")
+                        await on_msg.send(will_send_img)
+                        ctx.sent = True
+                        asyncio.create_task(
+                            write_ai_invoke_log_after_response(repr(will_send_img), group_id, ctx.message_id)
+                        )
+            else:
+                # 如果是数字，则直接转换为 face segment
+                face_id = int(content)
+                if face_id in EMOJI_ID_DICT:
+                    message.append(MessageSegment.face(face_id))
+    if len(message) > 0:
+        messages.append(message)
+    return messages
+
+
+async def send_text_messages(messages: list[Message], ctx: ReplyContext):
+    """检查并发送文本消息，逐条发送时按字数间隔一段时间"""
+    group_id = ctx.group_id
+    for index, message in enumerate(messages):
+        plain_text = extract_plain_text_from_message(message)
+
+        if LOG_LEVEL.upper() == "DEBUG" if isinstance(LOG_LEVEL, str) else LOG_LEVEL == logging.DEBUG:
+            print(f"即将向群组 {group_id} 发送消息")
+            print(plain_text)
+            print("被禁止出现在句子中的词汇或短语")
+            print(ctx.words)
+        if ctx.words.search(plain_text) is not None or GROUP_SPEAK_DISABLE.get(group_id, False):
+            continue
+        if index == 0:
+            # 判断是否需要提及消息
+            should_reply = await check_should_reply(
+                message_id=ctx.message_id, group_id=group_id, will_send_message=message
+            )
+            if should_reply:
+                message.insert(0, MessageSegment.reply(ctx.message_id))
+        elif ctx.segmented:
+            await sleep_sometime(len(plain_text))
+        if not GROUP_SPEAK_DISABLE.get(group_id, False):
+            logger.info(f"群{group_id}回复消息：{message.extract_plain_text()}")
+            await on_msg.send(message)
+            ctx.sent = True
+            asyncio.create_task(
+                write_ai_invoke_log_after_response(message.extract_plain_text(), group_id, ctx.message_id)
+            )
+
+
+async def handle_function_call(fc: FunctionCall, ctx: ReplyContext) -> bool:
+    """执行模型返回的函数调用，文本消息中包含非法文本时返回 False"""
+    group_id = ctx.group_id
+    if fc.name == "send_text_message" and fc.args:
+        messages = fc.args.get("messages")
+        logger.debug(f"群{group_id}调用函数{fc.name}，参数{messages}")
+        msg_str = str(messages)
+        returnMsgs: list[ReturnMsg] = [ReturnMsg(**item) for item in json.loads(msg_str.replace("'", '"'))]
+        text_messages = await build_text_messages(returnMsgs, ctx)
+        if text_messages is None:
+            return False
+        await send_text_messages(text_messages, ctx)
+
+    if fc.name == "send_meme" and fc.args:
+        description = fc.args.get("description")
+        logger.info(f"群{group_id}调用函数{fc.name}，参数{description}")
+        will_send_img = await get_file_name_of_image_will_sent_by_description_vec(str(description), group_id)
+        if will_send_img:
+            logger.trace(f"群{group_id}回复图片：{will_send_img}")
+            await on_msg.send(will_send_img)
+            ctx.sent = True
+            asyncio.create_task(write_ai_invoke_log_after_response(repr(will_send_img), group_id, ctx.message_id))
+
+    if fc.name == "poke_sb" and fc.args:
+        user_id = int(str(fc.args.get("user_id")))
+        logger.info(f"群{group_id}调用函数{fc.name}，参数{user_id}")
+        await poke_sb(group_id, user_id)
+        ctx.sent = True
+
+    if fc.name == "mute_sb" and fc.args:
+        user_id = int(str(fc.args.get("user_id")))
+        minute = int(str(fc.args.get("minute")))
+        logger.info(f"群{group_id}调用函数{fc.name}，参数{user_id}，{minute}分钟")
+        await mute_sb(group_id, user_id, minute)
+        ctx.sent = True
+
+    if fc.name == "get_group_history" and fc.args:
+        day = fc.args.get("day")
+        user_id = fc.args.get("user_id")
+        limit = fc.args.get("limit")
+        start_time = fc.args.get("start_time")
+        end_time = fc.args.get("end_time")
+        logger.info(f"群{group_id}调用函数{fc.name}，参数{day}，{user_id}，{limit}，{start_time}，{end_time}")
+        forward_message = await get_group_history(
+            group_id=group_id,
+            day=day,  # type: ignore
+            user_id=user_id,
+            limit=limit,
+            start_time=start_time,
+            end_time=end_time,
+        )
+        await ctx.bot.call_api("send_group_forward_msg", group_id=group_id, messages=forward_message)
+        ctx.sent = True
+    return True
+
+
+async def stream_reply(ctx: ReplyContext, **request_kwargs) -> bool:
+    """流式请求回复，每收到一个函数调用立即执行
+
+    已经发送过内容后不再重新请求，避免重复发言；返回 False 表示需要重新请求
+    """
+    chunks: AsyncGenerator[GenerateContentResponse, None] = await request_for_resp(stream=True, **request_kwargs)
+    try:
+        async for chunk in chunks:
+            if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+                continue
+            for part in chunk.candidates[0].content.parts:
+                if fc := part.function_call:
+                    if not await handle_function_call(fc, ctx) and not ctx.sent:
+                        return False
+    except Exception as e:
+        logger.error(f"群{ctx.group_id}流式请求中断：{repr(e)}")
+    finally:
+        await chunks.aclose()
+    return ctx.sent
+
+
 async def chat_with_gemini(
     message_id: int,
     group_id: int,
@@ -486,50 +724,26 @@ async def chat_with_gemini(
     bot_gender: Optional[str] = None,
     is_admin: bool = False,
     is_superuser: bool = False,
+    to_me: bool = False,
 ):
     """与gemini聊天"""
-    global _GEMINI_CLIENT, ALL_IMAGE_FILE_CACHE_DIR
+    global _GEMINI_CLIENT
     bot = get_bot()
 
     context_size: int = get_value_or_default(group_id, "context_size")
     forget_self: Optional[int] = get_value_or_default(group_id, "forget_self", None)
     enable_notice: bool = get_value_or_default(group_id, "enable_notice")
 
-    if enable_notice:
-        async with get_session() as session:
-            query_data = list(
-                await session.scalars(
-                    select(GroupMsg)
-                    .where(GroupMsg.group_id == group_id)
-                    .order_by(GroupMsg.time.desc())
-                    .limit(context_size)
-                )
-            )
-    else:
-        async with get_session() as session:
-            query_data = list(
-                await session.scalars(
-                    select(GroupMsg)
-                    .where(GroupMsg.group_id == group_id)
-                    .where(GroupMsg.message_id.is_not(None))
-                    .order_by(GroupMsg.time.desc())
-                    .limit(context_size)
-                )
-            )
+    # 上下文按群组缓存，新入库的消息会直接追加，无需每次查询数据库并重新生成 Part
+    data = await CONTEXT_BUFFER.get(group_id, context_size, enable_notice)
     # 过滤自身消息
     if forget_self is not None:
-        query_data = [data for data in query_data if data.self_msg is False or data.time > forget_self]
-    combined_list = list(query_data)
-    unique_dict: dict[int, GroupMsg] = {}
-    for item in combined_list:
-        unique_dict[item.id] = item  # 使用 item.id 作为键，item 对象作为值
-    data: list[GroupMsg] = list(unique_dict.values())  # 返回字典的值的列表 (元素对象)
+        data = [item for item in data if item.self_msg is False or item.time > forget_self]
     if len(data) < int(context_size / 4):
         # 如果没有数据，则不进行回复
         logger.info(f"群{group_id}查询结果少于{int(context_size / 4)}条，不进行回复")
         return
 
-    data: list[GroupMsg] = sorted(data, key=lambda x: x.time, reverse=False)  # type: ignore
     # 判断当前日志等级是否为 DEBUG
     # 写入AI调用日志文件，异步任务，使用子线程不阻塞主流程
     asyncio.create_task(write_ai_invoke_log_before_request(data, group_id, message_id))
@@ -541,34 +755,10 @@ async def chat_with_gemini(
 
     context: list[ChatMsg] = []
     for item in data:
-        context.append(await build_message_content(item))
+        context.append(item.chat if item.chat is not None else await build_message_content(item))
 
-    try:
-        today_zero_time = int(datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp())
-        async with get_session() as session:
-            query_self_data = list(
-                await session.scalars(
-                    select(GroupMsg)
-                    .where(GroupMsg.group_id == group_id)
-                    .where(GroupMsg.self_msg)
-                    .where(GroupMsg.time >= today_zero_time)
-                    .order_by(GroupMsg.time.desc())
-                )
-            )
-        self_has_speak = [
-            data.file_id if data.file_id and len(data.file_id) > 0 else data.content for data in query_self_data
-        ]
-    except Exception as e:
-        logger.error(e)
-        self_has_speak = []
-
-    do_not_send_words = Path(__file__).parent / "do_not_send.txt"
-    words = [s.strip() for s in do_not_send_words.read_text(encoding="utf-8").splitlines()]
-    # 将我是xxx过滤掉
-    words.append(f"我是{bot_nickname}")
-    words.append("ignore")
-    words.append("忽略")
-    words.extend(self_has_speak)  # type: ignore
+    # 禁止发送的词汇与机器人当天已经发送过的内容
+    words = await WORD_FILTER.get(group_id, bot_nickname)
 
     extra_prompt = get_value_or_default(group_id, "prompt")
 
@@ -589,13 +779,15 @@ async def chat_with_gemini(
     else:
         prompt = get_prompt(bot_nickname, bot_gender, extra_prompt, is_admin, None)
     contents = []
-    for msg in context:
+    context_ids: list[int] = []
+    for item, msg in zip(data, context):
         if len(c := msg.content) > 0:
             match msg.sender:
                 case Character.USER:
                     contents.append({"role": "user", "parts": c})
                 case Character.BOT:
                     contents.append({"role": "model", "parts": c})
+            context_ids.append(item.id)
     if len(contents) == 0:
         return None, None
     top_p = get_value_or_default(group_id, "topP", None)
@@ -704,154 +896,48 @@ async def chat_with_gemini(
     else:
         tools.append(Tool(function_declarations=function_declarations))
 
+    request_kwargs: dict[str, Any] = {
+        "group_id": group_id,
+        "contents": contents,
+        "prompt": prompt,
+        "top_p": top_p,
+        "top_k": top_k,
+        "c_len": c_len,
+        "tools": tools,
+        "temperature": temperature,
+        "enable_search": enable_search,
+        "context_ids": context_ids,
+        # 只对提及机器人的消息进行对冲请求
+        "hedge": to_me and get_value_or_default(group_id, "hedge", False),
+        # 提及机器人的消息优先选择延迟低的模型
+        "request_class": "latency" if to_me else "quality",
+    }
+    # 流式输出只用于函数调用，搜索模式仍需等待完整文本
+    enable_stream: bool = get_value_or_default(group_id, "stream", False) and not enable_search
+    reply_context = ReplyContext(
+        bot=bot, group_id=group_id, message_id=message_id, words=words, segmented=enable_stream
+    )
+
     # 至多重试 5 次
     for i in range(5):
         success = True
         logger.debug(f"群{group_id}第{i + 1}次请求消息")
-        resp = await request_for_resp(
-            group_id=group_id,
-            contents=contents,
-            prompt=prompt,
-            top_p=top_p,
-            top_k=top_k,
-            c_len=c_len,
-            tools=tools,
-            temperature=temperature,
-            enable_search=enable_search,
-        )
+        if enable_stream:
+            if await stream_reply(reply_context, **request_kwargs):
+                break
+            continue
+        resp = await request_for_resp(**request_kwargs)
 
         logger.debug(f"群{group_id}回复内容：{resp}")
 
-        logger.info(f"本次请求总token数{resp.usage_metadata.total_token_count}")  # type: ignore
-
         # 如果请求出错则重新请求
         if not resp.candidates or not resp.candidates[0].content or not resp.candidates[0].content.parts:
             logger.error(f"请求出错{repr(contents)}----------------------------{repr(resp)}")
             continue
         for part in resp.candidates[0].content.parts:
             if fc := part.function_call:
-                if fc.name == "send_text_message" and fc.args:
-                    messages = fc.args.get("messages")
-                    logger.debug(f"群{group_id}调用函数{fc.name}，参数{messages}")
-                    msg_str = str(messages)
-                    returnMsgs: list[ReturnMsg] = [ReturnMsg(**item) for item in json.loads(msg_str.replace("'", '"'))]
-                    message = Message()
-                    for returnMsg in returnMsgs:
-                        if returnMsg.msg_type == ReturnMsgEnum.AT:
-                            content = returnMsg.content
-                            if not content.isdigit():
-                                if not await process_text_segment(message, content, group_id, message_id):
-                                    success = False
-                                    logger.warning(
-                                        f"发送到群{group_id}的文本消息中包含非法文本：{content}，重新请求消息"
-                                    )
-                                    break
-                                else:
-                                    continue
-                            message.append(MessageSegment.at(int(content)))
-                        elif returnMsg.msg_type == ReturnMsgEnum.TEXT:
-                            # 处理文本中包含 @123 的情况，转换成 TEXT+AT+TEXT 串
-                            content = returnMsg.content
-                            if not await process_text_segment(message, content, group_id, message_id):
-                                success = False
-                                logger.warning(f"发送到群{group_id}的文本消息中包含非法文本：{content}，重新请求消息")
-                                break
-                        elif returnMsg.msg_type == ReturnMsgEnum.FACE:
-                            content = returnMsg.content
-                            if not content.isdigit():
-                                if content in EMOJI_NAME_DICT:
-                                    # 如果是表情名称，则转换为表情id
-                                    face_id = EMOJI_NAME_DICT[content]
-                                    message.append(MessageSegment.face(face_id))
-                                else:
-                                    # 如果找不到对应 face 描述的 id，则改为发送动画表情
-                                    description = content
-                                    logger.info(f"群{group_id}调用函数{fc.name}，参数{description}")
-                                    will_send_img = await get_file_name_of_image_will_sent_by_description_vec(
-                                        str(description), group_id
-                                    )
-                                    if will_send_img:
-                                        logger.trace(f"群{group_id}回复图片：{will_send_img}")
-                                        await on_msg.send(will_send_img)
-                                        asyncio.create_task(
-                                            write_ai_invoke_log_after_response(
-                                                repr(will_send_img), group_id, message_id
-                                            )
-                                        )
-                            else:
-                                # 如果是数字，则直接转换为 face segment
-                                face_id = int(content)
-                                if face_id in EMOJI_ID_DICT:
-                                    message.append(MessageSegment.face(face_id))
-
-                    if len(message) > 0 and success:
-                        plain_text = extract_plain_text_from_message(message)
-
-                        if LOG_LEVEL.upper() == "DEBUG" if isinstance(LOG_LEVEL, str) else LOG_LEVEL == logging.DEBUG:
-                            print(f"即将向群组 {group_id} 发送消息")
-                            print(plain_text)
-                            print("被禁止出现在句子中的词汇或短语")
-                            print(words)
-                        if all(ignore not in plain_text for ignore in words) and not GROUP_SPEAK_DISABLE.get(
-                            group_id, False
-                        ):
-                            # 判断是否需要提及消息
-                            should_reply = await check_should_reply(
-                                message_id=message_id, group_id=group_id, will_send_message=message
-                            )
-                            if should_reply:
-                                message.insert(0, MessageSegment.reply(message_id))
-                            if not GROUP_SPEAK_DISABLE.get(group_id, False):
-                                logger.info(f"群{group_id}回复消息：{message.extract_plain_text()}")
-                                await on_msg.send(message)
-                                asyncio.create_task(
-                                    write_ai_invoke_log_after_response(
-                                        message.extract_plain_text(), group_id, message_id
-                                    )
-                                )
-
-                if fc.name == "send_meme" and fc.args:
-                    description = fc.args.get("description")
-                    logger.info(f"群{group_id}调用函数{fc.name}，参数{description}")
-                    will_send_img = await get_file_name_of_image_will_sent_by_description_vec(
-                        str(description), group_id
-                    )
-                    if will_send_img:
-                        logger.trace(f"群{group_id}回复图片：{will_send_img}")
-                        await on_msg.send(will_send_img)
-                        asyncio.create_task(
-                            write_ai_invoke_log_after_response(repr(will_send_img), group_id, message_id)
-                        )
-
-                if fc.name == "poke_sb" and fc.args:
-                    user_id = int(str(fc.args.get("user_id")))
-                    logger.info(f"群{group_id}调用函数{fc.name}，参数{user_id}")
-                    await poke_sb(group_id, user_id)
-
-                if fc.name == "mute_sb" and fc.args:
-                    user_id = int(str(fc.args.get("user_id")))
-                    minute = int(str(fc.args.get("minute")))
-                    logger.info(f"群{group_id}调用函数{fc.name}，参数{user_id}，{minute}分钟")
-                    await mute_sb(group_id, user_id, minute)
-
-                if fc.name == "get_group_history" and fc.args:
-                    day = fc.args.get("day")
-                    user_id = fc.args.get("user_id")
-                    limit = fc.args.get("limit")
-                    start_time = fc.args.get("start_time")
-                    end_time = fc.args.get("end_time")
-                    logger.info(
-                        f"群{group_id}调用函数{fc.name}，参数{day}，{user_id}，{limit}，{start_time}，{end_time}"
-                    )
-                    forward_message = await get_group_history(
-                        group_id=group_id,
-                        day=day,  # type: ignore
-                        user_id=user_id,
-                        limit=limit,
-                        start_time=start_time,
-                        end_time=end_time,
-                    )
-                    await bot.call_api("send_group_forward_msg", group_id=group_id, messages=forward_message)
+                if not await handle_function_call(fc, reply_context):
+                    success = False
 
         if enable_search:
             text = resp.text  # type: ignore
@@ -871,7 +957,7 @@ async def chat_with_gemini(
                     print(plain_text)
                     print("被禁止出现在句子中的词汇或短语")
                     print(words)
-                if any(ignore in plain_text for ignore in words) and not GROUP_SPEAK_DISABLE.get(group_id, False):
+                if words.search(plain_text) is None and not GROUP_SPEAK_DISABLE.get(group_id, False):
                     # 判断是否需要提及消息
                     should_reply = await check_should_reply(
                         message_id=message_id, group_id=group_id, will_send_message=message
@@ -889,53 +975,6 @@ async def chat_with_gemini(
             break
 
 
-async def build_message_content(item: GroupMsg) -> ChatMsg:
-    """提取数据库中的消息元素，将其转为特定格式的文本消息内容"""
-    bot = get_bot()
-    if item.self_msg:
-        character = Character.BOT
-    else:
-        character = Character.USER
-        # 生成 parts
-    # TODO 这块或许也需要处理 GIF 分帧动画
-    # nick_name = item.nick_name
-    nick_name = await get_user_nickname_of_group(item.group_id, item.user_id)
-    user_id = item.user_id
-    formatted_time = datetime.fromtimestamp(item.time).strftime("%Y-%m-%d %H:%M:%S")
-    if item.file_id:
-        # 判断为图片消息
-        # 读取指定文件二进制信息
-        async with aiofiles.open(ALL_IMAGE_FILE_CACHE_DIR / item.file_id, "rb") as f:
-            content = await f.read()
-        suffix_name = item.file_id.split(".")[-1]
-        mime_type: Literal["image/jpeg", "image/png"] = "image/jpeg"
-        match suffix_name:
-            case "jpg" | "gif":
-                mime_type = "image/jpeg"
-            case "png":
-                mime_type = "image/png"
-        parts = []
-        parts.append(Part.from_text(text=f"[{nick_name}<{user_id}>{{{formatted_time}}}]"))
-        if item.to_me:
-            parts.append(Part.from_text(text=f"@{bot.self_id} "))
-        parts.append(Part.from_bytes(data=content, mime_type=mime_type))
-        return ChatMsg(sender=character, content=parts)
-    elif not item.message_id:
-        # 判断为 notice 消息
-        parts = []
-        parts.append(Part.from_text(text=f"[Notice{{{formatted_time}}}]"))
-        parts.append(Part.from_text(text=str(item.content)))
-        return ChatMsg(sender=character, content=parts)
-    else:
-        # 判断是否为通知消息
-        parts = []
-        parts.append(Part.from_text(text=f"[{nick_name}<{user_id}>{{{formatted_time}}}]"))
-        if item.to_me:
-            parts.append(Part.from_text(text=f"@{bot.self_id} "))
-        parts.append(Part.from_text(text=str(item.content)))
-        return ChatMsg(sender=character, content=parts)
-
-
 async def process_text_segment(message: Message, text_content: str, group_id: int, message_id: int) -> bool:
     """处理发送 Text 文本消息可能出现的各种异常情况
 
@@ -986,8 +1025,7 @@ async def process_text_segment(message: Message, text_content: str, group_id: in
             message.append(MessageSegment.text(pretty_text_segment(message, part)))
 
     # 判断 text 消息段是否含有非法字符串，如果有，则返回 False
-    words = ["face", "FACE", "at", "AT", "@", "poke", "POKE", "meme", "MEME"]
-    if any(any(ignore in ms.data["text"] for ignore in words) for ms in message if ms.type == "text"):
+    if any(SEGMENT_FILTER.search(ms.data["text"]) is not None for ms in message if ms.type == "text"):
         return False
     return True
 
@@ -1019,19 +1057,9 @@ async def check_should_reply(message_id: int, group_id: int, will_send_message:
     parts = []
     for item in messages:
         # 生成 parts
-        if item.file_id:
-            # 判断为图片消息
-            # 读取指定文件二进制信息
-            async with aiofiles.open(ALL_IMAGE_FILE_CACHE_DIR / item.file_id, "rb") as f:
-                content = await f.read()
-            suffix_name = item.file_id.split(".")[-1]
-            mime_type: Literal["image/jpeg", "image/png"] = "image/jpeg"
-            match suffix_name:
-                case "jpg" | "gif":
-                    mime_type = "image/jpeg"
-                case "png":
-                    mime_type = "image/png"
-            parts.append(Part.from_bytes(data=content, mime_type=mime_type))
+        if item.file_id and (image_part := await load_image_part(item.file_id)) is not None:
+            # 判断为图片消息，图片已被淘汰时按文本描述处理
+            parts.append(image_part)
         else:
             parts.append(Part.from_text(text=str(item.content)))
 
@@ -1043,6 +1071,10 @@ async def check_should_reply(message_id: int, group_id: int, will_send_message:
     return await check_message_relevance(contents=contents)
 
 
+RELEVANCE_MODEL = "gemini-2.5-flash-lite"
+"""判断消息相关性优先使用的模型"""
+
+
 async def check_message_relevance(contents: list) -> bool:
     """
     检查两条消息的相关性
@@ -1055,16 +1087,26 @@ async def check_message_relevance(contents: list) -> bool:
         related: bool
         """是否相关"""
 
-    resp = await _GEMINI_CLIENT.aio.models.generate_content(
-        model="gemini-2.5-flash-lite",
-        contents=contents,
-        config=GenerateContentConfig(
-            http_options=HttpOptions(timeout=6 * 60 * 1000),
-            system_instruction="判断这两条消息话题是否相关",
-            safety_settings=SAFETY_SETTINGS,
-            response_mime_type="application/json",
-            response_schema=ResponseSchema,
-        ),
+    model = MODEL_ROUTER.prefer(RELEVANCE_MODEL, "latency")
+
+    async def send():
+        return await _GEMINI_CLIENT.aio.models.generate_content(
+            model=model,
+            contents=contents,
+            config=GenerateContentConfig(
+                http_options=HttpOptions(timeout=6 * 60 * 1000),
+                system_instruction="判断这两条消息话题是否相关",
+                safety_settings=SAFETY_SETTINGS,
+                response_mime_type="application/json",
+                response_schema=ResponseSchema,
+            ),
+        )
+
+    resp = await GOVERNOR.call(
+        model,
+        lambda: MODEL_ROUTER.track(model, send),
+        priority=Priority.RELEVANCE,
+        tokens=estimate_tokens(contents),
     )
     obj: ResponseSchema = resp.parsed  # type: ignore
 
@@ -1141,16 +1183,7 @@ async def poke_sb(group_id: int, user_id: int):
     await get_bot().call_api("group_poke", group_id=group_id, user_id=user_id)
 
 
-def change_model_when_fail(e: Exception, _attempt: int):
-    """
-    失败时修改模型
-    """
-    if isinstance(e, APIError):
-        if e.code in [429, 503]:
-            change_model()
-
-
-@retry_on_exception(max_retries=5, on_exception=change_model_when_fail)
+@retry_on_exception(max_retries=5)
 async def request_for_resp(
     group_id: int,
     contents: list,
@@ -1161,30 +1194,161 @@ async def request_for_resp(
     tools: ToolListUnion,
     temperature: Optional[float],
     enable_search: bool,
+    context_ids: Optional[list[int]] = None,
+    stream: bool = False,
+    hedge: bool = False,
+    request_class: RequestClass = "quality",
 ):
-    model = get_model(group_id=group_id)
-    thinking_config = ThinkingConfig(thinking_budget=1024) if model.startswith("gemini-2.5") else None
+    """请求生成回复，stream 为 True 时返回逐块结果的异步生成器，hedge 为 True 时在响应较慢时同时请求下一个模型"""
+    model = get_model(group_id=group_id, request_class=request_class)
+    tool_config = (
+        ToolConfig(function_calling_config=FunctionCallingConfig(mode=FunctionCallingConfigMode.ANY))
+        if not enable_search
+        else None
+    )
 
-    resp = await _GEMINI_CLIENT.aio.models.generate_content(
-        model=model,
-        contents=contents,
-        config=GenerateContentConfig(
+    def build_config(model: str, cached_content: Optional[str]) -> GenerateContentConfig:
+        # 使用缓存时，提示词与工具已包含在缓存中，不能重复发送
+        return GenerateContentConfig(
             http_options=HttpOptions(timeout=6 * 60 * 1000),
-            system_instruction=prompt,
+            system_instruction=prompt if cached_content is None else None,
             top_p=top_p,
             top_k=top_k,
             max_output_tokens=c_len,
-            tools=tools,
+            tools=tools if cached_content is None else None,
             temperature=temperature,
-            tool_config=ToolConfig(function_calling_config=FunctionCallingConfig(mode=FunctionCallingConfigMode.ANY))
-            if not enable_search
-            else None,
-            thinking_config=thinking_config,
+            tool_config=tool_config if cached_content is None else None,
+            thinking_config=ThinkingConfig(thinking_budget=1024) if model.startswith("gemini-2.5") else None,
             safety_settings=SAFETY_SETTINGS,
-        ),
-    )
+            cached_content=cached_content,
+        )
+
+    estimated_tokens = estimate_tokens(contents) + estimate_tokens(prompt)
 
-    return resp
+    async def generate(model: str, request_contents: list, cached_content: Optional[str]):
+        async def send():
+            # 只统计请求本身的耗时，不包含排队时间
+            MODEL_ROUTER.begin(model)
+            start = time.perf_counter()
+            try:
+                if stream:
+                    chunks = await _GEMINI_CLIENT.aio.models.generate_content_stream(
+                        model=model, contents=request_contents, config=build_config(model, cached_content)
+                    )
+                else:
+                    resp = await _GEMINI_CLIENT.aio.models.generate_content(
+                        model=model, contents=request_contents, config=build_config(model, cached_content)
+                    )
+            except APIError as e:
+                if e.code == 429 or e.code >= 500:
+                    MODEL_ROUTER.record(model, False, time.perf_counter() - start, rate_limited=e.code == 429)
+                else:
+                    MODEL_ROUTER.release(model)
+                raise
+            except asyncio.CancelledError:
+                # 对冲请求中落后的一方被取消
+                MODEL_ROUTER.release(model)
+                raise
+            except Exception:
+                MODEL_ROUTER.record(model, False, time.perf_counter() - start)
+                raise
+            if stream:
+                return track_stream(model, chunks, start, group_id, cached_content is not None)
+            MODEL_ROUTER.record(model, True, time.perf_counter() - start)
+            CONTEXT_CACHE.record_usage(group_id, resp.usage_metadata, cached=cached_content is not None)
+            return resp
+
+        return await GOVERNOR.call(model, send, priority=Priority.INTERACTIVE, tokens=estimated_tokens)
+
+    async def generate_primary():
+        if context_ids is not None and len(context_ids) == len(contents):
+            cached_content, tail = await CONTEXT_CACHE.prepare(
+                group_id, model, prompt, list(tools), tool_config, context_ids, contents
+            )
+            if cached_content is not None:
+                try:
+                    return await generate(model, tail, cached_content)
+                except APIError as e:
+                    if e.code in [429, 503]:
+                        raise
+                    # 缓存已失效或与模型不匹配，改为发送完整内容
+                    logger.warning(f"群{group_id}使用上下文缓存请求失败：{repr(e)}，改为完整请求")
+                    CONTEXT_CACHE.invalidate(group_id)
+
+        return await generate(model, contents, None)
+
+    if not hedge or stream:
+        return await generate_primary()
+    # 上下文缓存与模型绑定，对冲请求发送完整内容
+    return await request_with_hedge(group_id, model, generate_primary, lambda m: generate(m, contents, None))
+
+
+def is_function_call_response(resp: GenerateContentResponse) -> bool:
+    """响应中是否包含函数调用"""
+    if not resp.candidates or not resp.candidates[0].content or not resp.candidates[0].content.parts:
+        return False
+    return any(part.function_call for part in resp.candidates[0].content.parts)
+
+
+async def request_with_hedge(
+    group_id: int,
+    model: str,
+    primary: Callable[[], Awaitable[GenerateContentResponse]],
+    backup: Callable[[str], Awaitable[GenerateContentResponse]],
+) -> GenerateContentResponse:
+    """主模型在 p90 延迟内没有响应时，向下一个模型发起相同请求，采用先返回的有效结果并取消另一个请求"""
+    p90 = MODEL_ROUTER.get_health(model).latency(0.9)
+    delay = max(plugin_config.hedge_min_delay, p90 if p90 is not None else plugin_config.hedge_default_delay)
+    primary_task = asyncio.create_task(primary())
+    done, _ = await asyncio.wait({primary_task}, timeout=delay)
+    if done:
+        return primary_task.result()
+    backup_model = MODEL_ROUTER.next_model(model)
+    if backup_model is None or not HEDGE_BUDGET.take(group_id):
+        return await primary_task
+    logger.info(f"群{group_id}模型{model}{delay:.1f}秒内未响应，同时请求模型{backup_model}")
+    pending: set[asyncio.Task] = {primary_task, asyncio.create_task(backup(backup_model))}
+    fallback: Optional[GenerateContentResponse] = None
+    error: Optional[BaseException] = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if (e := task.exception()) is not None:
+                    error = error or e
+                    continue
+                resp = task.result()
+                if is_function_call_response(resp):
+                    logger.info(f"群{group_id}采用{'主模型' if task is primary_task else '对冲模型'}的响应")
+                    return resp
+                fallback = fallback or resp
+    finally:
+        for task in pending:
+            task.cancel()
+    # 两个请求都没有有效结果时，与不对冲时一样返回结果交由调用方重试
+    if fallback is not None:
+        return fallback
+    raise error  # type: ignore
+
+
+async def track_stream(
+    model: str, chunks: AsyncIterator[GenerateContentResponse], start: float, group_id: int, cached: bool
+) -> AsyncGenerator[GenerateContentResponse, None]:
+    """逐块返回流式结果，结束后记录模型状态与 token 用量"""
+    usage = None
+    try:
+        async for chunk in chunks:
+            usage = chunk.usage_metadata or usage
+            yield chunk
+    except GeneratorExit:
+        # 调用方提前结束读取
+        MODEL_ROUTER.release(model)
+        raise
+    except Exception:
+        MODEL_ROUTER.record(model, False, time.perf_counter() - start)
+        raise
+    MODEL_ROUTER.record(model, True, time.perf_counter() - start)
+    CONTEXT_CACHE.record_usage(group_id, usage, cached=cached)
 
 
 def get_prompt(
@@ -1265,7 +1429,7 @@ def get_prompt(
 INVOKE_LOG_CACHE_DIR = store.get_cache_dir("people_like") / "log"
 
 
-async def write_ai_invoke_log_before_request(data: list[GroupMsg], group_id: int, message_id: int):
+async def write_ai_invoke_log_before_request(data: list[ContextMsg], group_id: int, message_id: int):
     """请求前写入AI调用日志文件，JSON格式"""
     # 获取当前时间戳
     now = datetime.now()
@@ -1359,9 +1523,7 @@ async def get_group_history(
 async def gen_message(msgs: list[GroupMsg]) -> Message:
     message = Message()
     for msg in msgs:
-        if msg.file_id is not None and len(msg.file_id) > 0:
-            async with aiofiles.open(ALL_IMAGE_FILE_CACHE_DIR / msg.file_id, "rb") as f:
-                content = await f.read()
+        if msg.file_id and (content := await IMAGE_CACHE.read(msg.file_id)) is not None:
             message.append(MessageSegment.image(content))
         else:
             message.append(MessageSegment.text(msg.content))
@@ -1471,6 +1633,10 @@ class MemberImpression(BaseModel):
     """印象内容"""
 
 
+IMPRESSION_MODEL = "gemini-2.5-flash-lite"
+"""生成群成员印象优先使用的模型"""
+
+
 @retry_on_exception(max_retries=5)
 async def request_for_impression_list(contents: list) -> list[MemberImpression]:
     prompt = f"""
@@ -1501,17 +1667,27 @@ async def request_for_impression_list(contents: list) -> list[MemberImpression]:
 
 """
 
-    resp = await _GEMINI_CLIENT.aio.models.generate_content(
-        model="gemini-2.5-flash-lite",
-        contents=contents,
-        config=GenerateContentConfig(
-            http_options=HttpOptions(timeout=6 * 60 * 1000),
-            system_instruction=prompt,
-            safety_settings=SAFETY_SETTINGS,
-            response_mime_type="application/json",
-            response_schema=list[MemberImpression],
-            thinking_config=ThinkingConfig(thinking_budget=10240),
-        ),
+    model = MODEL_ROUTER.prefer(IMPRESSION_MODEL)
+
+    async def send():
+        return await _GEMINI_CLIENT.aio.models.generate_content(
+            model=model,
+            contents=contents,
+            config=GenerateContentConfig(
+                http_options=HttpOptions(timeout=6 * 60 * 1000),
+                system_instruction=prompt,
+                safety_settings=SAFETY_SETTINGS,
+                response_mime_type="application/json",
+                response_schema=list[MemberImpression],
+                thinking_config=ThinkingConfig(thinking_budget=10240) if model.startswith("gemini-2.5") else None,
+            ),
+        )
+
+    resp = await GOVERNOR.call(
+        model,
+        lambda: MODEL_ROUTER.track(model, send),
+        priority=Priority.BATCH,
+        tokens=estimate_tokens(contents) + estimate_tokens(prompt),
     )
     impressions: list[MemberImpression] = resp.parsed  # type: ignore
     return impressions
@@ -1,9 +1,10 @@
 # 环境配置参数
 
-from typing import Optional
+from typing import Literal, Optional
 from pydantic import BaseModel, Field
 from nonebot import get_plugin_config
 
+from .index_profile import IndexProfile, IndexType
 
 
 class MilvusConfig(BaseModel):
@@ -14,6 +15,42 @@ class MilvusConfig(BaseModel):
     """密码"""
     uri: str = "http://localhost:19530"
     """连接地址"""
+    consistency_level: Literal["Strong", "Bounded", "Session", "Eventually"] = "Bounded"
+    """查询与搜索的一致性级别，Strong 每次搜索都需要等待所有写入同步完成"""
+    index_type: IndexType = "IVF_FLAT"
+    """图片向量索引类型，可选 IVF_FLAT、IVF_SQ8、HNSW、DISKANN"""
+    nlist: int = 128
+    """IVF 聚类中心数"""
+    nprobe: int = 8
+    """IVF 搜索的聚类数量"""
+    hnsw_m: int = 16
+    """HNSW 每个节点的最大连接数"""
+    hnsw_ef_construction: int = 200
+    """HNSW 构建时的候选集大小"""
+    hnsw_ef: int = 64
+    """HNSW 搜索时的候选集大小"""
+    diskann_search_list: int = 100
+    """DISKANN 搜索时的候选集大小"""
+
+    def index_profile(self, index_type: Optional[IndexType] = None) -> IndexProfile:
+        """生成索引配置，可指定索引类型"""
+        return IndexProfile(
+            index_type=index_type or self.index_type,
+            nlist=self.nlist,
+            nprobe=self.nprobe,
+            m=self.hnsw_m,
+            ef_construction=self.hnsw_ef_construction,
+            ef=self.hnsw_ef,
+            search_list=self.diskann_search_list,
+        )
+
+
+class RateLimit(BaseModel):
+    """单个模型的请求速率限制"""
+    rpm: int = 10
+    """每分钟请求数"""
+    tpm: int = 250000
+    """每分钟 token 数"""
 
 
 class Config(BaseModel):
@@ -29,20 +66,88 @@ class Config(BaseModel):
     """一个字最多花费多少时间"""
     image_analyze: bool = True
     """是否开启图片分析"""
+    image_analyze_concurrency: int = 3
+    """同时进行图片分析的最大请求数"""
+    ingest_workers: int = 4
+    """消息入库队列 worker 数量"""
+    ingest_queue_size: int = 1000
+    """消息入库队列最大积压数量"""
+    image_cache_max_mb: int = 2048
+    """群消息图片缓存最大占用空间（MB）"""
+    image_max_side: int = 1024
+    """发送给 Gemini 的图片最长边像素数，超过时缩小后重新编码"""
+    image_prep_quality: int = 85
+    """图片重新编码质量"""
+    image_prep_workers: int = 2
+    """图片预处理线程数"""
+    gif_frame_sample: int = 8
+    """GIF 动画发送给 Gemini 分析的帧数，0 表示全部帧"""
+    gif_frame_mode: Literal["even", "scene"] = "even"
+    """GIF 选帧方式，even 为均匀选取，scene 为选取画面变化最大的帧"""
+    gif_workers: int = 2
+    """GIF 拆帧进程数"""
+    memo_ttl_days: int = 30
+    """Gemini 图片描述与文本向量缓存有效天数"""
+    memo_max_rows: int = 100000
+    """Gemini 图片描述与文本向量缓存最大条数"""
+    context_cache_ttl: int = 600
+    """Gemini 上下文缓存有效秒数，0 表示不使用上下文缓存"""
+    context_cache_min_tokens: int = 4096
+    """上下文缓存的最少 token 数，低于该值的请求直接发送"""
+    context_cache_max_tail: int = 20
+    """缓存之后新增的消息超过该数量时重建上下文缓存"""
     gemini_key: Optional[str]
     """Gemini API Key"""
     gemini_base_url: Optional[str] = None
     """Gemini API Base URL"""
     gemini_model: str = "gemini-2.5-flash-lite"
     """Gemini 模型"""
+    gemini_rate_limits: dict[str, RateLimit] = Field(default_factory=dict)
+    """各模型的请求速率限制，未配置的模型使用 gemini_default_rate_limit"""
+    gemini_default_rate_limit: Optional[RateLimit] = None
+    """默认请求速率限制，为空时未单独配置的模型不限速"""
+    gemini_reserve_ratio: float = 0.2
+    """逐级预留的速率比例，各优先级只能使用该比例乘以优先级数值以上的额度，预留比例最多为 0.9"""
     query_len: int = 20
     """查询最近消息的数量"""
     search_len: int = 5
     """搜索相关消息的数量"""
     self_len: int = 10
     """查询自身发送消息的数量"""
+    reply_min_gap: float = 3
+    """同一群组两次回复之间的最小间隔秒数"""
+    hedge_budget_per_hour: int = 10
+    """每个群组每小时最多发起的对冲请求数"""
+    hedge_default_delay: float = 10
+    """模型没有延迟数据时，等待多少秒后发起对冲请求"""
+    hedge_min_delay: float = 2
+    """发起对冲请求前的最短等待秒数"""
     should_reply_len: int = 5
     """距离被回复的消息已经过去多少条消息，用于判断是否需要使用reply提及回复消息"""
+    migrate_concurrency: int = 4
+    """表情包迁移时同时分析的图片数量"""
+    migrate_page_size: int = 50
+    """表情包迁移每页处理的数据数量"""
+    retention_days: int = 7
+    """群消息默认保留天数，可按群组设置"""
+    retention_chunk_size: int = 1000
+    """清理过期消息时每次删除的数量"""
+    retention_chunk_pause: float = 0.2
+    """清理过期消息时两次删除之间的间隔秒数"""
+    retention_archive: bool = False
+    """删除前是否按天将过期消息归档为压缩 JSONL 文件"""
+    image_gc_grace_hours: int = 24
+    """没有消息引用的缓存图片超过多少小时未访问后删除"""
+    nickname_ttl: int = 60 * 60 * 24
+    """群成员昵称缓存多少秒后在后台刷新"""
+    nickname_stale_ttl: int = 60 * 60 * 24 * 7
+    """群成员昵称刷新失败时，过期后仍可继续使用的秒数"""
+    nickname_prefetch: bool = True
+    """bot 连接时是否批量获取所有群组的成员昵称"""
+    vector_backend: Literal["milvus", "local"] = "milvus"
+    """图片向量存储，local 为进程内 NumPy 索引，适用于表情包数量较少的部署"""
+    local_vector_fallback: bool = False
+    """使用 Milvus 时是否同时维护本地向量索引，Milvus 不可用时使用本地索引进行搜索"""
     milvus: MilvusConfig = Field(default_factory=MilvusConfig)
     """Milvus 配置"""
 
@@ -0,0 +1,184 @@
+# 对话上下文缓存
+
+import asyncio
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from enum import Enum
+from typing import Optional
+from nonebot import get_bot
+from nonebot_plugin_orm import get_session
+from sqlalchemy import select
+from google.genai.types import Part
+
+from .image_prep import load_image_part
+from .model import GroupMsg
+from .nickname import get_user_nickname_of_group
+from .word_filter import WORD_FILTER
+
+
+class Character(Enum):
+    BOT = 1
+    USER = 2
+
+
+@dataclass
+class ChatMsg:
+    sender: Character
+    content: list[Part]
+
+
+@dataclass
+class ContextMsg:
+    """脱离数据库会话的消息记录，附带已生成的 Part"""
+
+    id: int
+    message_id: Optional[int]
+    group_id: int
+    user_id: int
+    self_msg: bool
+    to_me: bool
+    index: int
+    nick_name: str
+    content: str
+    file_id: Optional[str]
+    time: int
+    chat: Optional[ChatMsg] = field(default=None, repr=False)
+
+    @classmethod
+    def from_model(cls, msg: GroupMsg) -> "ContextMsg":
+        """从数据库实体复制，需在会话内调用"""
+        return cls(
+            id=msg.id,
+            message_id=msg.message_id,
+            group_id=msg.group_id,
+            user_id=msg.user_id,
+            self_msg=msg.self_msg,
+            to_me=msg.to_me,
+            index=msg.index,
+            nick_name=msg.nick_name,
+            content=msg.content,
+            file_id=msg.file_id,
+            time=msg.time,
+        )
+
+
+async def build_message_content(item: GroupMsg | ContextMsg) -> ChatMsg:
+    """提取数据库中的消息元素，将其转为特定格式的文本消息内容"""
+    bot = get_bot()
+    if item.self_msg:
+        character = Character.BOT
+    else:
+        character = Character.USER
+        # 生成 parts
+    # TODO 这块或许也需要处理 GIF 分帧动画
+    # nick_name = item.nick_name
+    nick_name = await get_user_nickname_of_group(item.group_id, item.user_id)
+    user_id = item.user_id
+    formatted_time = datetime.fromtimestamp(item.time).strftime("%Y-%m-%d %H:%M:%S")
+    if item.file_id and (image_part := await load_image_part(item.file_id)) is not None:
+        # 判断为图片消息，图片已被淘汰时按文本描述处理
+        parts = []
+        parts.append(Part.from_text(text=f"[{nick_name}<{user_id}>{{{formatted_time}}}]"))
+        if item.to_me:
+            parts.append(Part.from_text(text=f"@{bot.self_id} "))
+        parts.append(image_part)
+        return ChatMsg(sender=character, content=parts)
+    elif not item.message_id:
+        # 判断为 notice 消息
+        parts = []
+        parts.append(Part.from_text(text=f"[Notice{{{formatted_time}}}]"))
+        parts.append(Part.from_text(text=str(item.content)))
+        return ChatMsg(sender=character, content=parts)
+    else:
+        # 判断是否为通知消息
+        parts = []
+        parts.append(Part.from_text(text=f"[{nick_name}<{user_id}>{{{formatted_time}}}]"))
+        if item.to_me:
+            parts.append(Part.from_text(text=f"@{bot.self_id} "))
+        parts.append(Part.from_text(text=str(item.content)))
+        return ChatMsg(sender=character, content=parts)
+
+
+@dataclass
+class GroupContext:
+    """单个群组的上下文窗口"""
+
+    context_size: int
+    enable_notice: bool
+    messages: list[ContextMsg] = field(default_factory=list)
+
+
+class ContextBuffer:
+    """按群组缓存最近 context_size 条消息及其 Part
+
+    首次回复时从数据库加载，之后入库的消息直接追加，回复时只需为新消息生成 Part
+    """
+
+    def __init__(self) -> None:
+        self.groups: dict[int, GroupContext] = {}
+        self.locks: defaultdict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    async def get(self, group_id: int, context_size: int, enable_notice: bool) -> list[ContextMsg]:
+        """获取群组上下文，按时间升序排列，群组设置变化时重新加载"""
+        async with self.locks[group_id]:
+            group = self.groups.get(group_id)
+            if group is None or group.context_size != context_size or group.enable_notice != enable_notice:
+                group = await self.load(group_id, context_size, enable_notice)
+                self.groups[group_id] = group
+            return list(group.messages)
+
+    async def load(self, group_id: int, context_size: int, enable_notice: bool) -> GroupContext:
+        """从数据库加载群组上下文"""
+        query = select(GroupMsg).where(GroupMsg.group_id == group_id)
+        if not enable_notice:
+            query = query.where(GroupMsg.message_id.is_not(None))
+        async with get_session() as session:
+            rows = [
+                ContextMsg.from_model(msg)
+                for msg in await session.scalars(query.order_by(GroupMsg.time.desc()).limit(context_size))
+            ]
+        rows.sort(key=lambda x: (x.time, x.id))
+        for row in rows:
+            row.chat = await build_message_content(row)
+        return GroupContext(context_size=context_size, enable_notice=enable_notice, messages=rows)
+
+    async def append(self, rows: list[ContextMsg]):
+        """追加新入库的消息，只处理已加载过上下文的群组"""
+        for row in rows:
+            if row.group_id not in self.groups:
+                continue
+            async with self.locks[row.group_id]:
+                group = self.groups.get(row.group_id)
+                if group is None or (not group.enable_notice and not row.message_id):
+                    continue
+                if any(msg.id == row.id for msg in group.messages):
+                    continue
+                if row.chat is None:
+                    row.chat = await build_message_content(row)
+                group.messages.append(row)
+                group.messages.sort(key=lambda x: (x.time, x.id))
+                del group.messages[: max(len(group.messages) - group.context_size, 0)]
+
+    def invalidate(self, group_id: Optional[int] = None):
+        """清除上下文缓存，不指定群组时清除全部"""
+        if group_id is None:
+            self.groups.clear()
+        else:
+            self.groups.pop(group_id, None)
+
+
+CONTEXT_BUFFER = ContextBuffer()
+"""群组上下文缓存"""
+
+
+async def add_group_msgs(session, msgs: list[GroupMsg]):
+    """在会话中写入消息并提交，提交后追加到上下文缓存"""
+    session.add_all(msgs)
+    await session.flush()
+    rows = [ContextMsg.from_model(msg) for msg in msgs]
+    await session.commit()
+    await CONTEXT_BUFFER.append(rows)
+    for row in rows:
+        if row.self_msg:
+            WORD_FILTER.record(row.group_id, [row.file_id if row.file_id else row.content])
@@ -0,0 +1,179 @@
+# Gemini 上下文缓存
+
+import asyncio
+import hashlib
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Optional
+from nonebot import get_driver, logger
+from google.genai.types import CreateCachedContentConfig, GenerateContentResponseUsageMetadata, ToolConfig
+
+from .config import plugin_config
+from .governor import GOVERNOR, Priority, estimate_tokens
+from .vector import _GEMINI_CLIENT
+
+_EXPIRE_MARGIN = 30
+"""缓存到期前多少秒视为失效，避免请求途中过期"""
+
+_CREATE_FAIL_BACKOFF = 5 * 60
+"""创建缓存失败后多少秒内不再尝试"""
+
+
+@dataclass
+class CacheEntry:
+    name: str
+    """缓存名称"""
+    fingerprint: str
+    """提示词、工具与模型的指纹"""
+    prefix_ids: list[int]
+    """已缓存的历史消息 id"""
+    expire_at: float
+    """本地记录的过期时间"""
+
+
+class ContextCacheManager:
+    """按群组维护显式上下文缓存
+
+    缓存内容为系统提示词、工具声明与较早的历史消息，之后的请求只发送缓存之后新增的消息。
+    上下文窗口滑动时，已移出窗口的早期消息仍保留在缓存中，直到新增消息超过 max_tail 条后重建缓存
+    """
+
+    def __init__(self, ttl: int, min_tokens: int, max_tail: int) -> None:
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.max_tail = max_tail
+        self.entries: dict[int, CacheEntry] = {}
+        self.prompt_tokens: dict[int, int] = {}
+        """各群组最近一次未使用缓存时的输入 token 数"""
+        self.fail_until: dict[int, float] = {}
+        self.locks: defaultdict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    @staticmethod
+    def make_fingerprint(model: str, prompt: str, tools: list, tool_config: Optional[ToolConfig]) -> str:
+        digest = hashlib.sha256(model.encode())
+        digest.update(prompt.encode())
+        for tool in tools:
+            digest.update(tool.model_dump_json(exclude_none=True).encode())
+        if tool_config is not None:
+            digest.update(tool_config.model_dump_json(exclude_none=True).encode())
+        return digest.hexdigest()
+
+    def match_tail(self, entry: CacheEntry, ids: list[int]) -> Optional[int]:
+        """返回缓存之后新增消息在当前上下文中的起始位置，缓存内容与当前上下文不连续时返回 None"""
+        if not entry.prefix_ids or entry.prefix_ids[-1] not in ids:
+            return None
+        anchor = ids.index(entry.prefix_ids[-1]) + 1
+        # 当前上下文中与缓存重叠的部分必须完全一致
+        if entry.prefix_ids[-anchor:] != ids[:anchor]:
+            return None
+        return anchor
+
+    async def prepare(
+        self,
+        group_id: int,
+        model: str,
+        prompt: str,
+        tools: list,
+        tool_config: Optional[ToolConfig],
+        ids: list[int],
+        contents: list[dict[str, Any]],
+    ) -> tuple[Optional[str], list[dict[str, Any]]]:
+        """获取可用的缓存名称以及需要发送的消息，无法使用缓存时返回 None 与完整消息"""
+        if not self.enabled or len(contents) < 2:
+            return None, contents
+        fingerprint = self.make_fingerprint(model, prompt, tools, tool_config)
+        async with self.locks[group_id]:
+            now = time.time()
+            entry = self.entries.get(group_id)
+            if entry is not None and entry.fingerprint == fingerprint and entry.expire_at > now:
+                anchor = self.match_tail(entry, ids)
+                if anchor is not None and len(contents) - anchor <= self.max_tail:
+                    return entry.name, contents[anchor:]
+            if self.prompt_tokens.get(group_id, 0) < self.min_tokens or self.fail_until.get(group_id, 0) > now:
+                return None, contents
+            # 重建缓存，最新一条消息不进入缓存
+            await self.drop(group_id)
+            try:
+                # 创建缓存同样计入模型的速率限制
+                cached = await GOVERNOR.call(
+                    model,
+                    lambda: _GEMINI_CLIENT.aio.caches.create(
+                        model=model,
+                        config=CreateCachedContentConfig(
+                            display_name=f"people_like_{group_id}",
+                            system_instruction=prompt,
+                            tools=tools,
+                            tool_config=tool_config,
+                            contents=contents[:-1],  # type: ignore
+                            ttl=f"{self.ttl}s",
+                        ),
+                    ),
+                    Priority.INTERACTIVE,
+                    estimate_tokens(contents[:-1]) + estimate_tokens(prompt),
+                )
+            except Exception as e:
+                logger.warning(f"群{group_id}创建上下文缓存失败：{repr(e)}")
+                self.fail_until[group_id] = now + _CREATE_FAIL_BACKOFF
+                return None, contents
+            if not cached.name:
+                return None, contents
+            self.entries[group_id] = CacheEntry(
+                name=cached.name,
+                fingerprint=fingerprint,
+                prefix_ids=ids[:-1],
+                expire_at=now + self.ttl - _EXPIRE_MARGIN,
+            )
+            cached_tokens = cached.usage_metadata.total_token_count if cached.usage_metadata else None
+            logger.info(f"群{group_id}已创建上下文缓存，缓存{len(ids) - 1}条消息，共{cached_tokens}个token")
+            return cached.name, contents[-1:]
+
+    def record_usage(self, group_id: int, usage: Optional[GenerateContentResponseUsageMetadata], cached: bool):
+        """记录 token 用量，用于判断是否值得创建缓存"""
+        if usage is None:
+            return
+        prompt_tokens = usage.prompt_token_count or 0
+        cached_tokens = usage.cached_content_token_count or 0
+        if not cached:
+            self.prompt_tokens[group_id] = prompt_tokens
+        logger.info(
+            f"群{group_id}本次请求总token数{usage.total_token_count}，输入{prompt_tokens}，"
+            f"其中缓存{cached_tokens}，未缓存{prompt_tokens - cached_tokens}"
+        )
+
+    async def drop(self, group_id: int):
+        """删除群组的上下文缓存"""
+        entry = self.entries.pop(group_id, None)
+        if entry is None:
+            return
+        try:
+            await _GEMINI_CLIENT.aio.caches.delete(name=entry.name)
+        except Exception as e:
+            logger.debug(f"删除上下文缓存{entry.name}失败：{repr(e)}")
+
+    def invalidate(self, group_id: int):
+        """缓存请求失败时调用，之后的请求重新创建缓存"""
+        task = asyncio.create_task(self.drop(group_id))
+        _BACKGROUND_TASKS.add(task)
+        task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+    async def clear(self):
+        """删除所有上下文缓存"""
+        await asyncio.gather(*(self.drop(group_id) for group_id in list(self.entries)))
+
+
+_BACKGROUND_TASKS: set[asyncio.Task] = set()
+
+CONTEXT_CACHE = ContextCacheManager(
+    plugin_config.context_cache_ttl, plugin_config.context_cache_min_tokens, plugin_config.context_cache_max_tail
+)
+"""Gemini 上下文缓存"""
+
+
+@get_driver().on_shutdown
+async def clear_context_cache():
+    await CONTEXT_CACHE.clear()
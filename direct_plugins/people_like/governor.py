@@ -0,0 +1,295 @@
+# Gemini 请求速率控制
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+from nonebot import on_command
+from nonebot.matcher import Matcher
+from nonebot.permission import SUPERUSER
+from nonebot.rule import to_me
+from google.genai.errors import APIError
+from google.genai.types import Content, Part
+
+from .config import RateLimit, plugin_config
+
+T = TypeVar("T")
+
+
+class Priority(IntEnum):
+    """请求优先级，数值越小越优先"""
+
+    INTERACTIVE = 0
+    """聊天回复"""
+    RELEVANCE = 1
+    """回复相关性判断"""
+    INGESTION = 2
+    """消息入库时的图片分析与审核"""
+    BATCH = 3
+    """定时任务与数据迁移"""
+
+
+DEFAULT_DEADLINE: dict[Priority, float] = {
+    Priority.INTERACTIVE: 60,
+    Priority.RELEVANCE: 20,
+    Priority.INGESTION: 5 * 60,
+    Priority.BATCH: 60 * 60,
+}
+"""各优先级请求的默认最长排队秒数"""
+
+
+class GovernorTimeout(Exception):
+    """请求排队超过期限"""
+
+
+_PRIORITY: ContextVar[Optional[Priority]] = ContextVar("gemini_request_priority", default=None)
+
+
+@contextmanager
+def request_priority(priority: Priority):
+    """指定当前上下文中 Gemini 请求的优先级，用于后台任务降低其中所有请求的优先级"""
+    token = _PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+def estimate_tokens(contents: Any) -> int:
+    """粗略估算请求内容的 token 数，文本按两个字符一个 token，图片按 258 个 token"""
+    if contents is None:
+        return 0
+    if isinstance(contents, str):
+        return len(contents) // 2 + 1
+    if isinstance(contents, (list, tuple)):
+        return sum(estimate_tokens(item) for item in contents)
+    if isinstance(contents, dict):
+        return estimate_tokens(contents.get("parts"))
+    if isinstance(contents, Content):
+        return estimate_tokens(contents.parts)
+    if isinstance(contents, Part):
+        if contents.text is not None:
+            return len(contents.text) // 2 + 1
+        return 258
+    return 0
+
+
+class TokenBucket:
+    """每分钟恢复 per_minute 个令牌的令牌桶，允许欠额，欠额在之后的恢复中偿还"""
+
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(max(per_minute, 1))
+        self.rate = self.capacity / 60
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, floor: float, now: float) -> float:
+        """取出 amount 个令牌后剩余不低于 floor 比例所需等待的秒数"""
+        self.refill(now)
+        reserve = self.capacity * floor
+        # 超过可用额度的请求按可用额度计算，避免永远无法满足
+        amount = min(amount, self.capacity - reserve)
+        return max(0.0, (amount + reserve - self.tokens) / self.rate)
+
+    def take(self, amount: float):
+        self.tokens -= amount
+
+    def drain(self):
+        self.tokens = min(self.tokens, 0)
+
+
+@dataclass(order=True)
+class Waiter:
+    priority: int
+    seq: int
+    tokens: int = field(compare=False)
+    deadline: float = field(compare=False)
+    enqueued: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+
+
+@dataclass
+class PriorityStats:
+    granted: int = 0
+    timeout: int = 0
+    wait_total: float = 0
+    wait_max: float = 0
+
+
+class ModelGovernor:
+    """单个模型的请求排队与限速"""
+
+    def __init__(self, model: str, limit: Optional[RateLimit], reserve_ratio: float) -> None:
+        self.model = model
+        self.rpm = TokenBucket(limit.rpm) if limit is not None else None
+        self.tpm = TokenBucket(limit.tpm) if limit is not None else None
+        self.reserve_ratio = reserve_ratio
+        self.heap: list[Waiter] = []
+        self.seq = itertools.count()
+        self.wake = asyncio.Event()
+        self.dispatcher: Optional[asyncio.Task] = None
+        self.stats: defaultdict[Priority, PriorityStats] = defaultdict(PriorityStats)
+        self.rate_limited = 0
+
+    MAX_FLOOR = 0.9
+    """预留比例上限，保证最低优先级的请求仍有额度可用"""
+
+    def floor(self, priority: Priority) -> float:
+        """各优先级只能使用 reserve_ratio * priority 以上的额度，优先级越低预留给更高优先级的额度越多"""
+        return min(self.reserve_ratio * priority, self.MAX_FLOOR)
+
+    async def acquire(self, priority: Priority, tokens: int, timeout: float):
+        """排队等待额度，超过期限时抛出 GovernorTimeout"""
+        if self.rpm is None:
+            # 未配置限速的模型直接放行
+            self.stats[priority].granted += 1
+            return
+        now = time.monotonic()
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.heap, Waiter(priority, next(self.seq), tokens, now + timeout, now, future))
+        if self.dispatcher is None or self.dispatcher.done():
+            self.dispatcher = asyncio.create_task(self._dispatch())
+        self.wake.set()
+        await future
+
+    async def _dispatch(self):
+        assert self.rpm is not None and self.tpm is not None
+        while self.heap:
+            waiter = self.heap[0]
+            now = time.monotonic()
+            if waiter.future.done():
+                # 调用方已取消
+                heapq.heappop(self.heap)
+                continue
+            stats = self.stats[Priority(waiter.priority)]
+            if waiter.deadline <= now:
+                heapq.heappop(self.heap)
+                stats.timeout += 1
+                waiter.future.set_exception(
+                    GovernorTimeout(f"模型{self.model}请求排队超过{now - waiter.enqueued:.0f}秒")
+                )
+                continue
+            floor = self.floor(Priority(waiter.priority))
+            wait = max(self.rpm.wait_time(1, floor, now), self.tpm.wait_time(waiter.tokens, floor, now))
+            if wait <= 0:
+                heapq.heappop(self.heap)
+                self.rpm.take(1)
+                self.tpm.take(waiter.tokens)
+                waited = now - waiter.enqueued
+                stats.granted += 1
+                stats.wait_total += waited
+                stats.wait_max = max(stats.wait_max, waited)
+                waiter.future.set_result(None)
+                continue
+            # 等待额度恢复，期间有新请求到达时重新选择
+            self.wake.clear()
+            try:
+                await asyncio.wait_for(self.wake.wait(), timeout=min(wait, waiter.deadline - now))
+            except asyncio.TimeoutError:
+                pass
+
+    def settle(self, estimated: int, actual: Optional[int]):
+        """按实际用量修正 token 额度"""
+        if actual is not None and self.tpm is not None:
+            self.tpm.take(actual - estimated)
+
+    def on_rate_limited(self):
+        """收到 429 时清空额度，之后的请求等待恢复"""
+        self.rate_limited += 1
+        if self.rpm is not None and self.tpm is not None:
+            self.rpm.drain()
+            self.tpm.drain()
+
+    def report(self) -> str:
+        if self.rpm is None or self.tpm is None:
+            lines = [f"{self.model}：不限速，429 {self.rate_limited}次"]
+        else:
+            now = time.monotonic()
+            self.rpm.refill(now)
+            self.tpm.refill(now)
+            lines = [
+                f"{self.model}：排队{len(self.heap)}，RPM 余量{self.rpm.tokens:.1f}/{self.rpm.capacity:.0f}，"
+                f"TPM 余量{self.tpm.tokens:.0f}/{self.tpm.capacity:.0f}，429 {self.rate_limited}次"
+            ]
+        for priority, stats in sorted(self.stats.items()):
+            avg = stats.wait_total / stats.granted if stats.granted else 0
+            lines.append(
+                f"  {priority.name}：放行{stats.granted}，超时{stats.timeout}，"
+                f"平均等待{avg:.2f}秒，最长等待{stats.wait_max:.2f}秒"
+            )
+        return "\n".join(lines)
+
+
+class Governor:
+    """所有 Gemini 请求的统一入口，按模型限速并按优先级排队"""
+
+    def __init__(
+        self, limits: dict[str, RateLimit], default_limit: Optional[RateLimit], reserve_ratio: float
+    ) -> None:
+        self.limits = limits
+        self.default_limit = default_limit
+        self.reserve_ratio = reserve_ratio
+        self.models: dict[str, ModelGovernor] = {}
+
+    def get(self, model: str) -> ModelGovernor:
+        if (governor := self.models.get(model)) is None:
+            governor = ModelGovernor(model, self.limits.get(model, self.default_limit), self.reserve_ratio)
+            self.models[model] = governor
+        return governor
+
+    async def call(
+        self,
+        model: str,
+        func: Callable[[], Awaitable[T]],
+        priority: Priority = Priority.INTERACTIVE,
+        tokens: int = 1000,
+        timeout: Optional[float] = None,
+    ) -> T:
+        """等待额度后执行请求
+
+        Args:
+            model (str): 模型名称
+            func (Callable[[], Awaitable[T]]): 发起请求的函数
+            priority (Priority): 默认优先级，上下文中通过 request_priority 指定时以上下文为准
+            tokens (int): 预估 token 数，请求完成后按 usage_metadata 修正
+            timeout (Optional[float]): 最长排队秒数
+        """
+        if (context_priority := _PRIORITY.get()) is not None:
+            priority = context_priority
+        governor = self.get(model)
+        await governor.acquire(priority, tokens, timeout if timeout is not None else DEFAULT_DEADLINE[priority])
+        try:
+            result = await func()
+        except APIError as e:
+            if e.code == 429:
+                governor.on_rate_limited()
+            raise
+        usage = getattr(result, "usage_metadata", None)
+        governor.settle(tokens, getattr(usage, "total_token_count", None))
+        return result
+
+    def report(self) -> str:
+        if not self.models:
+            return "暂无请求"
+        return "\n".join(governor.report() for governor in self.models.values())
+
+
+GOVERNOR = Governor(
+    plugin_config.gemini_rate_limits, plugin_config.gemini_default_rate_limit, plugin_config.gemini_reserve_ratio
+)
+"""Gemini 请求速率控制"""
+
+
+@on_command("请求状态", permission=SUPERUSER, rule=to_me(), priority=1, block=True).handle()
+async def governor_status(matcher: Matcher):
+    await matcher.finish(GOVERNOR.report())
@@ -0,0 +1,172 @@
+# 群消息图片缓存
+
+import asyncio
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+import aiofiles
+from httpx import AsyncClient
+from nonebot import logger
+from nonebot_plugin_orm import get_session
+from sqlalchemy import select
+import nonebot_plugin_localstore as store
+
+from .config import plugin_config
+from .model import GroupMsg
+
+ALL_IMAGE_FILE_CACHE_DIR = store.get_cache_dir("people_like") / "all"
+
+
+class ImageCache:
+    """以 QQ 图片 file id 为键的图片缓存
+
+    file id 由图片内容计算得到，相同图片重复发送时直接复用本地文件以及已经分析过的图片描述，
+    磁盘占用超过上限时按最近访问时间淘汰
+    """
+
+    def __init__(self, directory: Path, max_bytes: int, description_size: int = 4096) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.description_size = description_size
+        self.descriptions: OrderedDict[str, str] = OrderedDict()
+        self.downloading: dict[str, asyncio.Future[Optional[bytes]]] = {}
+        self.size: Optional[int] = None
+        self.evicting = False
+        self.file_hit = 0
+        self.file_miss = 0
+        self.description_hit = 0
+        self.description_miss = 0
+
+    def path(self, file_id: str) -> Path:
+        return self.directory / file_id
+
+    async def read(self, file_id: str) -> Optional[bytes]:
+        """读取缓存图片，不存在（如已被淘汰）时返回 None"""
+        file_path = self.path(file_id)
+        try:
+            async with aiofiles.open(file_path, "rb") as f:
+                content = await f.read()
+        except FileNotFoundError:
+            return None
+        # 更新访问时间，供 LRU 淘汰使用
+        os.utime(file_path)
+        return content
+
+    async def fetch(self, file_id: str, url: str, client: AsyncClient) -> Optional[bytes]:
+        """获取图片内容，本地已有则直接读取，否则下载，同一图片并发请求只下载一次"""
+        if (content := await self.read(file_id)) is not None:
+            self.file_hit += 1
+            return content
+        if (pending := self.downloading.get(file_id)) is not None:
+            return await pending
+        self.file_miss += 1
+        future: asyncio.Future[Optional[bytes]] = asyncio.get_running_loop().create_future()
+        self.downloading[file_id] = future
+        try:
+            content = await self._download(file_id, url, client)
+            future.set_result(content)
+            return content
+        except Exception as e:
+            future.set_exception(e)
+            # 避免没有其他等待者时出现未获取异常的警告
+            future.exception()
+            raise
+        finally:
+            self.downloading.pop(file_id, None)
+
+    async def _download(self, file_id: str, url: str, client: AsyncClient) -> Optional[bytes]:
+        data = await client.get(url)
+        if data.status_code != 200:
+            return None
+        await self.write(file_id, data.content)
+        return data.content
+
+    async def write(self, file_id: str, content: bytes):
+        """写入缓存文件，超出上限时触发淘汰"""
+        file_path = self.path(file_id)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        async with aiofiles.open(file_path, "wb") as f:
+            await f.write(content)
+        if self.size is not None:
+            self.size += len(content)
+        if self.size is None or self.size > self.max_bytes:
+            self.schedule_evict()
+
+    async def get_description(self, file_id: str) -> Optional[str]:
+        """获取已分析过的图片描述，优先读取内存，其次读取数据库中的历史消息"""
+        if (description := self.descriptions.get(file_id)) is not None:
+            self.descriptions.move_to_end(file_id)
+            self.description_hit += 1
+            return description
+        async with get_session() as session:
+            description = await session.scalar(
+                select(GroupMsg.content).where(GroupMsg.file_id == file_id).where(GroupMsg.content != "").limit(1)
+            )
+        if description:
+            self.description_hit += 1
+            self.remember_description(file_id, description)
+            return description
+        self.description_miss += 1
+        return None
+
+    def remember_description(self, file_id: str, description: str):
+        """记录图片描述"""
+        self.descriptions[file_id] = description
+        self.descriptions.move_to_end(file_id)
+        while len(self.descriptions) > self.description_size:
+            self.descriptions.popitem(last=False)
+
+    def schedule_evict(self):
+        """在后台线程中执行淘汰"""
+        if self.evicting:
+            return
+        self.evicting = True
+
+        async def run():
+            try:
+                await asyncio.to_thread(self.evict)
+            except Exception as e:
+                logger.error(f"图片缓存淘汰失败：{repr(e)}")
+            finally:
+                self.evicting = False
+
+        asyncio.create_task(run())
+
+    def evict(self):
+        """按最近访问时间淘汰文件，直到占用低于上限的 90%"""
+        if not self.directory.exists():
+            self.size = 0
+            return
+        files: list[tuple[float, int, Path]] = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, Path(entry.path)))
+        total = sum(size for _, size, _ in files)
+        if total > self.max_bytes:
+            target = int(self.max_bytes * 0.9)
+            removed = 0
+            for _, size, file_path in sorted(files):
+                if total <= target:
+                    break
+                file_path.unlink(missing_ok=True)
+                total -= size
+                removed += 1
+            logger.info(f"图片缓存超出上限，已淘汰{removed}个文件，当前占用{total / 1024 / 1024:.1f}MB")
+        self.size = total
+
+    def report(self) -> str:
+        """缓存状态报告"""
+        size = "未统计" if self.size is None else f"{self.size / 1024 / 1024:.1f}MB"
+        return "\n".join(
+            [
+                f"图片缓存占用：{size}/{self.max_bytes / 1024 / 1024:.0f}MB",
+                f"图片文件命中：{self.file_hit}，未命中：{self.file_miss}",
+                f"图片描述命中：{self.description_hit}，未命中：{self.description_miss}",
+            ]
+        )
+
+
+IMAGE_CACHE = ImageCache(ALL_IMAGE_FILE_CACHE_DIR, plugin_config.image_cache_max_mb * 1024 * 1024)
+"""群消息图片缓存"""
@@ -0,0 +1,52 @@
+# 发送给 Gemini 前的图片预处理
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from nonebot import get_driver, logger
+from google.genai.types import Part
+
+from common.image import PREPARED_SUFFIX, prepare_image, sniff_mime_type
+
+from .config import plugin_config
+from .image_cache import IMAGE_CACHE
+
+_PREP_EXECUTOR = ThreadPoolExecutor(max_workers=plugin_config.image_prep_workers, thread_name_prefix="image_prep")
+"""图片预处理线程池"""
+
+
+def sidecar_name(file_id: str) -> str:
+    """预处理结果与原图保存在同一目录"""
+    return f"{file_id}.prep.{PREPARED_SUFFIX}"
+
+
+async def load_image_part(file_id: str, content: Optional[bytes] = None) -> Optional[Part]:
+    """读取缩放并重新编码后的图片，预处理失败时使用原图，原图不存在或无法识别时返回 None
+
+    Args:
+        file_id (str): 图片 file id
+        content (Optional[bytes]): 已读取的原图内容，为空时从图片缓存中读取
+    """
+    if (prepared := await IMAGE_CACHE.read(sidecar_name(file_id))) is not None:
+        return Part.from_bytes(data=prepared, mime_type=f"image/{PREPARED_SUFFIX}")
+    if content is None and (content := await IMAGE_CACHE.read(file_id)) is None:
+        return None
+    try:
+        data, mime_type, reencoded = await asyncio.get_running_loop().run_in_executor(
+            _PREP_EXECUTOR, prepare_image, content, plugin_config.image_max_side, plugin_config.image_prep_quality
+        )
+    except Exception as e:
+        if (mime_type := sniff_mime_type(content)) is None:
+            logger.warning(f"图片{file_id}预处理失败：{repr(e)}")
+            return None
+        logger.warning(f"图片{file_id}预处理失败，使用原图：{repr(e)}")
+        return Part.from_bytes(data=content, mime_type=mime_type)
+    if reencoded:
+        # 原图可以直接使用时不保存副本，下次仍只需读取图片头
+        await IMAGE_CACHE.write(sidecar_name(file_id), data)
+    return Part.from_bytes(data=data, mime_type=mime_type)
+
+
+@get_driver().on_shutdown
+async def shutdown_image_prep():
+    _PREP_EXECUTOR.shutdown(wait=False, cancel_futures=True)
@@ -4,23 +4,27 @@ import random
 import time
 import os
 import asyncio
+import multiprocessing
 import typing_extensions
 import json
-import aiofiles
-import io
 from typing import Literal, Optional
 from pydantic import BaseModel
 from httpx import AsyncClient
 from aiofiles import open as aopen
 from nonebot_plugin_orm import get_session
-from sqlalchemy import select, update
+from sqlalchemy import func, select, update
 from nonebot import get_bot, logger, on_command, on_message, get_driver
+from nonebot.matcher import Matcher
+from nonebot.permission import SUPERUSER
+from nonebot.rule import to_me
 from nonebot.adapters.onebot.v11 import GroupMessageEvent, MessageEvent, MessageSegment, Bot as OB11Bot
 from nonebot.adapters.onebot.utils import b2s, f2s
 import nonebot_plugin_localstore as store  # noqa: E402
 from pathlib import Path
 
-from PIL import Image, ImageSequence
+from concurrent.futures import ProcessPoolExecutor
+
+from common.image import extract_gif_frames
 
 
 from google.genai.types import (
@@ -35,9 +39,22 @@ from google.genai.types import (
     UploadFileConfig,
 )
 
-from .model import ImageSender
+from nonebot_plugin_waiter import suggest
+
+from .config import plugin_config
+from .index_profile import INDEX_TYPES, IndexType
+from .model import ImageSender, JobCheckpoint
 from .setting import get_value_or_default
-from .vector import _GEMINI_CLIENT, VectorDataImage, get_text_embedding, get_milvus_vector_client, analysis_image_to_str_description
+from .vector import (
+    _GEMINI_CLIENT,
+    VectorDataImage,
+    get_text_embedding,
+    get_text_embeddings,
+    get_milvus_vector_client,
+    analysis_image_to_str_description,
+)
+from .local_vector import get_vector_client
+from .governor import GOVERNOR, Priority, estimate_tokens, request_priority
 
 
 EMOJI_DIR_PATH = store.get_data_dir("people_like") / "image"
@@ -76,9 +93,14 @@ async def get_file_name_of_image_will_sent_by_description_vec(description: str,
     """
     global _GEMINI_CLIENT
     # 先查数据库里所有的动画表情
-    milvus_client = await get_milvus_vector_client()
+    vector_client = await get_vector_client()
     vec_data = await get_text_embedding(description)
-    search_data_result: list[VectorDataImage] = await milvus_client.search_image_data([vec_data], file_id=True, search_len=10)
+    if not vec_data:
+        logger.warning(f"群聊 {group_id} 获取描述信息的向量失败")
+        return None
+    search_data_result: list[VectorDataImage] = await vector_client.search_image_data(
+        [vec_data], file_id=True, search_len=10, projection="send"
+    )
     file_ids = [item.name for item in search_data_result if item.name is not None]
     logger.debug(f"群聊 {group_id} 获取图片id，返回结果：{file_ids}")
     if search_data_result:
@@ -206,15 +228,20 @@ async def analysis_image_trait(file_part: list[Part], group_id: int = 0) -> Anal
     prompt = "根据给出的图片内容，判断是否含有色情内容，暴力内容或日本动漫形象内容，返回指定数据类型"
     file_part.append(Part.from_text(text="分析图片是否包含色情内容，暴力内容或日本动漫形象内容"))
     contents: ContentListUnion = [Content(role="user", parts=file_part)]
-    resp = await _GEMINI_CLIENT.aio.models.generate_content(
-        model="gemini-2.5-flash-lite",
-        contents=contents,
-        config=GenerateContentConfig(
-            system_instruction=prompt,
-            response_mime_type="application/json",
-            response_schema=AnalysisResult,
-            safety_settings=SAFETY_SETTINGS,
+    resp = await GOVERNOR.call(
+        "gemini-2.5-flash-lite",
+        lambda: _GEMINI_CLIENT.aio.models.generate_content(
+            model="gemini-2.5-flash-lite",
+            contents=contents,
+            config=GenerateContentConfig(
+                system_instruction=prompt,
+                response_mime_type="application/json",
+                response_schema=AnalysisResult,
+                safety_settings=SAFETY_SETTINGS,
+            ),
         ),
+        priority=Priority.INGESTION,
+        tokens=estimate_tokens(contents),
     )
 
     logger.debug(f"分析图片成功，返回结果：{resp.text}")
@@ -281,6 +308,7 @@ async def add_image(event: GroupMessageEvent):
     if not EMOJI_DIR_PATH.exists():
         EMOJI_DIR_PATH.mkdir(parents=True)
     ms = event.message.include("image")
+    pending_vec_data: list[VectorDataImage] = []
     for m in ms:
         url = m.data["url"]
         file_name = str(m.data.get("file"))
@@ -330,24 +358,21 @@ async def add_image(event: GroupMessageEvent):
                         parts = [Part.from_text(text="Summarize the content of the following set of pictures, using multiple tags to describe them, at least 40 tags")]
                         parts.extend(await process_image_file(EMOJI_DIR_PATH.joinpath(file_name)))
                         content = await analysis_image_to_str_description(parts=parts)
-                        vec = await get_text_embedding(content)
 
-                        image_vec_data = VectorDataImage(
-                            description=content,
-                            name=file_name,
-                            summary=summary,
-                            mime_type=mime_type,
-                            file_size=file_size,
-                            key=str(key),
-                            emoji_id=str(emoji_id),
-                            emoji_package_id=str(emoji_package_id),
-                            vec=vec,
+                        pending_vec_data.append(
+                            VectorDataImage(
+                                description=content,
+                                name=file_name,
+                                summary=summary,
+                                mime_type=mime_type,
+                                file_size=file_size,
+                                key=str(key),
+                                emoji_id=str(emoji_id),
+                                emoji_package_id=str(emoji_package_id),
+                                vec=None,
+                            )
                         )
 
-                        milvus_client = await get_milvus_vector_client()
-                        await milvus_client.insert_image_data([image_vec_data])
-                        logger.info(f"插入图片向量数据到Milvus成功，图片名称：{file_name}")
-
                     else:  # 如果原来存在，则更新
                         await session.execute(
                             update(ImageSender)
@@ -373,6 +398,13 @@ async def add_image(event: GroupMessageEvent):
                         logger.info(f"更新表情包图片{file_name}成功")
                     await session.commit()
 
+    if pending_vec_data:
+        # 一条消息中的所有表情包图片一起计算向量并插入
+        if failed := await embed_and_insert_image_data(pending_vec_data):
+            logger.error(f"表情包图片{failed}获取向量失败，未插入Milvus")
+        else:
+            logger.info(f"插入图片向量数据到Milvus成功，图片名称：{[item.name for item in pending_vec_data]}")
+
         # else:
         #     resp = await _HTTP_CLIENT.get(url)
         #     # 文件不存在则写入
@@ -397,148 +429,239 @@ async def refresh_image_cache():
     _IMAGE_DICT = {i.name:i for i in res}
 
 
+async def embed_and_insert_image_data(items: list[VectorDataImage]) -> list[str]:
+    """批量计算图片描述的向量并插入向量数据库，返回获取向量失败的图片名称"""
+    vecs = await get_text_embeddings([str(item.description or "") for item in items])
+    success: list[VectorDataImage] = []
+    failed: list[str] = []
+    for item, vec in zip(items, vecs):
+        if vec:
+            item.vec = vec
+            success.append(item)
+        else:
+            failed.append(str(item.name))
+    if success:
+        vector_client = await get_vector_client()
+        await vector_client.insert_image_data(success)
+    return failed
+
+
 def get_mime_type(filename: str) -> Literal["image/jpeg", "image/png"]:
     ext = filename.lower().split(".")[-1]
     return "image/png" if ext == "png" else "image/jpeg"
 
 
 
-@driver.on_bot_connect
-async def migrate_imagesender_to_milvus():
+MIGRATE_JOB_NAME = "migrate_imagesender_to_milvus"
+"""表情包迁移任务名称"""
+
+_MIGRATE_TASK: Optional[asyncio.Task] = None
+
+
+async def load_checkpoint(job: str) -> int:
+    """读取任务进度，返回已处理的最大数据id"""
     async with get_session() as session:
-        res = list(await session.scalars(select(ImageSender)))
-    
-    logger.debug(f"共需要迁移{len(res)}条数据")
-    milvus_client = await get_milvus_vector_client()
-    skip_count = 0
-    success_count = 0
-    error_count = 0
-    fail_files = []
-    for i in res:
-        name = i.name
-        summary = i.summary
-        mime_type = i.mime_type
-        file_size = i.file_size
-        key = i.key
-        emoji_id = i.emoji_id
-        emoji_package_id = i.emoji_package_id
-
-        res = await milvus_client.query_image_data(name)
-        if len(res) > 0:
-            # 判断描述中是否含有中文，有则删除原来的记录，重新设置
-            description = res[0].description
-            if description and any('\u4e00' <= ch <= '\u9fff' for ch in description):
-                # 删除原有记录，重新迁移
-                await milvus_client.delete_image_data(name)
-                logger.info(f"图片{name}描述不合法，已删除原有记录，准备重新迁移")
-            else:
-                skip_count += 1
-                logger.debug(f"图片{name}已存在且描述无中文，不进行数据迁移")
-                continue
+        checkpoint = await session.scalar(select(JobCheckpoint).where(JobCheckpoint.job == job))
+    return checkpoint.last_id if checkpoint else 0
+
 
-        mime_type = get_mime_type(name)
-        try:
+async def save_checkpoint(job: str, last_id: int):
+    """保存任务进度"""
+    async with get_session() as session:
+        updated = await session.execute(
+            update(JobCheckpoint)
+            .where(JobCheckpoint.job == job)
+            .values(last_id=last_id, update_time=int(time.time()))
+        )
+        if not updated.rowcount:
+            session.add(JobCheckpoint(job=job, last_id=last_id, update_time=int(time.time())))
+        await session.commit()
+
+
+@driver.on_bot_connect
+async def start_migrate_imagesender_to_milvus():
+    """在后台启动迁移任务，不阻塞 bot 连接"""
+    global _MIGRATE_TASK
+    if _MIGRATE_TASK is not None and not _MIGRATE_TASK.done():
+        logger.info("表情包迁移任务正在运行，不重复启动")
+        return
+    # 迁移任务中的请求均为最低优先级，不影响聊天回复
+    with request_priority(Priority.BATCH):
+        _MIGRATE_TASK = asyncio.create_task(migrate_imagesender_to_milvus())
+
+
+@on_command("重建向量索引", permission=SUPERUSER, rule=to_me(), priority=1, block=True).handle()
+async def reindex_image_collection(matcher: Matcher):
+    """使用新的索引类型重建图片向量集合"""
+    if plugin_config.vector_backend == "local":
+        await matcher.finish("当前使用本地向量索引，无需重建")
+    milvus_client = await get_milvus_vector_client()
+    resp = await suggest(
+        f"当前索引类型{milvus_client.profile.index_type}，请选择新的索引类型", timeout=60, expect=INDEX_TYPES
+    )
+    if not resp or str(resp) not in INDEX_TYPES:
+        await matcher.finish("输入无效，指令中断")
+    index_type: IndexType = str(resp)  # type: ignore
+    await matcher.send(f"开始使用{index_type}索引重建图片向量集合")
+    try:
+        copied = await milvus_client.reindex(plugin_config.milvus.index_profile(index_type))
+    except Exception as e:
+        logger.error(f"重建向量索引失败：{repr(e)}")
+        await matcher.finish(f"重建向量索引失败：{repr(e)}")
+    await matcher.finish(f"重建完成，共复制{copied}条数据，请同步修改配置中的索引类型")
+
+
+@on_command("重新迁移表情包", permission=SUPERUSER, rule=to_me(), priority=1, block=True).handle()
+async def restart_migrate_imagesender_to_milvus(matcher: Matcher):
+    """清空迁移进度，从头开始迁移"""
+    if _MIGRATE_TASK is not None and not _MIGRATE_TASK.done():
+        await matcher.finish("表情包迁移任务正在运行")
+    await save_checkpoint(MIGRATE_JOB_NAME, 0)
+    await start_migrate_imagesender_to_milvus()
+    await matcher.finish("已开始重新迁移表情包")
+
+
+async def describe_image_sender(image: ImageSender, semaphore: asyncio.Semaphore) -> Optional[VectorDataImage]:
+    """分析表情包图片，生成待插入的向量数据（向量稍后批量计算）"""
+    name = image.name
+    mime_type = get_mime_type(name)
+    try:
+        async with semaphore:
             parts = [Part.from_text(text="Summarize the content of the following set of pictures, using multiple tags to describe them, at least 40 tags")]
             parts.extend(await process_image_file(EMOJI_DIR_PATH.joinpath(name)))
             description = await analysis_image_to_str_description(parts=parts)
-            vec = await get_text_embedding(description)
-            vec_image_data = VectorDataImage(
-                description=description,
-                name=name,
-                summary=summary,
-                mime_type=mime_type,
-                file_size=file_size,
-                key=key,
-                emoji_id=emoji_id,
-                emoji_package_id=emoji_package_id,
-                vec=vec
-            )
+    except Exception as e:
+        logger.error(f"数据{name}, mime_type为{mime_type}，迁移失败{repr(e)}")
+        return None
+    return VectorDataImage(
+        description=description,
+        name=name,
+        summary=image.summary,
+        mime_type=mime_type,
+        file_size=image.file_size,
+        key=image.key,
+        emoji_id=image.emoji_id,
+        emoji_package_id=image.emoji_package_id,
+        vec=None,
+    )
 
-            await milvus_client.insert_image_data([vec_image_data])
-            success_count += 1
-            logger.info(f"数据{name}迁移成功")
-        except Exception as e:
-            fail_files.append(name)
-            error_count += 1
-            logger.error(f"数据{name}, mime_type为{mime_type}，迁移失败{repr(e)}")
 
-    else:
-        # 删除失败的文件以及本地文件
-        # if fail_files:
-        #     for file_name in fail_files:
-        #         file_path = EMOJI_DIR_PATH.joinpath(file_name)
-        #         if file_path.exists():
-        #             os.remove(file_path)
-        #             logger.info(f"删除失败的文件{file_name}成功")
-        #         else:
-        #             logger.warning(f"文件{file_name}不存在，无法删除")
-            
-        # async with get_session() as session:
-            # count = await session.execute(delete(ImageSender).where(ImageSender.name.in_(fail_files)))
-            # await session.commit()
-        # logger.info(f"删除数据库中{count.rowcount}条迁移失败的数据")
-        logger.info(f"{skip_count}条数据跳过迁移，{error_count}条数据迁移失败，{success_count}条数据迁移成功")
+async def migrate_imagesender_to_milvus():
+    """将表情包数据分页迁移到向量数据库，中断后从进度处继续
 
+    进度只记录到第一条迁移失败的数据之前，之后的数据已迁移成功的在下次迁移时会被跳过，失败的数据会重新迁移
+    """
+    last_id = await load_checkpoint(MIGRATE_JOB_NAME)
+    async with get_session() as session:
+        total = await session.scalar(select(func.count()).select_from(ImageSender).where(ImageSender.id > last_id)) or 0
+    logger.info(f"共需要迁移{total}条数据，从id {last_id} 之后开始")
+    if total == 0:
+        return
+
+    vector_client = await get_vector_client()
+    semaphore = asyncio.Semaphore(plugin_config.migrate_concurrency)
+    page_size = plugin_config.migrate_page_size
+    skip_count = 0
+    success_count = 0
+    error_count = 0
+    processed = 0
+    # 出现迁移失败的数据后不再推进进度
+    checkpoint_blocked = False
+    start_time = time.perf_counter()
+    while True:
+        async with get_session() as session:
+            page = list(
+                await session.scalars(
+                    select(ImageSender).where(ImageSender.id > last_id).order_by(ImageSender.id.asc()).limit(page_size)
+                )
+            )
+        if not page:
+            break
+
+        # 一次查询整页数据在向量数据库中的记录
+        names = list({i.name for i in page})
+        existing: dict[str, Optional[str]] = {}
+        for item in await vector_client.query_image_data(names, limit=len(names) * 4, projection="meta"):
+            existing.setdefault(str(item.name), item.description)
+        # 描述中含有中文的记录需要删除后重新迁移
+        invalid = [
+            name for name, description in existing.items()
+            if description and any("\u4e00" <= ch <= "\u9fff" for ch in description)
+        ]
+        if invalid:
+            await vector_client.delete_image_data(invalid)
+            logger.info(f"图片{invalid}描述不合法，已删除原有记录，准备重新迁移")
+        todo = [i for i in page if i.name not in existing or i.name in invalid]
+        skip_count += len(page) - len(todo)
+
+        described = await asyncio.gather(*(describe_image_sender(i, semaphore) for i in todo))
+        items = [item for item in described if item is not None]
+        failed_names = {i.name for i, item in zip(todo, described) if item is None}
+        error_count += len(todo) - len(items)
+        if items:
+            try:
+                failed = await embed_and_insert_image_data(items)
+            except Exception as e:
+                failed = [str(item.name) for item in items]
+                logger.error(f"批量插入{len(failed)}条数据失败{repr(e)}")
+            failed_names.update(failed)
+            error_count += len(failed)
+            success_count += len(items) - len(failed)
+
+        if not checkpoint_blocked:
+            # 进度推进到本页第一条失败数据之前
+            checkpoint = last_id
+            for i in page:
+                if i.name in failed_names:
+                    checkpoint_blocked = True
+                    break
+                checkpoint = i.id
+            if checkpoint != last_id:
+                await save_checkpoint(MIGRATE_JOB_NAME, checkpoint)
+        last_id = page[-1].id
+        processed += len(page)
+        elapsed = time.perf_counter() - start_time
+        eta = elapsed / processed * max(total - processed, 0)
+        logger.info(f"表情包迁移进度{processed}/{total}，已用时{elapsed:.0f}秒，预计剩余{eta:.0f}秒")
+
+    logger.info(f"{skip_count}条数据跳过迁移，{error_count}条数据迁移失败，{success_count}条数据迁移成功")
 
 
 async def process_image_file(file_path: Path) -> list[Part]:
-    """处理即将发送给AI进行分析的图片输入，如果是静态图片，则直接去二进制内容，如果是动态图片，则分帧去多次二进制内容"""
-    parts = []
-    mime_type = get_mime_type(file_path.name)
+    """处理即将发送给AI进行分析的图片输入，如果是静态图片，则直接去二进制内容，如果是动态图片，则按配置选取部分帧"""
+    async with aopen(file_path, "rb") as f:
+        content = await f.read()
     if file_path.name.endswith(".gif"):
-        frame_paths = await split_gif_pillow_async(file_path, file_path.name)
-        for path in frame_paths:
-            async with aopen(path, "rb") as f:
-                content = await f.read()
-            parts.append(Part.from_bytes(data=content, mime_type=mime_type))
-        await remove_gif_frames(file_path)
-    else:
-        async with aopen(file_path, "rb") as f:
-            content = await f.read()
-        parts.append(Part.from_bytes(data=content, mime_type=mime_type))
-    return parts
-
-
-async def async_save_image(image: Image.Image, path: Path):
-    """Pillow保存为字节流，然后异步写入文件"""
-    buf = io.BytesIO()
-    rgb_image = image.convert("RGB")
-    rgb_image.save(buf, format="JPEG")
-    async with aiofiles.open(path, "wb") as f:
-        await f.write(buf.getvalue())
-
-GIF_FRAME_OUTPUT_DIR = store.get_cache_dir("people_like") / "gif_frames"
-
-async def split_gif_pillow_async(gif_path: Path, file_name: str) -> list[Path]:
-    """将gif动态图片分割成多个静态图片"""
-    gif = Image.open(gif_path)
-    GIF_FRAME_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
-
-    canvas = Image.new("RGBA", gif.size, (0, 0, 0, 0))
-    durations = []
-    tasks = []
-    frame_paths = []
-    file_name = file_name.split(".")[0]
-
-    for i, frame in enumerate(ImageSequence.Iterator(gif)):
-        rgba = frame.convert("RGBA")
-        composed = Image.alpha_composite(canvas, rgba)
-        save_path = GIF_FRAME_OUTPUT_DIR / f"{file_name}_frame_{i:03d}.png"
-        tasks.append(async_save_image(composed, save_path))
-        canvas = composed
-        durations.append(int(frame.info.get("duration", 0)))
-        frame_paths.append(save_path)
-
-    await asyncio.gather(*tasks)
-
-    logger.info(f"完成，共导出 {len(durations)} 帧")
-    return frame_paths
-
-
-async def remove_gif_frames(file_path: Path):
-    """删除 GIF 动画帧"""
-    file_name = file_path.name.split(".")[0]
-
-    for frame in GIF_FRAME_OUTPUT_DIR.glob(f"{file_name}_frame_*.png"):
-        frame.unlink(missing_ok=True)
-    logger.info(f"删除 {file_name} GIF 动画帧成功")
+        frames = await split_gif_frames(content)
+        logger.debug(f"{file_path.name}选取{len(frames)}帧")
+        return [Part.from_bytes(data=frame, mime_type="image/jpeg") for frame in frames]
+    return [Part.from_bytes(data=content, mime_type=get_mime_type(file_path.name))]
+
+
+_GIF_EXECUTOR: Optional[ProcessPoolExecutor] = None
+"""GIF 拆帧进程池，首次使用时创建"""
+
+
+async def split_gif_frames(content: bytes) -> list[bytes]:
+    """在进程池中拆分 GIF 动画，返回编码后的帧"""
+    global _GIF_EXECUTOR
+    if _GIF_EXECUTOR is None:
+        # 事件循环、数据库连接等状态不能安全地 fork 到子进程，使用 spawn 启动全新的解释器
+        _GIF_EXECUTOR = ProcessPoolExecutor(
+            max_workers=plugin_config.gif_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+    return await asyncio.get_running_loop().run_in_executor(
+        _GIF_EXECUTOR,
+        extract_gif_frames,
+        content,
+        plugin_config.gif_frame_sample,
+        plugin_config.gif_frame_mode,
+        plugin_config.image_max_side,
+        plugin_config.image_prep_quality,
+    )
+
+
+@driver.on_shutdown
+async def shutdown_gif_executor():
+    if _GIF_EXECUTOR is not None:
+        _GIF_EXECUTOR.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,52 @@
+# 向量索引配置
+# 不依赖 nonebot，可在基准测试脚本中单独加载
+
+from dataclasses import dataclass
+from typing import Any, Literal
+
+IndexType = Literal["IVF_FLAT", "IVF_SQ8", "HNSW", "DISKANN"]
+
+INDEX_TYPES: list[str] = ["IVF_FLAT", "IVF_SQ8", "HNSW", "DISKANN"]
+
+
+@dataclass
+class IndexProfile:
+    """向量索引构建与搜索参数"""
+
+    index_type: IndexType = "IVF_FLAT"
+    """索引类型"""
+    nlist: int = 128
+    """IVF 聚类中心数"""
+    nprobe: int = 8
+    """IVF 搜索的聚类数量"""
+    m: int = 16
+    """HNSW 每个节点的最大连接数"""
+    ef_construction: int = 200
+    """HNSW 构建时的候选集大小"""
+    ef: int = 64
+    """HNSW 搜索时的候选集大小"""
+    search_list: int = 100
+    """DISKANN 搜索时的候选集大小"""
+
+    def index_params(self) -> dict[str, Any]:
+        """构建索引参数"""
+        match self.index_type:
+            case "IVF_FLAT" | "IVF_SQ8":
+                return {"nlist": self.nlist}
+            case "HNSW":
+                return {"M": self.m, "efConstruction": self.ef_construction}
+            case _:
+                return {}
+
+    def search_params(self) -> dict[str, Any]:
+        """搜索参数"""
+        match self.index_type:
+            case "IVF_FLAT" | "IVF_SQ8":
+                params: dict[str, Any] = {"nprobe": self.nprobe}
+            case "HNSW":
+                params = {"ef": self.ef}
+            case "DISKANN":
+                params = {"search_list": self.search_list}
+            case _:
+                params = {}
+        return {"metric_type": "COSINE", "params": params}
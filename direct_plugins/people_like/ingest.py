@@ -0,0 +1,149 @@
+# 消息入库队列
+
+import asyncio
+import time
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Optional
+from nonebot import logger
+
+Job = Callable[[], Awaitable[Any]]
+
+
+def _consume_exception(future: asyncio.Future):
+    if not future.cancelled():
+        future.exception()
+
+
+class StageLatency:
+    """记录某一阶段最近若干次耗时"""
+
+    def __init__(self, window: int = 200) -> None:
+        self.samples: deque[float] = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self) -> str:
+        if not self.samples:
+            return "无数据"
+        ordered = sorted(self.samples)
+        avg = sum(ordered) / len(ordered)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return f"共{self.count}次，平均{avg * 1000:.1f}ms，p95 {p95 * 1000:.1f}ms，最大{ordered[-1] * 1000:.1f}ms"
+
+
+class IngestQueue:
+    """固定数量 worker 的有界入库队列
+
+    消息处理器只负责入队，不会等待，实际入库由后台 worker 完成；队列满时转为在后台直接执行，
+    直接执行的任务至多与 worker 数量相同，超出时丢弃并计数
+    """
+
+    def __init__(self, name: str, workers: int = 4, maxsize: int = 1000) -> None:
+        self.name = name
+        self.worker_count = workers
+        self.queue: asyncio.Queue[tuple[float, Job, asyncio.Future]] = asyncio.Queue(maxsize=maxsize)
+        self.workers: list[asyncio.Task] = []
+        self.inline_tasks: set[asyncio.Task] = set()
+        self.stages: dict[str, StageLatency] = defaultdict(StageLatency)
+        self.overflow_count = 0
+        self.dropped_count = 0
+        self.error_count = 0
+        self.closed = False
+
+    def start(self):
+        """启动 worker"""
+        if self.workers:
+            return
+        self.closed = False
+        self.workers = [asyncio.create_task(self._worker(i)) for i in range(self.worker_count)]
+        logger.info(f"入库队列{self.name}已启动，worker 数量{self.worker_count}")
+
+    def record(self, stage: str, seconds: float):
+        """记录阶段耗时"""
+        self.stages[stage].record(seconds)
+
+    def submit(self, job: Job) -> asyncio.Future:
+        """提交入库任务，返回可等待任务完成的 Future，不等待时失败原因已记录在日志中"""
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # 调用方可以不等待结果，由回调取出异常，避免未读取异常的警告
+        future.add_done_callback(_consume_exception)
+        enqueue_time = time.perf_counter()
+        if self.closed or not self.workers:
+            # 未启动或已关闭时直接执行
+            self._run_inline(enqueue_time, job, future)
+            return future
+        try:
+            self.queue.put_nowait((enqueue_time, job, future))
+        except asyncio.QueueFull:
+            self.overflow_count += 1
+            logger.warning(f"入库队列{self.name}已满（{self.queue.qsize()}），直接执行入库任务")
+            self._run_inline(enqueue_time, job, future)
+        return future
+
+    def _run_inline(self, enqueue_time: float, job: Job, future: asyncio.Future):
+        """在后台直接执行，同时执行的任务数超过 worker 数量时丢弃，关闭时等待执行完毕"""
+        if len(self.inline_tasks) >= self.worker_count:
+            self.dropped_count += 1
+            logger.error(f"入库队列{self.name}直接执行的任务已达上限{self.worker_count}，丢弃入库任务")
+            future.set_exception(asyncio.QueueFull())
+            return
+        task = asyncio.create_task(self._execute(enqueue_time, job, future))
+        self.inline_tasks.add(task)
+        task.add_done_callback(self.inline_tasks.discard)
+
+    async def _execute(self, enqueue_time: float, job: Job, future: asyncio.Future):
+        start = time.perf_counter()
+        self.record("wait", start - enqueue_time)
+        try:
+            result = await job()
+        except Exception as e:
+            self.error_count += 1
+            logger.error(f"入库队列{self.name}任务执行失败：{repr(e)}")
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self.record("total", time.perf_counter() - enqueue_time)
+
+    async def _worker(self, index: int):
+        while True:
+            enqueue_time, job, future = await self.queue.get()
+            try:
+                await self._execute(enqueue_time, job, future)
+            finally:
+                self.queue.task_done()
+
+    async def flush(self, timeout: Optional[float] = 30):
+        """停止接收新任务，等待队列中的任务执行完毕后关闭 worker"""
+        self.closed = True
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"入库队列{self.name}关闭超时，仍有{self.queue.qsize()}条任务未执行")
+        if self.inline_tasks:
+            _, pending = await asyncio.wait(list(self.inline_tasks), timeout=timeout)
+            if pending:
+                logger.warning(f"入库队列{self.name}关闭超时，仍有{len(pending)}条直接执行的任务未完成")
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        logger.info(f"入库队列{self.name}已关闭")
+
+    def report(self) -> str:
+        """队列状态报告"""
+        lines = [
+            f"入库队列：{self.name}",
+            f"队列深度：{self.queue.qsize()}/{self.queue.maxsize}",
+            f"worker 数量：{len(self.workers)}",
+            f"溢出直接执行次数：{self.overflow_count}，执行中{len(self.inline_tasks)}，丢弃{self.dropped_count}",
+            f"失败次数：{self.error_count}",
+        ]
+        for stage, latency in self.stages.items():
+            lines.append(f"{stage}：{latency.summary()}")
+        return "\n".join(lines)
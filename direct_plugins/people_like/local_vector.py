@@ -0,0 +1,333 @@
+# 进程内向量索引，可作为小规模部署的主存储或 Milvus 不可用时的后备
+
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Optional
+import numpy as np
+from nonebot import get_driver, logger
+from nonebot_plugin_apscheduler import scheduler
+import nonebot_plugin_localstore as store
+
+from .config import plugin_config
+from .vector import (
+    PROJECTION_FIELDS,
+    MilvusVector,
+    Projection,
+    VectorDataImage,
+    get_milvus_vector_client,
+    to_vector_data_image,
+)
+
+LOCAL_VECTOR_DIR = store.get_data_dir("people_like") / "local_vector"
+
+DIM = 768
+
+
+class LocalVector:
+    """基于 NumPy 的余弦相似度索引，接口与 MilvusVector 的图片数据操作一致
+
+    向量归一化后保存在 vec.npy 中并以内存映射方式读取，其余字段保存在 meta.json 中；
+    写入时整体重写文件，适用于写少读多的表情包数据
+    """
+
+    def __init__(self, directory: Path, query_len: int = 10, search_len: int = 10) -> None:
+        self.directory = directory
+        self.query_len = query_len
+        self.search_len = search_len
+        self.vec_path = directory / "vec.npy"
+        self.meta_path = directory / "meta.json"
+        self.vectors: np.ndarray = np.zeros((0, DIM), dtype=np.float32)
+        self.meta: list[dict] = []
+        self.next_id = 1
+        self.lock = asyncio.Lock()
+        self.sync_inserted: Optional[list[tuple[dict, list[float]]]] = None
+        """同步进行期间插入的数据，同步完成时合并"""
+        self.sync_deleted: Optional[list[str | list[str]]] = None
+        """同步进行期间删除的数据"""
+        self.load()
+
+    def load(self):
+        """从磁盘加载索引"""
+        if not self.vec_path.exists() or not self.meta_path.exists():
+            return
+        self.vectors = np.load(self.vec_path, mmap_mode="r")
+        self.meta = json.loads(self.meta_path.read_text(encoding="utf-8"))
+        if len(self.meta) != len(self.vectors):
+            logger.warning(f"本地向量索引数据不一致（{len(self.meta)}/{len(self.vectors)}），已清空，等待重新同步")
+            self.vectors = np.zeros((0, DIM), dtype=np.float32)
+            self.meta = []
+        self.next_id = max((int(m.get("id") or 0) for m in self.meta), default=0) + 1
+        logger.info(f"已加载本地向量索引，共{len(self.meta)}条数据")
+
+    def save(self, vectors: np.ndarray, meta: list[dict]):
+        """写入临时文件后替换，完成后重新映射"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_vec_path = self.directory / "vec.tmp.npy"
+        tmp_meta_path = self.directory / "meta.tmp.json"
+        np.save(tmp_vec_path, vectors.astype(np.float32, copy=False))
+        tmp_meta_path.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        # 释放旧的内存映射后再替换文件
+        self.vectors = np.zeros((0, DIM), dtype=np.float32)
+        os.replace(tmp_vec_path, self.vec_path)
+        os.replace(tmp_meta_path, self.meta_path)
+        self.vectors = np.load(self.vec_path, mmap_mode="r")
+        self.meta = meta
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def match(self, file_id: str | list[str] | bool) -> np.ndarray:
+        """按图片名称筛选，返回布尔掩码"""
+        names = [m.get("name") for m in self.meta]
+        if isinstance(file_id, bool):
+            return np.array([bool(name) for name in names], dtype=bool) if file_id else np.ones(len(names), dtype=bool)
+        targets = set(file_id) if isinstance(file_id, list) else {file_id}
+        return np.array([name in targets for name in names], dtype=bool)
+
+    def to_item(self, index: int, projection: Projection) -> VectorDataImage:
+        entity = dict(self.meta[index])
+        if projection == "full":
+            entity["vec"] = self.vectors[index].tolist()
+        return to_vector_data_image(entity, projection)
+
+    async def insert_image_data(self, data: list[VectorDataImage]) -> int:
+        """插入数据"""
+        if not data:
+            return 0
+        async with self.lock:
+            meta = list(self.meta)
+            new_vectors = []
+            for item in data:
+                entity = item.model_dump(exclude={"vec"})
+                entity["id"] = self.next_id
+                self.next_id += 1
+                meta.append(entity)
+                new_vectors.append(item.vec or [0.0] * DIM)
+                if self.sync_inserted is not None:
+                    self.sync_inserted.append((entity, new_vectors[-1]))
+            vectors = np.concatenate(
+                [np.asarray(self.vectors), self.normalize(np.asarray(new_vectors, dtype=np.float32))]
+            )
+            await asyncio.to_thread(self.save, vectors, meta)
+        return len(data)
+
+    async def query_image_data(
+        self, file_id: str | list[str], limit: int = 0, projection: Projection = "full"
+    ) -> list[VectorDataImage]:
+        indexes = np.flatnonzero(self.match(file_id))[: self.query_len if limit == 0 else limit]
+        return [self.to_item(int(i), projection) for i in indexes]
+
+    async def search_image_data(
+        self,
+        query_vector: list[list[float]],
+        file_id: str | bool = False,
+        search_len: int = 0,
+        projection: Projection = "full",
+    ) -> list[VectorDataImage]:
+        if len(self.meta) == 0 or not query_vector:
+            return []
+        limit = self.search_len if search_len == 0 else search_len
+        query = self.normalize(np.asarray(query_vector[:1], dtype=np.float32))[0]
+        scores = np.asarray(self.vectors @ query)
+        scores[~self.match(file_id)] = -np.inf
+        candidates = int(np.count_nonzero(np.isfinite(scores)))
+        if candidates == 0:
+            return []
+        limit = min(limit, candidates)
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        return [self.to_item(int(i), projection) for i in top]
+
+    async def delete_image_data(self, file_id: str | list[str]) -> int:
+        """删除数据"""
+        async with self.lock:
+            if self.sync_deleted is not None:
+                self.sync_deleted.append(file_id)
+            mask = self.match(file_id)
+            count = int(mask.sum())
+            if count == 0:
+                return 0
+            keep = ~mask
+            vectors = np.asarray(self.vectors)[keep]
+            meta = [m for m, k in zip(self.meta, keep) if k]
+            await asyncio.to_thread(self.save, vectors, meta)
+        return count
+
+    async def sync_from(self, milvus: MilvusVector) -> int:
+        """从 Milvus 全量同步数据，返回同步的数据条数
+
+        读取 Milvus 期间本地索引仍可写入，读取完成后在锁内替换数据，
+        并重新应用读取期间的插入与删除
+        """
+
+        def fetch() -> list[dict]:
+            iterator = milvus.client.query_iterator(
+                collection_name=milvus.collection_name_image,
+                batch_size=1000,
+                output_fields=PROJECTION_FIELDS["full"],
+            )
+            rows: list[dict] = []
+            while batch := iterator.next():
+                rows.extend(batch)
+            iterator.close()
+            return rows
+
+        if self.sync_inserted is not None:
+            logger.info("本地向量索引正在同步，跳过本次同步")
+            return 0
+        self.sync_inserted = []
+        self.sync_deleted = []
+        try:
+            await milvus.ensure_loaded()
+            rows = await asyncio.to_thread(fetch)
+            async with self.lock:
+                meta = [{k: v for k, v in row.items() if k != "vec"} for row in rows]
+                vecs = [row["vec"] for row in rows]
+                next_id = max((int(m.get("id") or 0) for m in meta), default=0) + 1
+                # 读取期间插入的数据可能已包含在读取结果中，按名称去重
+                names = {m.get("name") for m in meta}
+                for entity, vec in self.sync_inserted:
+                    if entity.get("name") in names:
+                        continue
+                    meta.append({**entity, "id": next_id})
+                    vecs.append(vec)
+                    next_id += 1
+                vectors = self.normalize(np.asarray(vecs, dtype=np.float32).reshape(-1, DIM))
+                for file_id in self.sync_deleted:
+                    targets = set(file_id) if isinstance(file_id, list) else {file_id}
+                    keep = np.array([m.get("name") not in targets for m in meta], dtype=bool)
+                    vectors = vectors[keep]
+                    meta = [m for m, k in zip(meta, keep) if k]
+                await asyncio.to_thread(self.save, vectors, meta)
+                self.next_id = next_id
+        finally:
+            self.sync_inserted = None
+            self.sync_deleted = None
+        logger.info(f"本地向量索引已从 Milvus 同步{len(rows)}条数据，共{len(meta)}条数据")
+        return len(meta)
+
+
+class FallbackVector:
+    """以 Milvus 为主、本地索引为后备的图片向量存储
+
+    写入 Milvus 成功后再写本地索引，Milvus 写入失败时抛出异常且不写入本地索引，避免迁移时误判为已存在；
+    读取失败时使用本地索引。
+    Milvus 无法连接时只使用本地索引，并每隔一段时间尝试重新连接，连接成功后从 Milvus 同步本地索引
+    """
+
+    RECONNECT_INTERVAL = 60
+    """重新连接 Milvus 的最短间隔秒数"""
+
+    def __init__(self, fallback: LocalVector) -> None:
+        self.primary: Optional[MilvusVector] = None
+        self.fallback = fallback
+        self.error: Optional[Exception] = None
+        self.retry_at = 0.0
+
+    async def get_primary(self) -> MilvusVector:
+        """获取 Milvus 客户端，未连接时尝试连接，失败时抛出连接异常"""
+        if self.primary is not None:
+            return self.primary
+        if self.error is not None and time.monotonic() < self.retry_at:
+            raise self.error
+        try:
+            self.primary = await get_milvus_vector_client()
+        except Exception as e:
+            self.error = e
+            self.retry_at = time.monotonic() + self.RECONNECT_INTERVAL
+            logger.warning(f"连接 Milvus 失败，使用本地向量索引：{repr(e)}")
+            raise
+        if self.error is not None:
+            logger.info("已重新连接 Milvus")
+            self.error = None
+        _BACKGROUND_TASKS.add(task := asyncio.create_task(sync_local_vector()))
+        task.add_done_callback(_BACKGROUND_TASKS.discard)
+        return self.primary
+
+    async def insert_image_data(self, data: list[VectorDataImage]) -> int:
+        # Milvus 写入失败时抛出异常，由调用方决定是否重试
+        count = await (await self.get_primary()).insert_image_data(data)
+        try:
+            await self.fallback.insert_image_data(data)
+        except Exception as e:
+            # 本地索引缺少的数据在下次同步时补齐
+            logger.error(f"写入本地向量索引失败：{repr(e)}")
+        return count
+
+    async def query_image_data(
+        self, file_id: str | list[str], limit: int = 0, projection: Projection = "full"
+    ) -> list[VectorDataImage]:
+        try:
+            return await (await self.get_primary()).query_image_data(file_id, limit, projection)
+        except Exception as e:
+            logger.warning(f"Milvus 查询失败，使用本地向量索引：{repr(e)}")
+            return await self.fallback.query_image_data(file_id, limit, projection)
+
+    async def search_image_data(
+        self,
+        query_vector: list[list[float]],
+        file_id: str | bool = False,
+        search_len: int = 0,
+        projection: Projection = "full",
+    ) -> list[VectorDataImage]:
+        try:
+            return await (await self.get_primary()).search_image_data(query_vector, file_id, search_len, projection)
+        except Exception as e:
+            logger.warning(f"Milvus 搜索失败，使用本地向量索引：{repr(e)}")
+            return await self.fallback.search_image_data(query_vector, file_id, search_len, projection)
+
+    async def delete_image_data(self, file_id: str | list[str]) -> int:
+        try:
+            await self.fallback.delete_image_data(file_id)
+        except Exception as e:
+            logger.error(f"删除本地向量索引数据失败：{repr(e)}")
+        return await (await self.get_primary()).delete_image_data(file_id)
+
+
+_VECTOR_CLIENT: Optional[MilvusVector | LocalVector | FallbackVector] = None
+
+_BACKGROUND_TASKS: set[asyncio.Task] = set()
+
+
+async def get_vector_client() -> MilvusVector | LocalVector | FallbackVector:
+    """获取图片向量存储，根据配置返回 Milvus、本地索引或带本地后备的 Milvus"""
+    global _VECTOR_CLIENT
+    if _VECTOR_CLIENT is not None:
+        return _VECTOR_CLIENT
+    if plugin_config.vector_backend == "local":
+        _VECTOR_CLIENT = LocalVector(LOCAL_VECTOR_DIR, plugin_config.query_len, plugin_config.search_len)
+    elif plugin_config.local_vector_fallback:
+        _VECTOR_CLIENT = FallbackVector(
+            LocalVector(LOCAL_VECTOR_DIR, plugin_config.query_len, plugin_config.search_len)
+        )
+    else:
+        _VECTOR_CLIENT = await get_milvus_vector_client()
+    return _VECTOR_CLIENT
+
+
+@get_driver().on_startup
+async def start_local_vector():
+    """启动时连接 Milvus，连接成功后在后台同步本地后备索引，无法连接时先使用本地索引"""
+    client = await get_vector_client()
+    if isinstance(client, FallbackVector):
+        try:
+            await client.get_primary()
+        except Exception:
+            pass
+
+
+@scheduler.scheduled_job("interval", hours=6, id="sync_local_vector")
+async def sync_local_vector():
+    """定期从 Milvus 同步本地后备索引，修正写入失败等原因造成的差异"""
+    if not isinstance(_VECTOR_CLIENT, FallbackVector) or _VECTOR_CLIENT.primary is None:
+        return
+    try:
+        await _VECTOR_CLIENT.fallback.sync_from(_VECTOR_CLIENT.primary)
+    except Exception as e:
+        logger.error(f"同步本地向量索引失败：{repr(e)}")
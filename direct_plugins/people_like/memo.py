@@ -0,0 +1,130 @@
+# Gemini 调用结果持久化缓存
+
+import hashlib
+import json
+import time
+from typing import Any, Optional
+from nonebot import logger
+from nonebot_plugin_orm import get_session
+from nonebot_plugin_apscheduler import scheduler
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from google.genai.types import Part
+
+from .config import plugin_config
+from .model import GeminiMemo
+
+
+class GeminiMemoCache:
+    """以内容哈希加模型名称为键，缓存图片描述与文本向量等确定性较高的调用结果"""
+
+    def __init__(self, ttl: int, max_rows: int) -> None:
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.hit = 0
+        self.miss = 0
+
+    @staticmethod
+    def make_key(model: str, *payload: str | bytes) -> str:
+        """计算缓存键"""
+        digest = hashlib.sha256(model.encode())
+        for item in payload:
+            data = item.encode() if isinstance(item, str) else item
+            # 写入长度，避免不同切分方式得到相同哈希
+            digest.update(len(data).to_bytes(8, "big"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    @staticmethod
+    def parts_payload(parts: list[Part]) -> list[str | bytes]:
+        """将 Part 列表转换为参与哈希计算的内容"""
+        payload: list[str | bytes] = []
+        for part in parts:
+            if part.text is not None:
+                payload.append(f"text:{part.text}")
+            elif part.inline_data is not None:
+                payload.append(f"bytes:{part.inline_data.mime_type}")
+                payload.append(part.inline_data.data or b"")
+            else:
+                payload.append(part.model_dump_json(exclude_none=True))
+        return payload
+
+    async def get(self, key: str) -> Optional[Any]:
+        """读取缓存，不存在或已过期时返回 None"""
+        now = int(time.time())
+        async with get_session() as session:
+            memo = await session.scalar(select(GeminiMemo).where(GeminiMemo.key == key))
+            if memo is None or memo.create_time + self.ttl < now:
+                self.miss += 1
+                return None
+            value = json.loads(memo.value)
+            # 访问时间精确到小时即可，减少写入
+            if now - memo.access_time > 60 * 60:
+                await session.execute(update(GeminiMemo).where(GeminiMemo.key == key).values(access_time=now))
+                await session.commit()
+        self.hit += 1
+        return value
+
+    async def get_many(self, keys: list[str]) -> dict[str, Any]:
+        """批量读取缓存，返回命中的键值"""
+        if not keys:
+            return {}
+        now = int(time.time())
+        async with get_session() as session:
+            memos = list(await session.scalars(select(GeminiMemo).where(GeminiMemo.key.in_(keys))))
+            result = {memo.key: json.loads(memo.value) for memo in memos if memo.create_time + self.ttl >= now}
+            stale_keys = [memo.key for memo in memos if memo.key in result and now - memo.access_time > 60 * 60]
+            if stale_keys:
+                await session.execute(update(GeminiMemo).where(GeminiMemo.key.in_(stale_keys)).values(access_time=now))
+                await session.commit()
+        self.hit += len(result)
+        self.miss += len(set(keys)) - len(result)
+        return result
+
+    async def set(self, key: str, model: str, value: Any):
+        """写入缓存"""
+        now = int(time.time())
+        raw = json.dumps(value, ensure_ascii=False)
+        async with get_session() as session:
+            updated = await session.execute(
+                update(GeminiMemo)
+                .where(GeminiMemo.key == key)
+                .values(model=model, value=raw, create_time=now, access_time=now)
+            )
+            if not updated.rowcount:
+                session.add(GeminiMemo(key=key, model=model, value=raw, create_time=now, access_time=now))
+            try:
+                await session.commit()
+            except IntegrityError:
+                # 并发写入同一键，保留先写入的结果
+                await session.rollback()
+
+    async def cleanup(self):
+        """删除过期缓存，并按访问时间淘汰超出数量上限的缓存"""
+        expire_before = int(time.time()) - self.ttl
+        async with get_session() as session:
+            result = await session.execute(delete(GeminiMemo).where(GeminiMemo.create_time < expire_before))
+            expired_count = result.rowcount or 0
+            total = await session.scalar(select(func.count()).select_from(GeminiMemo)) or 0
+            evicted_count = 0
+            if total > self.max_rows:
+                evict_ids = select(GeminiMemo.id).order_by(GeminiMemo.access_time.asc()).limit(total - self.max_rows)
+                result = await session.execute(delete(GeminiMemo).where(GeminiMemo.id.in_(evict_ids)))
+                evicted_count = result.rowcount or 0
+            await session.commit()
+        logger.info(f"Gemini调用缓存清理完成，过期{expired_count}条，淘汰{evicted_count}条")
+
+    def report(self) -> str:
+        """缓存命中情况"""
+        total = self.hit + self.miss
+        rate = f"{self.hit / total * 100:.1f}%" if total else "无数据"
+        return f"Gemini调用缓存命中：{self.hit}，未命中：{self.miss}，命中率：{rate}"
+
+
+GEMINI_MEMO = GeminiMemoCache(plugin_config.memo_ttl_days * 60 * 60 * 24, plugin_config.memo_max_rows)
+"""Gemini 调用结果缓存"""
+
+
+@scheduler.scheduled_job("interval", hours=6, id="cleanup_gemini_memo")
+async def cleanup_gemini_memo():
+    await GEMINI_MEMO.cleanup()
@@ -1,6 +1,7 @@
 # 数据库实体
 
 from nonebot_plugin_orm import Model
+from sqlalchemy import Index
 from sqlalchemy.orm import Mapped, mapped_column
 
 class ImageSender(Model):
@@ -53,6 +54,17 @@ class GroupMsg(Model):
     file_id: Mapped[str] = mapped_column(nullable=True)
     time: Mapped[int]  # 时间戳
 
+    __table_args__ = (
+        # 按群组读取最近消息与按时间范围查询历史消息
+        Index("ix_people_like_groupmsg_group_id_time", "group_id", "time"),
+        # 按消息 id 查询原消息
+        Index("ix_people_like_groupmsg_message_id", "message_id"),
+        # 按群组与用户查询历史消息
+        Index("ix_people_like_groupmsg_group_id_user_id_time", "group_id", "user_id", "time"),
+        # 按图片 file id 查询已分析过的图片描述
+        Index("ix_people_like_groupmsg_file_id", "file_id"),
+    )
+
 class GroupMemberImpression(Model):
     """群成员印象"""
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
@@ -60,4 +72,30 @@ class GroupMemberImpression(Model):
     user_id: Mapped[int]
     impression: Mapped[str] = mapped_column(nullable=True)
     create_time: Mapped[int]
-    update_time: Mapped[int]
\ No newline at end of file
+    update_time: Mapped[int]
+
+
+class GeminiMemo(Model):
+    """Gemini 调用结果缓存"""
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    key: Mapped[str] = mapped_column(unique=True, index=True)
+    """内容哈希与模型名称计算得到的缓存键"""
+    model: Mapped[str]
+    """模型名称"""
+    value: Mapped[str]
+    """JSON 格式的调用结果"""
+    create_time: Mapped[int]
+    """创建时间"""
+    access_time: Mapped[int]
+    """最近访问时间"""
+
+
+class JobCheckpoint(Model):
+    """后台任务进度"""
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    job: Mapped[str] = mapped_column(unique=True, index=True)
+    """任务名称"""
+    last_id: Mapped[int]
+    """已处理的最大数据id"""
+    update_time: Mapped[int]
+    """更新时间"""
@@ -0,0 +1,241 @@
+# 群成员昵称缓存
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Any, Optional
+from nonebot import get_bot, get_driver, logger
+from nonebot.adapters import Bot
+from nonebot_plugin_apscheduler import scheduler
+import nonebot_plugin_localstore as store
+
+from common.struct import EXPIRABLE_DICTS, ExpirableDict, ExpirableDictFamily
+
+from .config import plugin_config
+from .setting import get_blacklist
+
+_SNAPSHOT = store.get_cache_dir("people_like") / "nickname.json"
+
+NicknameEntry = tuple[str, int]
+"""昵称与需要刷新的时间戳"""
+
+
+def member_name(info: dict[str, Any]) -> str:
+    """优先使用群名片，没有群名片时使用昵称"""
+    nickname_obj = info.get("card")
+    if not nickname_obj:
+        nickname_obj = info.get("nickname")
+    return str(nickname_obj)
+
+
+class NicknameCache:
+    """群成员昵称缓存
+
+    首次接触群组时通过 get_group_member_list 批量获取全部成员昵称；单个成员未命中时，
+    同一成员的并发请求只调用一次 get_group_member_info。超过 ttl 的昵称先返回旧值并在后台刷新，
+    超过 ttl + stale_ttl 后才需要等待重新获取
+    """
+
+    def __init__(self, ttl: int, stale_ttl: int, snapshot: Path) -> None:
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.snapshot = snapshot
+        self.groups: ExpirableDictFamily[int, int, NicknameEntry] = EXPIRABLE_DICTS.family("people_like.nickname")
+        self.prefetched: dict[int, float] = {}
+        self.member_fetches: dict[tuple[int, int], asyncio.Task[str]] = {}
+        self.group_fetches: dict[int, asyncio.Task[None]] = {}
+        self.dirty = False
+        self.hit = 0
+        self.stale = 0
+        self.miss = 0
+        self.api_calls = 0
+
+    def group(self, group_id: int) -> ExpirableDict[int, NicknameEntry]:
+        return self.groups.get(group_id)
+
+    def set(self, group_id: int, user_id: int, name: str, ttl: Optional[int] = None):
+        """写入昵称，ttl 为需要刷新前的秒数"""
+        ttl = self.ttl if ttl is None else ttl
+        self.group(group_id).set(user_id, (name, int(time.time()) + ttl), ttl + self.stale_ttl)
+        self.dirty = True
+
+    def delete(self, group_id: int, user_id: int):
+        self.group(group_id).delete(user_id)
+        self.dirty = True
+
+    async def get(self, group_id: int, user_id: int) -> str:
+        """获取用户在群组中的昵称"""
+        if (entry := self.group(group_id).get(user_id)) is None and group_id not in self.prefetched:
+            # 首次接触该群组，批量获取所有成员
+            await self.prefetch_group(get_bot(), group_id)
+            entry = self.group(group_id).get(user_id)
+        if entry is None:
+            self.miss += 1
+            return await asyncio.shield(self._single_flight(group_id, user_id))
+        name, refresh_at = entry
+        if refresh_at <= time.time():
+            self.stale += 1
+            # 先返回旧值，后台刷新
+            self._single_flight(group_id, user_id)
+        else:
+            self.hit += 1
+        return name
+
+    def _single_flight(self, group_id: int, user_id: int) -> asyncio.Task[str]:
+        key = (group_id, user_id)
+        if (task := self.member_fetches.get(key)) is None:
+            task = asyncio.create_task(self._fetch_member(group_id, user_id))
+            self.member_fetches[key] = task
+            task.add_done_callback(lambda _: self.member_fetches.pop(key, None))
+        return task
+
+    async def _fetch_member(self, group_id: int, user_id: int) -> str:
+        self.api_calls += 1
+        try:
+            info: dict[str, Any] = dict(
+                await get_bot().call_api("get_group_member_info", group_id=group_id, user_id=user_id)
+            )
+        except Exception as e:
+            logger.error(f"获取群{group_id}成员{user_id}信息失败：{repr(e)}")
+            if (entry := self.group(group_id).get(user_id)) is not None:
+                # 保留旧值，稍后再试
+                return entry[0]
+            info = {}
+        nickname = member_name(info)
+        # 获取失败时只短暂缓存，避免每条消息都重新请求
+        self.set(group_id, user_id, nickname, None if info else 10 * 60)
+        return nickname
+
+    async def prefetch_group(self, bot: Bot, group_id: int):
+        """批量获取群组所有成员的昵称，同一群组并发调用只请求一次"""
+        if (task := self.group_fetches.get(group_id)) is None:
+            task = asyncio.create_task(self._fetch_group(bot, group_id))
+            self.group_fetches[group_id] = task
+            task.add_done_callback(lambda _: self.group_fetches.pop(group_id, None))
+        await asyncio.shield(task)
+
+    async def _fetch_group(self, bot: Bot, group_id: int):
+        self.api_calls += 1
+        # 失败时同样标记，避免之后每次未命中都重新批量获取
+        self.prefetched[group_id] = time.time()
+        try:
+            members: list[dict[str, Any]] = list(await bot.call_api("get_group_member_list", group_id=group_id))
+        except Exception as e:
+            logger.error(f"获取群{group_id}成员列表失败：{repr(e)}")
+            return
+        for member in members:
+            self.set(group_id, int(member["user_id"]), member_name(member))
+        logger.debug(f"已缓存群{group_id}的{len(members)}个成员昵称")
+
+    async def prefetch_all(self, bot: Bot):
+        """批量获取所有群组的成员昵称，快照中尚未过期的群组跳过"""
+        groups: list[dict[str, Any]] = list(await bot.call_api("get_group_list"))
+        blacklist = get_blacklist()
+        now = time.time()
+        for group in groups:
+            group_id = int(group["group_id"])
+            if str(group_id) in blacklist or now - self.prefetched.get(group_id, 0) < self.ttl:
+                continue
+            await self.prefetch_group(bot, group_id)
+
+    def load(self):
+        """读取磁盘快照"""
+        if not self.snapshot.exists():
+            return
+        try:
+            data: dict[str, Any] = json.loads(self.snapshot.read_text(encoding="utf-8"))
+        except Exception as e:
+            logger.warning(f"读取昵称缓存快照失败：{repr(e)}")
+            return
+        now = int(time.time())
+        count = 0
+        for group_id, group in data.get("groups", {}).items():
+            gd = self.group(int(group_id))
+            for user_id, (name, refresh_at) in group.items():
+                if (ttl := refresh_at + self.stale_ttl - now) > 0:
+                    gd.set(int(user_id), (name, refresh_at), ttl)
+                    count += 1
+        self.prefetched.update({int(group_id): t for group_id, t in data.get("prefetched", {}).items()})
+        logger.info(f"已从快照恢复{count}个群成员昵称")
+
+    def dump(self) -> str:
+        return json.dumps(
+            {
+                "groups": {
+                    str(group_id): {str(user_id): list(entry) for user_id, entry in gd.items()}
+                    for group_id, gd in self.groups.items()
+                },
+                "prefetched": {str(group_id): t for group_id, t in self.prefetched.items()},
+            },
+            ensure_ascii=False,
+        )
+
+    async def save(self):
+        """有改动时写入磁盘快照"""
+        if not self.dirty:
+            return
+        self.dirty = False
+        text = self.dump()
+
+        def write():
+            self.snapshot.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.snapshot.with_suffix(".tmp")
+            tmp.write_text(text, encoding="utf-8")
+            tmp.replace(self.snapshot)
+
+        try:
+            await asyncio.to_thread(write)
+        except Exception as e:
+            self.dirty = True
+            logger.warning(f"保存昵称缓存快照失败：{repr(e)}")
+
+    def report(self) -> str:
+        users = sum(len(gd) for _, gd in self.groups.items())
+        return (
+            f"昵称缓存：{len(self.groups)}个群组{users}个成员，命中{self.hit}，"
+            f"旧值{self.stale}，未命中{self.miss}，接口调用{self.api_calls}次"
+        )
+
+
+NICKNAME_CACHE = NicknameCache(plugin_config.nickname_ttl, plugin_config.nickname_stale_ttl, _SNAPSHOT)
+"""群成员昵称缓存"""
+
+driver = get_driver()
+
+_BACKGROUND_TASKS: set[asyncio.Task] = set()
+
+
+async def get_user_nickname_of_group(group_id: int, user_id: int) -> str:
+    """读取程序内存中缓存的用户在指定群组的昵称"""
+    return await NICKNAME_CACHE.get(group_id, user_id)
+
+
+@driver.on_startup
+async def load_nickname_snapshot():
+    await asyncio.to_thread(NICKNAME_CACHE.load)
+
+
+@driver.on_bot_connect
+async def prefetch_nicknames(bot: Bot):
+    """在后台批量获取成员昵称，不阻塞 bot 连接"""
+    if not plugin_config.nickname_prefetch:
+        return
+
+    async def run():
+        try:
+            await NICKNAME_CACHE.prefetch_all(bot)
+        except Exception as e:
+            logger.error(f"批量获取群成员昵称失败：{repr(e)}")
+
+    _BACKGROUND_TASKS.add(task := asyncio.create_task(run()))
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+
+@scheduler.scheduled_job("interval", minutes=10, id="save_nickname_snapshot")
+async def save_nickname_snapshot():
+    await NICKNAME_CACHE.save()
+
+
+@driver.on_shutdown
+async def save_nickname_snapshot_on_shutdown():
+    await NICKNAME_CACHE.save()
@@ -4,34 +4,9 @@ from nonebot import get_bot, logger, on_notice
 from nonebot.adapters import Event
 from nonebot_plugin_orm import get_session
 
-from common.struct import ExpirableDict
 from .model import GroupMsg
-
-_USER_OF_GROUP_NICKNAME: dict[int, ExpirableDict[int, str]] = dict()
-
-
-async def get_user_nickname_of_group(group_id: int, user_id: int) -> str:
-    """读取程序内存中缓存的用户在指定群组的昵称"""
-    global _USER_OF_GROUP_NICKNAME
-    gd = _USER_OF_GROUP_NICKNAME.get(group_id, ExpirableDict(str(group_id)))
-    name = gd.get(user_id)
-    if name is None:
-        bot = get_bot()
-        try:
-            info: dict[str, Any] = dict(await bot.call_api("get_group_member_info", group_id=group_id, user_id=user_id))
-        except Exception as e:
-            logger.error("获取群成员信息失败", str(e))
-            info: dict[str, Any] = {}
-        nickname_obj = info.get("card")
-        if not nickname_obj:
-            nickname_obj = info.get("nickname")
-        nickname: str = str(nickname_obj)
-        # 缓存一天
-        gd.set(user_id, nickname, 60 * 60 * 24)
-        _USER_OF_GROUP_NICKNAME.update({group_id: gd})
-        return nickname
-    else:
-        return name
+from .context import CONTEXT_BUFFER, add_group_msgs
+from .nickname import NICKNAME_CACHE, get_user_nickname_of_group
 
 def check_group_card_update(event: Event):
     """检查事件为群成员名片修改事件"""
@@ -41,19 +16,16 @@ def check_group_card_update(event: Event):
 @on_notice(rule=check_group_card_update).handle()
 async def _(event: Event):
     """更新缓存中的群成员名片"""
-    global _USER_OF_GROUP_NICKNAME
     event_model = event.model_dump()
     group_id = event_model["group_id"]
     user_id = event_model["user_id"]
     card_new = event_model["card_new"]
-    gd = _USER_OF_GROUP_NICKNAME.get(group_id, ExpirableDict(str(group_id)))
-    name = gd.get(user_id)
-    if name is not None:
-        # 更新缓存
-        gd.set(user_id, card_new, gd.ttl(user_id))
-    if card_new == '':  # 如果用户清空了群备注
-        gd.delete(user_id)
-    _USER_OF_GROUP_NICKNAME.update({group_id: gd})
+    if card_new == '':  # 如果用户清空了群备注，重新获取昵称
+        NICKNAME_CACHE.delete(group_id, user_id)
+    else:
+        NICKNAME_CACHE.set(group_id, user_id, card_new)
+    # 上下文中缓存的消息内容包含昵称，需要重新生成
+    CONTEXT_BUFFER.invalidate(group_id)
 
 
 def check_poke(event: Event):
@@ -64,7 +36,6 @@ def check_poke(event: Event):
 @on_notice(rule=check_poke).handle()
 async def _(event: Event):
     """将戳一戳消息插入数据库"""
-    global _USER_OF_GROUP_NICKNAME
     event_model = event.model_dump()
     group_id = event_model["group_id"]
     user_id = event_model["user_id"]
@@ -81,7 +52,7 @@ async def _(event: Event):
         content = f"{nickname}({user_id}){action_name}{target_nickname}({target_id}){detail_name}"
         # 将消息插入数据库
         async with get_session() as session:
-            session.add(GroupMsg(
+            await add_group_msgs(session, [GroupMsg(
                 message_id=None,
                 group_id=group_id,
                 user_id=user_id,
@@ -92,8 +63,7 @@ async def _(event: Event):
                 content=content,
                 file_id=None,
                 time=time
-            ))
-            await session.commit()
+            )])
 
 def check_group_mute(event: Event):
     return event.get_event_name() == "notice.group_ban.ban" or event.get_event_name() == "notice.group_ban.lift_ban"
@@ -115,7 +85,7 @@ async def _(event: Event):
         nickname = await get_user_nickname_of_group(group_id, user_id)
         content = f"{nickname}({user_id})被{operator_nickname}({operator_id}){f'禁言{duration/60}分钟' if sub_type == 'ban' else '解除禁言'}"
         async with get_session() as session:
-            session.add(GroupMsg(
+            await add_group_msgs(session, [GroupMsg(
                 message_id=None,
                 group_id=group_id,
                 user_id=user_id,
@@ -126,5 +96,4 @@ async def _(event: Event):
                 content=content,
                 file_id=None,
                 time=time
-            ))
-            await session.commit()
\ No newline at end of file
+            )])
\ No newline at end of file
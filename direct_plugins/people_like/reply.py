@@ -0,0 +1,97 @@
+# 群组回复调度
+
+import asyncio
+import time
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Optional
+from nonebot import logger
+
+ReplyJob = Callable[[bool], Awaitable[Any]]
+"""回复任务，参数为本次回复是否需要按提及机器人处理"""
+
+
+class ReplyScheduler:
+    """保证每个群组同一时间至多只有一个回复在生成
+
+    生成期间到达的触发只保留最新的一个，当前回复结束后再执行一次，被合并的触发中任意一个提及机器人时，
+    执行的回复同样按提及机器人处理；两次回复之间至少间隔 min_gap 秒
+    """
+
+    def __init__(self, min_gap: float = 0) -> None:
+        self.min_gap = min_gap
+        self.running: dict[int, asyncio.Task] = {}
+        self.pending: dict[int, tuple[ReplyJob, bool, list[asyncio.Future]]] = {}
+        self.last_finish: dict[int, float] = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def trigger(self, group_id: int, job: ReplyJob, to_me: bool = False) -> asyncio.Future:
+        """提交回复任务，返回的 Future 在覆盖此次触发的回复完成后结束"""
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        if group_id in self.running:
+            if (previous := self.pending.get(group_id)) is not None:
+                self.coalesced += 1
+                _, previous_to_me, previous_waiters = previous
+                to_me = to_me or previous_to_me
+                waiters = [*previous_waiters, future]
+            else:
+                waiters = [future]
+            self.pending[group_id] = (job, to_me, waiters)
+            logger.debug(f"群{group_id}正在生成回复，本次触发合并到下一次回复")
+            return future
+        self.running[group_id] = asyncio.create_task(self._run(group_id, job, to_me, [future]))
+        return future
+
+    async def _run(self, group_id: int, job: Optional[ReplyJob], to_me: bool, waiters: list[asyncio.Future]):
+        try:
+            while job is not None:
+                if (gap := self.min_gap - (time.monotonic() - self.last_finish.get(group_id, 0))) > 0:
+                    await asyncio.sleep(gap)
+                try:
+                    await job(to_me)
+                except Exception as e:
+                    logger.exception(f"群{group_id}生成回复失败：{repr(e)}")
+                finally:
+                    self.executed += 1
+                    self.last_finish[group_id] = time.monotonic()
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_result(None)
+                job, to_me, waiters = self.pending.pop(group_id, (None, False, []))
+        finally:
+            self.running.pop(group_id, None)
+            # 任务被取消时，等待中的触发一并结束
+            waiters = [*waiters, *self.pending.pop(group_id, (None, False, []))[2]]
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    def report(self) -> str:
+        """调度状态"""
+        return f"回复生成中的群组：{len(self.running)}，已回复{self.executed}次，合并触发{self.coalesced}次"
+
+
+class HedgeBudget:
+    """限制每个群组每小时发起的对冲请求数"""
+
+    def __init__(self, per_hour: int) -> None:
+        self.per_hour = per_hour
+        self.history: defaultdict[int, deque[float]] = defaultdict(deque)
+        self.used = 0
+        self.rejected = 0
+
+    def take(self, group_id: int) -> bool:
+        """尝试使用一次额度"""
+        now = time.monotonic()
+        history = self.history[group_id]
+        while history and history[0] <= now - 60 * 60:
+            history.popleft()
+        if len(history) >= self.per_hour:
+            self.rejected += 1
+            return False
+        history.append(now)
+        self.used += 1
+        return True
+
+    def report(self) -> str:
+        return f"对冲请求{self.used}次，超出额度{self.rejected}次"
@@ -0,0 +1,197 @@
+# 过期群消息清理与归档
+
+import asyncio
+import gzip
+import json
+import os
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+from nonebot import logger, on_command
+from nonebot.matcher import Matcher
+from nonebot.permission import SUPERUSER
+from nonebot.rule import to_me
+from nonebot_plugin_apscheduler import scheduler
+from nonebot_plugin_orm import get_session
+from sqlalchemy import delete, select
+import nonebot_plugin_localstore as store
+
+from .config import plugin_config
+from .context import CONTEXT_BUFFER
+from .image_cache import IMAGE_CACHE
+from .model import GroupMsg
+from .setting import get_value_or_default
+
+ARCHIVE_DIR = store.get_data_dir("people_like") / "archive"
+
+_PREP_MARK = ".prep."
+
+
+@dataclass
+class RetentionReport:
+    groups: int = 0
+    deleted: int = 0
+    archived: int = 0
+    removed_files: int = 0
+    freed_bytes: int = 0
+    elapsed: float = 0
+
+    def __str__(self) -> str:
+        return (
+            f"清理{self.groups}个群组的过期消息{self.deleted}条，归档{self.archived}条，"
+            f"删除缓存图片{self.removed_files}个（{self.freed_bytes / 1024 / 1024:.1f}MB），用时{self.elapsed:.1f}秒"
+        )
+
+
+def _archive_rows(directory: Path, rows: list[dict[str, Any]]):
+    """按消息日期追加写入压缩文件，gzip 允许多段拼接，追加写入的文件可以直接整体解压"""
+    by_day: defaultdict[str, list[dict[str, Any]]] = defaultdict(list)
+    for row in rows:
+        by_day[datetime.fromtimestamp(row["time"]).strftime("%Y-%m-%d")].append(row)
+    directory.mkdir(parents=True, exist_ok=True)
+    for day, day_rows in by_day.items():
+        with gzip.open(directory / f"{day}.jsonl.gz", "at", encoding="utf-8") as f:
+            for row in day_rows:
+                f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+def _collect_orphans(directory: Path, referenced: set[str], grace_seconds: float) -> tuple[int, int]:
+    """删除没有消息引用且超过保留期未访问的缓存图片及其预处理文件，返回删除数量与释放字节数"""
+    if not directory.exists():
+        return 0, 0
+    expire = time.time() - grace_seconds
+    removed = freed = 0
+    for entry in os.scandir(directory):
+        if not entry.is_file():
+            continue
+        file_id = entry.name.split(_PREP_MARK, 1)[0]
+        if file_id in referenced:
+            continue
+        stat = entry.stat()
+        # 刚下载的图片对应的消息可能还在入库队列中，访问时间在保留期内的文件不删除
+        if stat.st_mtime > expire:
+            continue
+        Path(entry.path).unlink(missing_ok=True)
+        removed += 1
+        freed += stat.st_size
+    return removed, freed
+
+
+class RetentionEngine:
+    """按群组保留天数分批删除过期消息
+
+    每批删除后提交事务并短暂让出，避免长时间占用数据库写锁；可选在删除前按天归档，
+    清理完成后删除不再被任何消息引用的缓存图片
+    """
+
+    def __init__(
+        self,
+        chunk_size: int,
+        chunk_pause: float,
+        archive: bool,
+        archive_dir: Path,
+        image_grace_hours: float,
+    ) -> None:
+        self.chunk_size = chunk_size
+        self.chunk_pause = chunk_pause
+        self.archive = archive
+        self.archive_dir = archive_dir
+        self.image_grace_seconds = image_grace_hours * 60 * 60
+        self.lock = asyncio.Lock()
+        self.last_report: Optional[RetentionReport] = None
+
+    async def run(self) -> RetentionReport:
+        """执行一次清理，已有清理在进行时等待其结束后返回其结果"""
+        if self.lock.locked():
+            async with self.lock:
+                return self.last_report or RetentionReport()
+        async with self.lock:
+            start = time.monotonic()
+            report = RetentionReport()
+            async with get_session() as session:
+                group_ids = list(await session.scalars(select(GroupMsg.group_id).distinct()))
+            now = int(time.time())
+            for group_id in group_ids:
+                days: int = get_value_or_default(group_id, "retention_days")
+                try:
+                    deleted, archived = await self.purge_group(group_id, now - days * 24 * 60 * 60)
+                except Exception as e:
+                    logger.exception(f"清理群{group_id}过期消息失败：{repr(e)}")
+                    continue
+                if deleted:
+                    report.groups += 1
+                    report.deleted += deleted
+                    report.archived += archived
+                    CONTEXT_BUFFER.invalidate(group_id)
+            try:
+                report.removed_files, report.freed_bytes = await self.collect_images()
+            except Exception as e:
+                logger.exception(f"清理缓存图片失败：{repr(e)}")
+            report.elapsed = time.monotonic() - start
+            self.last_report = report
+            logger.info(str(report))
+            return report
+
+    async def purge_group(self, group_id: int, before: int) -> tuple[int, int]:
+        """分批删除群组中早于 before 的消息，返回删除数量与归档数量"""
+        deleted = archived = 0
+        while True:
+            async with get_session() as session:
+                query = (
+                    select(GroupMsg)
+                    .where(GroupMsg.group_id == group_id)
+                    .where(GroupMsg.time < before)
+                    .order_by(GroupMsg.time)
+                    .limit(self.chunk_size)
+                )
+                msgs = list(await session.scalars(query))
+                if not msgs:
+                    return deleted, archived
+                if self.archive:
+                    columns = GroupMsg.__table__.columns
+                    rows = [{column.name: getattr(msg, column.name) for column in columns} for msg in msgs]
+                    # 归档失败时不删除，抛出异常由调用方记录
+                    await asyncio.to_thread(_archive_rows, self.archive_dir, rows)
+                    archived += len(rows)
+                await session.execute(delete(GroupMsg).where(GroupMsg.id.in_([msg.id for msg in msgs])))
+                await session.commit()
+            deleted += len(msgs)
+            if len(msgs) < self.chunk_size:
+                return deleted, archived
+            await asyncio.sleep(self.chunk_pause)
+
+    async def collect_images(self) -> tuple[int, int]:
+        """删除没有消息引用的缓存图片"""
+        async with get_session() as session:
+            referenced = set(
+                await session.scalars(select(GroupMsg.file_id).where(GroupMsg.file_id.is_not(None)).distinct())
+            )
+        removed, freed = await asyncio.to_thread(
+            _collect_orphans, IMAGE_CACHE.directory, referenced, self.image_grace_seconds
+        )
+        if IMAGE_CACHE.size is not None:
+            IMAGE_CACHE.size = max(IMAGE_CACHE.size - freed, 0)
+        return removed, freed
+
+
+RETENTION = RetentionEngine(
+    plugin_config.retention_chunk_size,
+    plugin_config.retention_chunk_pause,
+    plugin_config.retention_archive,
+    ARCHIVE_DIR,
+    plugin_config.image_gc_grace_hours,
+)
+"""过期消息清理"""
+
+
+@scheduler.scheduled_job("interval", days=1, id="remove_old_msg")
+async def remove_old_msg():
+    await RETENTION.run()
+
+
+@on_command("清理消息", permission=SUPERUSER, rule=to_me(), priority=1, block=True).handle()
+async def run_retention(matcher: Matcher):
+    await matcher.finish(str(await RETENTION.run()))
@@ -97,11 +97,19 @@ _EXPECT_PROP_NAMES: dict[str, PropConfig] = {
     "temperature": {"range": "0.0-2.0", "callable": None, "default": 1.0, "desc": "温度系数"},
     "length": {"range": None, "callable": None, "default": 0, "desc": "限制生成token数量"},
     "search": {"range": None, "callable": str_to_bool, "default": False, "desc": "是否启用搜索"},
+    "stream": {"range": None, "callable": str_to_bool, "default": False, "desc": "是否流式生成并逐条发送回复"},
+    "hedge": {"range": None, "callable": str_to_bool, "default": False, "desc": "提及消息回复较慢时是否同时请求下一个模型"},
     "reply_probability": {"range": "0.0-1.0", "callable": None,"default": plugin_config.reply_probability, "desc":"回复概率"},
     "model": {"range": None, "callable": None,"default": plugin_config.gemini_model, "desc": "模型名称"},
     "anime_only": {"range": None, "callable": str_to_bool, "default": False, "desc": "发送动画表情时是否只发送二次元动画表情"},
     "at_reply_probability": {"range": "0.0-1.0","callable": None, "default": plugin_config.reply_probability * 4, "desc": "提及回复概率"},
     "context_size": {"range": "0-1000", "callable": None, "default": plugin_config.context_size, "desc": "上下文长度"},
+    "retention_days": {
+        "range": "1-365",
+        "callable": None,
+        "default": plugin_config.retention_days,
+        "desc": "消息保留天数",
+    },
     "forget_self": {"range": None, "callable": str_to_timestamp, "default": 0, "desc": "不将指定时间戳之前的自身消息列入上下文"},
     "impression": {"range": None, "callable": str_to_bool, "default": True, "desc": "是否启用群组成员印象"},
     "enable_notice": {"range": None, "callable": str_to_bool, "default": True, "desc": "是否将通知消息加入消息上下文"}
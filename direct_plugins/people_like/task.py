@@ -1,7 +1,13 @@
-# 定时任务相关
+# 模型选择相关
 
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import Awaitable, Callable, Iterable, Literal, Optional, TypeVar
+from google.genai.errors import APIError
 from nonebot import logger, on_command
-from nonebot_plugin_apscheduler import scheduler
 from nonebot.rule import to_me
 from nonebot.matcher import Matcher
 from nonebot.permission import SUPERUSER
@@ -10,52 +16,224 @@ from nonebot.adapters.onebot.v11 import Bot, MessageEvent
 from .setting import get_value_or_default
 
 ALL_MODEL = ["gemini-2.5-pro", "gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-2.0-flash", "gemini-2.0-flash-lite"]
-CURRENT_MODEL_INDEX = 0
-DAILY_FAIL_COUNT: list[int] = [0] * len(ALL_MODEL)
-
-
-@scheduler.scheduled_job("interval", minutes=1, id="reset_model_index_minute")
-def reset_model_index_minute():
-    global CURRENT_MODEL_INDEX, DAILY_FAIL_COUNT
-    pre_model = ALL_MODEL[CURRENT_MODEL_INDEX]
-    for i in range(0, len(ALL_MODEL)):
-        CURRENT_MODEL_INDEX = i
-        if DAILY_FAIL_COUNT[CURRENT_MODEL_INDEX] < 3:
-            if pre_model != ALL_MODEL[CURRENT_MODEL_INDEX]:
-                logger.info(f"模型{pre_model}已禁用，切换到模型{ALL_MODEL[CURRENT_MODEL_INDEX]}")
-            break
-    else:
-        DAILY_FAIL_COUNT = [0] * len(ALL_MODEL)
-
-
-@scheduler.scheduled_job("interval", days=1, id="reset_model_index_day")
-def reset_model_index_day():
-    global CURRENT_MODEL_INDEX, DAILY_FAIL_COUNT
-    CURRENT_MODEL_INDEX = 0
-    DAILY_FAIL_COUNT = [0] * len(ALL_MODEL)
-
-
-def change_model():
-    global CURRENT_MODEL_INDEX, DAILY_FAIL_COUNT
-    DAILY_FAIL_COUNT[CURRENT_MODEL_INDEX] += 1
-    for i in range(CURRENT_MODEL_INDEX, len(ALL_MODEL)):
-        CURRENT_MODEL_INDEX = i
-        if DAILY_FAIL_COUNT[CURRENT_MODEL_INDEX] >= 3:
-            logger.info(f"模型{ALL_MODEL[CURRENT_MODEL_INDEX]}已在今日内禁用")
-        else:
-            logger.info(f"已启用模型{ALL_MODEL[CURRENT_MODEL_INDEX]}")
-            break
-    else:
-        DAILY_FAIL_COUNT = [0] * len(ALL_MODEL)
-
-
-def get_model(group_id: int) -> str:
-    default_model = ALL_MODEL[CURRENT_MODEL_INDEX]
-    return get_value_or_default(group_id, "model", default_model)
+
+RequestClass = Literal["quality", "latency"]
+"""请求类型，quality 按模型优先顺序选择，latency 选择延迟最低的模型"""
+
+T = TypeVar("T")
+
+
+class CircuitState(Enum):
+    CLOSED = "正常"
+    OPEN = "禁用"
+    HALF_OPEN = "试探"
+
+
+@dataclass
+class Sample:
+    time: float
+    ok: bool
+    latency: float
+    rate_limited: bool
+
+
+class ModelHealth:
+    """单个模型最近若干次请求的统计与熔断状态"""
+
+    def __init__(self, model: str, window: int = 50, window_seconds: float = 30 * 60) -> None:
+        self.model = model
+        self.window_seconds = window_seconds
+        self.samples: deque[Sample] = deque(maxlen=window)
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self.cooldown = ModelRouter.MIN_COOLDOWN
+        self.reopen_at = 0.0
+        self.probing = False
+
+    def recent(self) -> list[Sample]:
+        expire = time.time() - self.window_seconds
+        return [sample for sample in self.samples if sample.time >= expire]
+
+    def success_rate(self) -> Optional[float]:
+        samples = self.recent()
+        return sum(sample.ok for sample in samples) / len(samples) if samples else None
+
+    def rate_limited_rate(self) -> Optional[float]:
+        samples = self.recent()
+        return sum(sample.rate_limited for sample in samples) / len(samples) if samples else None
+
+    def latency(self, quantile: float) -> Optional[float]:
+        latencies = sorted(sample.latency for sample in self.recent() if sample.ok)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * quantile))]
+
+    def available(self, now: float) -> bool:
+        """是否可以接收请求，禁用期结束后允许一次试探请求"""
+        if self.state == CircuitState.OPEN and now >= self.reopen_at:
+            self.state = CircuitState.HALF_OPEN
+            self.probing = False
+        if self.state == CircuitState.HALF_OPEN:
+            return not self.probing
+        return self.state == CircuitState.CLOSED
+
+    def summary(self) -> str:
+        rate = self.success_rate()
+        r429 = self.rate_limited_rate()
+        p50 = self.latency(0.5)
+        p95 = self.latency(0.95)
+        parts = [
+            f"{self.model}：{self.state.value}",
+            f"成功率{'-' if rate is None else f'{rate * 100:.0f}%'}",
+            f"429率{'-' if r429 is None else f'{r429 * 100:.0f}%'}",
+            f"p50 {'-' if p50 is None else f'{p50:.1f}s'}",
+            f"p95 {'-' if p95 is None else f'{p95:.1f}s'}",
+        ]
+        if self.state == CircuitState.OPEN:
+            parts.append(f"{max(self.reopen_at - time.time(), 0):.0f}秒后试探")
+        return "，".join(parts)
+
+
+class ModelRouter:
+    """按模型健康状况选择模型
+
+    连续失败或近期成功率过低的模型会被禁用，禁用期结束后放行一次试探请求，
+    试探成功则恢复，失败则禁用期加倍
+    """
+
+    MIN_COOLDOWN = 60
+    """首次禁用秒数"""
+    MAX_COOLDOWN = 60 * 60
+    """最长禁用秒数"""
+    FAILURE_THRESHOLD = 3
+    """连续失败多少次后禁用"""
+    MIN_SUCCESS_RATE = 0.5
+    """近期成功率低于该值时禁用"""
+    MIN_SAMPLES = 6
+    """按成功率禁用所需的最少请求数"""
+
+    def __init__(self, models: list[str]) -> None:
+        self.models = models
+        self.health: dict[str, ModelHealth] = {model: ModelHealth(model) for model in models}
+
+    def get_health(self, model: str) -> ModelHealth:
+        if (health := self.health.get(model)) is None:
+            health = ModelHealth(model)
+            self.health[model] = health
+        return health
+
+    def available(self, model: str) -> bool:
+        return self.get_health(model).available(time.time())
+
+    def pick(self, request_class: RequestClass = "quality", exclude: Iterable[str] = ()) -> str:
+        """选择模型，全部不可用时选择最早结束禁用的模型"""
+        now = time.time()
+        excluded = set(exclude)
+        candidates = [
+            model for model in self.models if model not in excluded and self.health[model].available(now)
+        ]
+        if not candidates:
+            pool = [model for model in self.models if model not in excluded] or self.models
+            return min(pool, key=lambda model: self.health[model].reopen_at)
+        if request_class == "latency":
+            # 没有延迟数据的模型排在最后
+            return min(candidates, key=lambda model: self.health[model].latency(0.5) or float("inf"))
+        return candidates[0]
+
+    def prefer(self, model: str, request_class: RequestClass = "quality") -> str:
+        """优先使用指定模型，不可用时由模型路由选择"""
+        if self.available(model):
+            return model
+        return self.pick(request_class, exclude=[model])
+
+    async def track(self, model: str, request: Callable[[], Awaitable[T]]) -> T:
+        """执行单次请求并记录结果，限流与服务端错误计入失败，其他请求错误不计入统计"""
+        self.begin(model)
+        start = time.perf_counter()
+        try:
+            result = await request()
+        except APIError as e:
+            if e.code == 429 or e.code >= 500:
+                self.record(model, False, time.perf_counter() - start, rate_limited=e.code == 429)
+            else:
+                self.release(model)
+            raise
+        except asyncio.CancelledError:
+            self.release(model)
+            raise
+        except Exception:
+            self.record(model, False, time.perf_counter() - start)
+            raise
+        self.record(model, True, time.perf_counter() - start)
+        return result
+
+    def next_model(self, model: str) -> Optional[str]:
+        """按优先顺序获取排在指定模型之后的第一个可用模型"""
+        now = time.time()
+        start = self.models.index(model) + 1 if model in self.models else 0
+        for candidate in self.models[start:]:
+            if self.health[candidate].available(now):
+                return candidate
+        return None
+
+    def begin(self, model: str):
+        """请求开始，试探状态下标记已有请求在进行"""
+        health = self.get_health(model)
+        if health.state == CircuitState.HALF_OPEN:
+            health.probing = True
+
+    def release(self, model: str):
+        """请求因与模型无关的原因结束，不计入统计"""
+        self.get_health(model).probing = False
+
+    def record(self, model: str, ok: bool, latency: float, rate_limited: bool = False):
+        """记录请求结果"""
+        health = self.get_health(model)
+        health.samples.append(Sample(time.time(), ok, latency, rate_limited))
+        if ok:
+            health.consecutive_failures = 0
+            if health.state != CircuitState.CLOSED:
+                logger.info(f"模型{model}试探请求成功，已恢复")
+            health.state = CircuitState.CLOSED
+            health.cooldown = self.MIN_COOLDOWN
+            health.probing = False
+            return
+        health.consecutive_failures += 1
+        if health.state == CircuitState.HALF_OPEN:
+            # 试探失败，禁用期加倍
+            health.cooldown = min(health.cooldown * 2, self.MAX_COOLDOWN)
+            self.open(health)
+            return
+        rate = health.success_rate()
+        if health.consecutive_failures >= self.FAILURE_THRESHOLD or (
+            rate is not None and len(health.recent()) >= self.MIN_SAMPLES and rate < self.MIN_SUCCESS_RATE
+        ):
+            self.open(health)
+
+    def open(self, health: ModelHealth):
+        health.state = CircuitState.OPEN
+        health.probing = False
+        health.reopen_at = time.time() + health.cooldown
+        logger.info(f"模型{health.model}已禁用{health.cooldown}秒")
+
+    def report(self) -> str:
+        return "\n".join(self.health[model].summary() for model in self.models)
+
+
+MODEL_ROUTER = ModelRouter(ALL_MODEL)
+"""聊天模型选择"""
+
+
+def get_model(group_id: int, request_class: RequestClass = "quality", exclude: Iterable[str] = ()) -> str:
+    """获取群组使用的模型，群组指定的模型不可用时由模型路由选择"""
+    model: Optional[str] = get_value_or_default(group_id, "model", None)
+    if model and model not in exclude and MODEL_ROUTER.available(model):
+        return model
+    return MODEL_ROUTER.pick(request_class, exclude)
 
 
 @on_command("当前模型", permission=SUPERUSER, rule=to_me(), priority=1, block=True).handle()
 async def current_model(bot: Bot, matcher: Matcher, e: MessageEvent):
-    model = ALL_MODEL[CURRENT_MODEL_INDEX]
+    model = MODEL_ROUTER.pick()
     logger.info(f"当前模型{model}")
-    await matcher.finish(model)
+    await matcher.finish(f"当前模型{model}\n{MODEL_ROUTER.report()}")
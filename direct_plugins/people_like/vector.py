@@ -1,7 +1,8 @@
 # 向量数据库相关
 
+import asyncio
 import json
-from typing import Optional
+from typing import Awaitable, Callable, Literal, Optional, TypeVar
 from pydantic import BaseModel
 from pymilvus import DataType, AsyncMilvusClient, MilvusClient
 from nonebot import get_driver, logger
@@ -14,6 +15,9 @@ from google.genai.types import (
 from common import retry_on_exception
 
 from .config import plugin_config
+from .index_profile import IndexProfile
+from .memo import GEMINI_MEMO
+from .governor import GOVERNOR, Priority, estimate_tokens
 
 _GEMINI_CLIENT = genai.Client(
     api_key=plugin_config.gemini_key,
@@ -40,6 +44,8 @@ async def init_milvus_vector() -> "MilvusVector":
         plugin_config.query_len,
         plugin_config.search_len,
         plugin_config.self_len,
+        plugin_config.milvus.consistency_level,
+        plugin_config.milvus.index_profile(),
     )
     return _MILVUS_VECTOR_CLIENT
 
@@ -70,27 +76,88 @@ class VectorData(BaseModel):
 
 class VectorDataImage(BaseModel):
     id: Optional[int] = None  # 自增主键
-    description: Optional[str]
-    name: Optional[str]
-    summary: Optional[str]
-    mime_type: Optional[str]
-    file_size: Optional[int]
-    key: Optional[str]
-    emoji_id: Optional[str]
-    emoji_package_id: Optional[str]
-    vec: Optional[list[float]]  # 向量数据，假设为浮点数列表
+    description: Optional[str] = None
+    name: Optional[str] = None
+    summary: Optional[str] = None
+    mime_type: Optional[str] = None
+    file_size: Optional[int] = None
+    key: Optional[str] = None
+    emoji_id: Optional[str] = None
+    emoji_package_id: Optional[str] = None
+    vec: Optional[list[float]] = None  # 向量数据，假设为浮点数列表
     extra: Optional[dict] = None  # 可选的额外信息
 
 
+Projection = Literal["ids", "send", "meta", "full"]
+"""图片数据查询返回字段范围"""
+
+PROJECTION_FIELDS: dict[str, list[str]] = {
+    # 仅主键与图片名称
+    "ids": ["id", "name"],
+    # 发送图片所需字段
+    "send": ["id", "name", "summary", "mime_type", "key", "emoji_id", "emoji_package_id"],
+    # 除向量外的所有字段
+    "meta": [
+        "id",
+        "description",
+        "name",
+        "summary",
+        "mime_type",
+        "file_size",
+        "key",
+        "emoji_id",
+        "emoji_package_id",
+        "extra",
+    ],
+    # 包含向量在内的所有字段
+    "full": [
+        "id",
+        "description",
+        "name",
+        "summary",
+        "mime_type",
+        "file_size",
+        "key",
+        "emoji_id",
+        "emoji_package_id",
+        "vec",
+        "extra",
+    ],
+}
+
+
+def to_vector_data_image(entity: dict, projection: Projection) -> VectorDataImage:
+    """将查询结果转换为 VectorDataImage，非 full 模式下跳过校验以减少开销"""
+    if projection == "full":
+        return VectorDataImage(**entity)
+    return VectorDataImage.model_construct(**{k: entity.get(k) for k in PROJECTION_FIELDS[projection]})
+
+
+R = TypeVar("R")
+
+
 class MilvusVector:
     def __init__(
-        self, uri: str, username: str, password: str, query_len: int = 10, search_len: int = 10, self_len: int = 3
+        self,
+        uri: str,
+        username: str,
+        password: str,
+        query_len: int = 10,
+        search_len: int = 10,
+        self_len: int = 3,
+        consistency_level: str = "Bounded",
+        profile: Optional[IndexProfile] = None,
     ):
         self.query_len = query_len
         self.search_len = search_len
         self.self_len = self_len
+        self.consistency_level = consistency_level
+        self.profile = profile or IndexProfile()
 
         self.collection_name_image = "people_like_image"
+        self.loaded = False
+        """集合是否已加载到内存，出错时重置并重新加载"""
+        self.load_lock = asyncio.Lock()
 
         self.client = MilvusClient(uri=uri, user=username, password=password)
         self.async_client = AsyncMilvusClient(uri=uri, user=username, password=password)
@@ -100,39 +167,109 @@ class MilvusVector:
     def create_collection(self):
         # 创建图片集合
         if not self.client.has_collection(self.collection_name_image):
-            schema = self.client.create_schema(
-                auto_id=True,  # 启用自增主键[3,4](@ref)
-                enable_dynamic_field=False,
-            )
-            schema.add_field("id", DataType.INT64, is_primary=True)
-            schema.add_field("description", DataType.VARCHAR, max_length=8192)
-            schema.add_field("name", DataType.VARCHAR, max_length=1024)
-            schema.add_field("summary", DataType.VARCHAR, max_length=1024, nullable=True)
-            schema.add_field("mime_type", DataType.VARCHAR, max_length=255)
-            schema.add_field("file_size", DataType.INT64, nullable=True)  # 文件大小
-            schema.add_field("key", DataType.VARCHAR, max_length=1024, nullable=True)
-            schema.add_field("emoji_id", DataType.VARCHAR, max_length=255, nullable=True)
-            schema.add_field("emoji_package_id", DataType.VARCHAR, max_length=255, nullable=True)
-            schema.add_field("vec", DataType.FLOAT_VECTOR, dim=768)  # 向量维度需自定义
-            schema.add_field("extra", DataType.JSON, nullable=True)
-
-            # 创建索引参数（向量字段必建索引）
-            index_params = self.client.prepare_index_params()
-            index_params.add_index(
-                field_name="vec",
-                index_type="IVF_FLAT",  # 中等规模数据集推荐[3](@ref)
-                metric_type="COSINE",  # 余弦相似度
-                params={"nlist": 128},  # 聚类中心数
-            )
-
-            # 创建集合
-            self.client.create_collection(
-                collection_name=self.collection_name_image, schema=schema, index_params=index_params
-            )
+            self.create_image_collection(self.collection_name_image, self.profile)
             logger.info(f"Collection '{self.collection_name_image}' created.")
         else:
             logger.info(f"Collection '{self.collection_name_image}' already exists.")
+            # 以集合实际使用的索引类型为准，避免重建索引后配置未同步导致搜索参数不匹配
+            try:
+                index_info = self.client.describe_index(self.collection_name_image, index_name="vec")
+                if (index_type := index_info.get("index_type")) and index_type != self.profile.index_type:
+                    logger.warning(f"集合索引类型为{index_type}，与配置的{self.profile.index_type}不一致，以集合为准")
+                    self.profile.index_type = index_type
+            except Exception as e:
+                logger.warning(f"读取集合索引信息失败：{repr(e)}")
+
+    def create_image_collection(self, collection_name: str, profile: IndexProfile):
+        """按指定索引配置创建图片集合"""
+        schema = self.client.create_schema(
+            auto_id=True,  # 启用自增主键[3,4](@ref)
+            enable_dynamic_field=False,
+        )
+        schema.add_field("id", DataType.INT64, is_primary=True)
+        schema.add_field("description", DataType.VARCHAR, max_length=8192)
+        schema.add_field("name", DataType.VARCHAR, max_length=1024)
+        schema.add_field("summary", DataType.VARCHAR, max_length=1024, nullable=True)
+        schema.add_field("mime_type", DataType.VARCHAR, max_length=255)
+        schema.add_field("file_size", DataType.INT64, nullable=True)  # 文件大小
+        schema.add_field("key", DataType.VARCHAR, max_length=1024, nullable=True)
+        schema.add_field("emoji_id", DataType.VARCHAR, max_length=255, nullable=True)
+        schema.add_field("emoji_package_id", DataType.VARCHAR, max_length=255, nullable=True)
+        schema.add_field("vec", DataType.FLOAT_VECTOR, dim=768)  # 向量维度需自定义
+        schema.add_field("extra", DataType.JSON, nullable=True)
 
+        # 创建索引参数（向量字段必建索引）
+        index_params = self.client.prepare_index_params()
+        index_params.add_index(
+            field_name="vec",
+            index_name="vec",
+            index_type=profile.index_type,
+            metric_type="COSINE",  # 余弦相似度
+            params=profile.index_params(),
+        )
+
+        # 创建集合
+        self.client.create_collection(collection_name=collection_name, schema=schema, index_params=index_params)
+
+    async def reindex(self, profile: IndexProfile) -> int:
+        """使用新的索引配置重建图片集合，返回复制的数据条数
+
+        先将数据复制到使用新索引的临时集合，完成后删除原集合并将临时集合重命名为原集合名称；
+        复制期间新写入原集合的数据不会被复制
+        """
+        tmp_collection_name = f"{self.collection_name_image}_reindex"
+
+        def run() -> int:
+            if self.client.has_collection(tmp_collection_name):
+                self.client.drop_collection(tmp_collection_name)
+            self.create_image_collection(tmp_collection_name, profile)
+            self.client.load_collection(self.collection_name_image)
+            iterator = self.client.query_iterator(
+                collection_name=self.collection_name_image,
+                batch_size=500,
+                output_fields=PROJECTION_FIELDS["full"],
+            )
+            copied = 0
+            while batch := iterator.next():
+                for item in batch:
+                    item.pop("id", None)
+                self.client.insert(collection_name=tmp_collection_name, data=batch)
+                copied += len(batch)
+                logger.info(f"重建索引已复制{copied}条数据")
+            iterator.close()
+            # 替换原集合
+            self.client.release_collection(self.collection_name_image)
+            self.client.drop_collection(self.collection_name_image)
+            self.client.rename_collection(tmp_collection_name, self.collection_name_image)
+            return copied
+
+        async with self.load_lock:
+            copied = await asyncio.to_thread(run)
+            self.profile = profile
+            self.loaded = False
+        logger.info(f"Collection '{self.collection_name_image}' 已使用{profile.index_type}索引重建，共{copied}条数据")
+        return copied
+
+    async def ensure_loaded(self):
+        """加载集合，已加载时直接返回"""
+        if self.loaded:
+            return
+        async with self.load_lock:
+            if not self.loaded:
+                await self.async_client.load_collection(collection_name=self.collection_name_image)
+                self.loaded = True
+                logger.info(f"Collection '{self.collection_name_image}' loaded.")
+
+    async def call_loaded(self, func: Callable[[], Awaitable[R]]) -> R:
+        """确保集合已加载后执行操作，失败时重新加载集合并重试一次（如 Milvus 重启或连接断开后集合被释放）"""
+        await self.ensure_loaded()
+        try:
+            return await func()
+        except Exception as e:
+            logger.warning(f"Milvus 操作失败，重新加载集合后重试：{repr(e)}")
+            self.loaded = False
+            await self.ensure_loaded()
+            return await func()
 
     async def insert_image_data(self, data: list[VectorDataImage]):
         """插入数据到 Milvus 向量数据库 collection_name_image"""
@@ -142,38 +279,29 @@ class MilvusVector:
         res = await self.async_client.insert(collection_name=self.collection_name_image, data=data_dict)
         return res["insert_count"]
 
-    async def query_image_data(self, file_id: str | list[str]) -> list[VectorDataImage]:
+    async def query_image_data(
+        self, file_id: str | list[str], limit: int = 0, projection: Projection = "full"
+    ) -> list[VectorDataImage]:
         exprs = []
         if isinstance(file_id, list):
             exprs.append(f"name in {repr(file_id)}")
         else:
             exprs.append(f"name == '{file_id}'")
-        await self.async_client.load_collection(collection_name=self.collection_name_image)
-        results = await self.async_client.query(
+        results = await self.call_loaded(lambda: self.async_client.query(
             collection_name=self.collection_name_image,
             filter=" and ".join(exprs),
-            output_fields=[
-                "id",
-                "description",
-                "name",
-                "summary",
-                "mime_type",
-                "file_size",
-                "key",
-                "emoji_id",
-                "emoji_package_id",
-                "vec",
-                "extra",
-            ],
-            limit=self.query_len,  # 限制返回数量
-        )
-        return [VectorDataImage(**item) for item in results]
+            output_fields=PROJECTION_FIELDS[projection],
+            limit=self.query_len if limit == 0 else limit,  # 限制返回数量
+            consistency_level=self.consistency_level,
+        ))
+        return [to_vector_data_image(item, projection) for item in results]
 
     async def search_image_data(
         self,
         query_vector: list[list[float]],
         file_id: str | bool = False,
         search_len: int = 0,
+        projection: Projection = "full",
     ) -> list[VectorDataImage]:
         exprs: list[str] = []
         if file_id:
@@ -181,40 +309,22 @@ class MilvusVector:
                 exprs.append("name != ''")
             elif isinstance(file_id, str):
                 exprs.append(f"name == '{file_id}'")
-        await self.async_client.load_collection(collection_name=self.collection_name_image)
-        results = await self.async_client.search(
+        results = await self.call_loaded(lambda: self.async_client.search(
             collection_name=self.collection_name_image,
             data=query_vector,
             filter=" and ".join(exprs),
-            search_params={
-                "metric_type": "COSINE",
-                "params": {
-                    "nprobe": 8,  # 搜索空间大小（精度-性能平衡点）
-                },
-            },
-            output_fields=[
-                "id",
-                "description",
-                "name",
-                "summary",
-                "mime_type",
-                "file_size",
-                "key",
-                "emoji_id",
-                "emoji_package_id",
-                "vec",
-                "extra",
-            ],
+            search_params=self.profile.search_params(),
+            output_fields=PROJECTION_FIELDS[projection],
             limit=self.search_len if search_len == 0 else search_len,  # 限制返回数量
-            consistency_level="Strong",  # 强一致性
-        )
+            consistency_level=self.consistency_level,
+        ))
         # 适配 Milvus 返回结构
         vector_data_image_list = []
         if results and len(results) > 0:
             for item in results[0]:
                 # 如果是 entity 结构
                 entity = item.get("entity", item)
-                vector_data_image_list.append(VectorDataImage(**entity))
+                vector_data_image_list.append(to_vector_data_image(entity, projection))
         return vector_data_image_list
 
     async def delete_image_data(self, file_id: str | list[str]) -> int:
@@ -224,44 +334,145 @@ class MilvusVector:
             exprs.append(f"name in {repr(file_id)}")
         else:
             exprs.append(f"name == '{file_id}'")
-        await self.async_client.load_collection(collection_name=self.collection_name_image)
-        res = await self.async_client.delete(
+        res = await self.call_loaded(lambda: self.async_client.delete(
             collection_name=self.collection_name_image,
             filter=" and ".join(exprs),
-        )
+        ))
         return res["delete_count"]
 
-@retry_on_exception(max_retries=5)
+EMBEDDING_MODEL = "text-embedding-004"
+"""文本向量模型"""
+
+IMAGE_DESCRIPTION_MODEL = "gemini-2.5-flash-lite"
+"""图片描述模型"""
+
+
 async def get_text_embedding(text: str) -> list[float]:
-    """获取文本的向量表示"""
-    global _GEMINI_CLIENT
+    """获取文本的向量表示，相同文本优先读取缓存"""
     if not text:
         return []
-    resp = await _GEMINI_CLIENT.aio.models.embed_content(
-        model="text-embedding-004",
-        contents=text,
+    key = GEMINI_MEMO.make_key(EMBEDDING_MODEL, text)
+    if (cached := await GEMINI_MEMO.get(key)) is not None:
+        return cached
+    value = await request_text_embedding(text)
+    # 请求无返回值时不进行缓存
+    if value:
+        await GEMINI_MEMO.set(key, EMBEDDING_MODEL, value)
+    return value
+
+
+EMBEDDING_BATCH_SIZE = 100
+"""单次批量向量请求最多包含的文本数量"""
+
+
+async def get_text_embeddings(texts: list[str]) -> list[list[float]]:
+    """批量获取文本的向量表示，返回结果与输入顺序一致
+
+    相同文本只请求一次，超出单次请求上限时拆分为多次请求；
+    批量请求失败时逐条重试，仍然失败的文本返回空列表
+    """
+    results: list[list[float]] = [[] for _ in texts]
+    keys = {text: GEMINI_MEMO.make_key(EMBEDDING_MODEL, text) for text in texts if text}
+    cached = await GEMINI_MEMO.get_many(list(keys.values()))
+    pending: list[str] = [text for text, key in keys.items() if key not in cached]
+    values: dict[str, list[float]] = {text: cached[key] for text, key in keys.items() if key in cached}
+
+    for start in range(0, len(pending), EMBEDDING_BATCH_SIZE):
+        batch = pending[start : start + EMBEDDING_BATCH_SIZE]
+        try:
+            batch_values = await request_text_embeddings(batch)
+        except Exception as e:
+            logger.warning(f"批量获取{len(batch)}条文本向量失败，改为逐条请求：{repr(e)}")
+            batch_values = [[] for _ in batch]
+        for text, value in zip(batch, batch_values):
+            if not value:
+                # 批量结果缺失的文本逐条重试
+                try:
+                    value = await request_text_embedding(text)
+                except Exception as e:
+                    logger.error(f"获取文本向量失败：{repr(e)}")
+                    continue
+            if value:
+                values[text] = value
+                await GEMINI_MEMO.set(keys[text], EMBEDDING_MODEL, value)
+
+    for index, text in enumerate(texts):
+        if text:
+            results[index] = values.get(text, [])
+    return results
+
+
+@retry_on_exception(max_retries=3)
+async def request_text_embeddings(texts: list[str]) -> list[list[float]]:
+    """批量请求文本的向量表示，缺失的结果以空列表占位"""
+    global _GEMINI_CLIENT
+    resp = await GOVERNOR.call(
+        EMBEDDING_MODEL,
+        lambda: _GEMINI_CLIENT.aio.models.embed_content(
+            model=EMBEDDING_MODEL,
+            contents=texts,  # type: ignore
+        ),
+        priority=Priority.INTERACTIVE,
+        tokens=estimate_tokens(texts),
     )
-    embedding = resp.embeddings
-    value = embedding[0].values if embedding else []
-    return value if value else [0.0] * 768  # 假设向量维度为768，如果没有返回值则返回全0向量
+    embeddings = resp.embeddings or []
+    values = [embedding.values or [] for embedding in embeddings]
+    if len(values) != len(texts):
+        logger.warning(f"批量向量请求返回{len(values)}条结果，与请求的{len(texts)}条不一致")
+        return [[] for _ in texts]
+    return values
 
 
 @retry_on_exception(max_retries=5)
+async def request_text_embedding(text: str) -> list[float]:
+    """请求文本的向量表示，没有返回值时返回空列表"""
+    global _GEMINI_CLIENT
+    resp = await GOVERNOR.call(
+        EMBEDDING_MODEL,
+        lambda: _GEMINI_CLIENT.aio.models.embed_content(
+            model=EMBEDDING_MODEL,
+            contents=text,
+        ),
+        priority=Priority.INTERACTIVE,
+        tokens=estimate_tokens(text),
+    )
+    embedding = resp.embeddings
+    value = embedding[0].values if embedding else None
+    return value or []
+
+
 async def analysis_image_to_str_description(parts: list[Part]) -> str:
-    """分析图片，返回图片分析内容"""
+    """分析图片，返回图片分析内容，相同图片与提示词优先读取缓存"""
+    key = GEMINI_MEMO.make_key(IMAGE_DESCRIPTION_MODEL, *GEMINI_MEMO.parts_payload(parts))
+    if (cached := await GEMINI_MEMO.get(key)) is not None:
+        return cached
+    description = await request_image_description(parts)
+    if description:
+        await GEMINI_MEMO.set(key, IMAGE_DESCRIPTION_MODEL, description)
+    return description
+
+
+@retry_on_exception(max_retries=5)
+async def request_image_description(parts: list[Part]) -> str:
+    """请求分析图片"""
     global _GEMINI_CLIENT
-    response = await _GEMINI_CLIENT.aio.models.generate_content(
-        model="gemini-2.5-flash-lite",
-        contents=[
-            Content(
-                role="user",
-                parts=parts,
-            )
-        ],
-        config=GenerateContentConfig(
-            response_mime_type="application/json",
-            response_schema=list[str],
+    response = await GOVERNOR.call(
+        IMAGE_DESCRIPTION_MODEL,
+        lambda: _GEMINI_CLIENT.aio.models.generate_content(
+            model=IMAGE_DESCRIPTION_MODEL,
+            contents=[
+                Content(
+                    role="user",
+                    parts=parts,
+                )
+            ],
+            config=GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=list[str],
+            ),
         ),
+        priority=Priority.INGESTION,
+        tokens=estimate_tokens(parts),
     )
     arr: list[str] = json.loads(str(response.text))
 
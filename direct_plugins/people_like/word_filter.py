@@ -0,0 +1,203 @@
+# 回复内容过滤
+
+import asyncio
+from collections import deque
+from datetime import date, datetime
+from pathlib import Path
+from typing import Iterable, Optional
+from nonebot import logger
+from nonebot_plugin_orm import get_session
+from sqlalchemy import select
+
+from .model import GroupMsg
+
+DO_NOT_SEND_FILE = Path(__file__).parent / "do_not_send.txt"
+
+_STATIC_EXTRA_WORDS = ["ignore", "忽略"]
+"""固定追加到 do_not_send.txt 之后的词汇"""
+
+
+class AhoCorasick:
+    """多模式子串匹配自动机，一次扫描判断文本是否包含任意一个模式串
+
+    空字符串不会被加入自动机
+    """
+
+    __slots__ = ("goto", "fail", "output", "patterns")
+
+    def __init__(self, patterns: Iterable[str]) -> None:
+        self.goto: list[dict[str, int]] = [{}]
+        self.output: list[Optional[str]] = [None]
+        self.patterns = 0
+        for pattern in patterns:
+            if not pattern:
+                continue
+            self.patterns += 1
+            node = 0
+            for ch in pattern:
+                if (child := self.goto[node].get(ch)) is None:
+                    child = len(self.goto)
+                    self.goto[node][ch] = child
+                    self.goto.append({})
+                    self.output.append(None)
+                node = child
+            self.output[node] = pattern
+        # 按层构建失败指针，节点的输出继承失败指针指向节点的输出
+        self.fail = [0] * len(self.goto)
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[child] = self.goto[f].get(ch, 0)
+                if self.output[child] is None:
+                    self.output[child] = self.output[self.fail[child]]
+
+    def search(self, text: str) -> Optional[str]:
+        """返回文本中包含的任意一个模式串，不包含时返回 None"""
+        goto, fail, output = self.goto, self.fail, self.output
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if (matched := output[node]) is not None:
+                return matched
+        return None
+
+
+SEGMENT_FILTER = AhoCorasick(["face", "FACE", "at", "AT", "@", "poke", "POKE", "meme", "MEME"])
+"""消息文本段中不能出现的调用格式残留"""
+
+
+class StaticWords:
+    """do_not_send.txt 中的词汇，文件修改时间变化时重新构建自动机"""
+
+    def __init__(self, path: Path, extra: list[str]) -> None:
+        self.path = path
+        self.extra = extra
+        self.mtime: Optional[float] = None
+        self.automaton = AhoCorasick(extra)
+
+    def get(self) -> AhoCorasick:
+        try:
+            mtime = self.path.stat().st_mtime
+        except FileNotFoundError:
+            return self.automaton
+        if mtime != self.mtime:
+            words = [s.strip() for s in self.path.read_text(encoding="utf-8").splitlines()]
+            self.automaton = AhoCorasick([*words, *self.extra])
+            self.mtime = mtime
+            logger.info(f"已加载禁止发送的词汇{self.automaton.patterns}个")
+        return self.automaton
+
+
+class SelfSpeech:
+    """群组中机器人当天已经发送过的内容，新增内容后在下一次匹配时重新构建自动机"""
+
+    __slots__ = ("day", "texts", "loaded", "_automaton")
+
+    def __init__(self, day: date) -> None:
+        self.day = day
+        self.texts: set[str] = set()
+        self.loaded = False
+        self._automaton: Optional[AhoCorasick] = None
+
+    def add(self, text: str):
+        if text and text not in self.texts:
+            self.texts.add(text)
+            self._automaton = None
+
+    @property
+    def automaton(self) -> AhoCorasick:
+        if self._automaton is None:
+            self._automaton = AhoCorasick(self.texts)
+        return self._automaton
+
+
+class WordFilter:
+    """单次回复使用的过滤器，文本包含任意一个禁止词汇或机器人当天发送过的内容时匹配"""
+
+    __slots__ = ("automata", "literals")
+
+    def __init__(self, automata: list[AhoCorasick], literals: list[str]) -> None:
+        self.automata = automata
+        self.literals = literals
+
+    def search(self, text: str) -> Optional[str]:
+        """返回文本中包含的任意一个词汇，不包含时返回 None"""
+        for literal in self.literals:
+            if literal in text:
+                return literal
+        for automaton in self.automata:
+            if (matched := automaton.search(text)) is not None:
+                return matched
+        return None
+
+    def __repr__(self) -> str:
+        return f"WordFilter({self.literals}，{[automaton.patterns for automaton in self.automata]})"
+
+
+class WordFilterManager:
+    """按群组维护回复内容过滤器"""
+
+    def __init__(self, path: Path) -> None:
+        self.static = StaticWords(path, _STATIC_EXTRA_WORDS)
+        self.groups: dict[int, SelfSpeech] = {}
+        self.loading: dict[int, asyncio.Task[None]] = {}
+
+    def speech(self, group_id: int) -> SelfSpeech:
+        """获取群组当天的发言记录，跨天时重新开始"""
+        today = date.today()
+        if (speech := self.groups.get(group_id)) is None or speech.day != today:
+            speech = SelfSpeech(today)
+            self.groups[group_id] = speech
+        return speech
+
+    def record(self, group_id: int, texts: Iterable[str]):
+        """记录机器人发送的内容"""
+        speech = self.speech(group_id)
+        for text in texts:
+            speech.add(text)
+
+    async def load(self, group_id: int, speech: SelfSpeech):
+        """从数据库读取机器人当天在群组中发送的内容，同一群组并发调用只查询一次"""
+        if (task := self.loading.get(group_id)) is None:
+            task = asyncio.create_task(self._load(group_id, speech))
+            self.loading[group_id] = task
+            task.add_done_callback(lambda _: self.loading.pop(group_id, None))
+        await asyncio.shield(task)
+
+    async def _load(self, group_id: int, speech: SelfSpeech):
+        today_zero_time = int(datetime.combine(speech.day, datetime.min.time()).timestamp())
+        try:
+            async with get_session() as session:
+                rows = (
+                    await session.execute(
+                        select(GroupMsg.file_id, GroupMsg.content)
+                        .where(GroupMsg.group_id == group_id)
+                        .where(GroupMsg.self_msg)
+                        .where(GroupMsg.time >= today_zero_time)
+                    )
+                ).all()
+        except Exception as e:
+            logger.error(e)
+            return
+        for file_id, content in rows:
+            speech.add(file_id if file_id else content)
+        speech.loaded = True
+
+    async def get(self, group_id: int, bot_nickname: str) -> WordFilter:
+        """获取群组的回复内容过滤器"""
+        speech = self.speech(group_id)
+        if not speech.loaded:
+            await self.load(group_id, speech)
+        # 将我是xxx过滤掉
+        return WordFilter([self.static.get(), speech.automaton], [f"我是{bot_nickname}"])
+
+
+WORD_FILTER = WordFilterManager(DO_NOT_SEND_FILE)
+"""回复内容过滤"""
@@ -6,7 +6,7 @@ from typing import Optional
 from nonebot.matcher import Matcher
 from .struct import BanImage
 from nonebot.params import Depends
-from common.struct import ExpirableDict
+from common.struct import EXPIRABLE_DICTS, ExpirableDictFamily
 from common.permission import owner_permission
 from .metadata import __plugin_meta__ as __plugin_meta__
 from nonebot import require
@@ -35,7 +35,7 @@ async def get_ban_image(event: GroupMessageEvent) -> BanImage:
         return ban_image
 
 
-mute_dict: dict[int, ExpirableDict[str, int]] = {}
+mute_dict: ExpirableDictFamily[int, str, int] = EXPIRABLE_DICTS.family("ban_image.mute_dict")
 """分群组存储禁言字典"""
 
 
@@ -51,16 +51,14 @@ async def check_img(event: GroupMessageEvent, ban_image: BanImage = Depends(get_
 
 async def compute_mute_time(event: GroupMessageEvent) -> int:
     """计算禁言时间"""
-    global mute_dict
     user_id = event.user_id
     group_id = event.group_id
     # 判断这个成员是否于指定时间段内被禁言过，如果是，则加大处罚力度
-    mute_dict_group = mute_dict.get(group_id, ExpirableDict(str(group_id)))
+    mute_dict_group = mute_dict.get(group_id)
     key = str(user_id)
     time = 1 if (t := mute_dict_group.get(key)) is None else t << 1
     logger.debug(f"ttl: {mute_dict_group.ttl(key)}s")
     mute_dict_group.set(key, time, ttl=time * 2 * 60)
-    mute_dict.update({group_id: mute_dict_group})
     return time
 
 
@@ -14,7 +14,7 @@ from nonebot.exception import IgnoredException
 from nonebot.permission import SUPERUSER
 
 from nonebot.message import run_preprocessor
-from common.struct import ExpirableDict
+from common.struct import EXPIRABLE_DICTS, ExpirableDictFamily
 
 from .config import Config, plugin_config
 
@@ -25,7 +25,7 @@ __plugin_meta__ = PluginMetadata(
     config=Config,
 )
 
-throttle_dict: dict[str, ExpirableDict[str, str]] = {}
+throttle_dict: ExpirableDictFamily[str, str, str] = EXPIRABLE_DICTS.family("throttle.throttle_dict")
 
 
 @run_preprocessor
@@ -38,7 +38,6 @@ async def _(event: Event, matcher: Matcher):
     Raises:
         IgnoredException: _description_
     """
-    global throttle_dict
     session_id = (sid := event.get_session_id())[: sid.rfind("_")]
     user_id = event.get_user_id()
     if event.get_type() != "message":
@@ -48,7 +47,7 @@ async def _(event: Event, matcher: Matcher):
         logger.debug(f"用户{user_id}在白名单中，不进行节流处理")
         return
     if plugin_config.throttle_count_limit <= 0:  # 如果不配置响应次数，则对每一个用户独立进行节流
-        expirable_dict = throttle_dict.get(session_id, ExpirableDict(name=session_id))
+        expirable_dict = throttle_dict.get(session_id)
         # ttl > 0 则说明在一段时间内处理过该用户的消息，则不再处理
         if (ttl := expirable_dict.ttl(user_id)) > 0:
             tip = f"用户{user_id}在{plugin_config.throttle_time_out - ttl}秒内已处理过消息，不再处理"
@@ -57,9 +56,8 @@ async def _(event: Event, matcher: Matcher):
             raise IgnoredException("节流处理")
         else:
             expirable_dict.set(user_id, user_id, plugin_config.throttle_time_out)
-            throttle_dict.update({session_id: expirable_dict})
     else:  # 如果配置了响应次数，则对同一个对话中的所有用户进行节流
-        expirable_dict = throttle_dict.get(session_id, ExpirableDict(name=session_id))
+        expirable_dict = throttle_dict.get(session_id)
         if len(keys := expirable_dict.keys()) >= plugin_config.throttle_count_limit:
             tip = "\n".join(
                 [
@@ -72,7 +70,6 @@ async def _(event: Event, matcher: Matcher):
             raise IgnoredException("节流处理")
         else:
             expirable_dict.set(str(time.time() * 1000), user_id, plugin_config.throttle_time_out)
-            throttle_dict.update({session_id: expirable_dict})
 
 
 white_list_setting = on_alconna(
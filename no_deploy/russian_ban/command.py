@@ -23,7 +23,7 @@ from nonebot.adapters.onebot.v11 import (
 from nonebot_plugin_waiter import waiter
 from random import choices, choice
 from .config import config
-from common.struct import ExpirableDict
+from common.struct import EXPIRABLE_DICTS, ExpirableDictFamily
 from common.permission import admin_permission
 from .model import ScheduleBanJob
 from asyncio import Lock
@@ -475,7 +475,7 @@ async def _(event: GroupMessageEvent, matcher: Matcher):
         await matcher.finish(msg)
 
 
-mock_mute_dict: dict[int, ExpirableDict[str, int]] = {}
+mock_mute_dict: ExpirableDictFamily[int, str, int] = EXPIRABLE_DICTS.family("russian_ban.mock_mute_dict")
 """虚假禁言列表
 """
 
@@ -490,13 +490,11 @@ async def _(bot: Bot, event: GroupMessageEvent, matcher: Matcher, arg: Message =
         bot (Bot): bot 对象
         event (GroupMessageEvent): 群组消息事件
     """
-    global mock_mute_dict
     group_id = event.group_id
-    mock_mute_dict_group = mock_mute_dict.get(group_id, ExpirableDict(str(group_id)))
+    mock_mute_dict_group = mock_mute_dict.get(group_id)
     qq = arg[0].data.get("qq")
     period = int(arg[1].data.get("text") or 0)
     mock_mute_dict_group.set(str(qq), 1, period * 60)
-    mock_mute_dict.update({group_id: mock_mute_dict_group})
     message = [MessageSegment.at(int(qq or 0)), MessageSegment.text(f" 你已被管理员禁言{period}分钟")]
     await matcher.finish(Message(message))
 
@@ -513,13 +511,11 @@ async def _(bot: Bot, event: GroupMessageEvent, matcher: Matcher, arg: Message =
         bot (Bot): bot 对象
         event (GroupMessageEvent): 群组消息事件
     """
-    global mock_mute_dict
     group_id = event.group_id
-    mock_mute_dict_group = mock_mute_dict.get(group_id, ExpirableDict(str(group_id)))
+    mock_mute_dict_group = mock_mute_dict.peek(group_id)
     qq = arg[0].data.get("qq")
-    if mock_mute_dict_group.get(str(qq)) is not None:
+    if mock_mute_dict_group is not None and mock_mute_dict_group.get(str(qq)) is not None:
         mock_mute_dict_group.delete(str(qq))
-        mock_mute_dict.update({group_id: mock_mute_dict_group})
         message = [MessageSegment.at(int(qq or 0)), MessageSegment.text(" 你已被管理员解除禁言")]
         await matcher.finish(Message(message))
     else:
@@ -531,7 +527,9 @@ async def _(bot: Bot, event: GroupMessageEvent, matcher: Matcher, arg: Message =
 async def _(bot: Bot, event: PokeNotifyEvent, matcher: Matcher):
     """收到戳一戳事件，如果用户处于禁言状态，则返回其剩余的解禁时间"""
     group_id = event.group_id
-    mock_mute_dict_group = mock_mute_dict.get(group_id or 0, ExpirableDict(str(group_id)))
+    # 只读取，不为没有模拟禁言记录的群组创建字典
+    if (mock_mute_dict_group := mock_mute_dict.peek(group_id or 0)) is None:
+        return
     qq = event.user_id
     if (ttl := mock_mute_dict_group.ttl(str(qq))) > 0:
         message = [MessageSegment.at(int(qq)), MessageSegment.text(f" 你剩余禁言时间还有 {ttl//60}:{ttl%60:02}")]
@@ -545,9 +543,8 @@ async def delete_message_judge(bot: Bot, event: GroupMessageEvent):
     Args:
         event (GroupMessageEvent): 群组消息事件
     """
-    global mock_mute_dict
     group_id = event.group_id
     user_id = event.user_id
-    mock_mute_dict_group = mock_mute_dict.get(group_id, ExpirableDict(str(group_id)))
-    if mock_mute_dict_group.ttl(str(user_id)) > 0:
+    mock_mute_dict_group = mock_mute_dict.peek(group_id)
+    if mock_mute_dict_group is not None and mock_mute_dict_group.ttl(str(user_id)) > 0:
         await bot.delete_msg(message_id=event.message_id)